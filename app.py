@@ -1,12 +1,15 @@
+import time
+_startup_started = time.perf_counter() # Before the other imports, so the startup report includes them
 import os
 import logging
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_migrate import Migrate # Import Migrate
+from flask_sock import Sock
 from sqlalchemy.orm import DeclarativeBase
-from ultralytics import YOLO # Import YOLO
 import secrets
+from startup import StartupTimer
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -18,9 +21,12 @@ class Base(DeclarativeBase):
 # Initialize extensions
 db = SQLAlchemy(model_class=Base)
 login_manager = LoginManager()
+sock = Sock() # WebSocket routes (livestream)
 
 # Create the Flask app
 app = Flask(__name__, instance_relative_config=True)
+startup_timer = StartupTimer(_startup_started)
+app.extensions['startup_timer'] = startup_timer
 
 # Define the base directory for the application
 # This ensures paths are relative to this file's location
@@ -31,22 +37,6 @@ logging.info(f"Application BASE_DIR: {BASE_DIR}")
 # Ensure your model file (e.g., best.pt) is in the 'models' directory
 YOLO_MODEL_NAME = "best.pt" # IMPORTANT: Change this if your model file has a different name
 YOLO_MODEL_PATH = os.environ.get("YOLO_MODEL_PATH", os.path.join(BASE_DIR, "models", YOLO_MODEL_NAME))
-yolo_model_global = None # Use a distinct name to avoid conflict with 'models' module
-
-try:
-    if os.path.exists(YOLO_MODEL_PATH):
-        logging.info(f"Attempting to load YOLO model from: {YOLO_MODEL_PATH}")
-        yolo_model_global = YOLO(YOLO_MODEL_PATH)
-        # Optional: Perform a dummy inference to ensure model is loaded and to "warm it up"
-        # This can also help catch issues early.
-        # yolo_model_global("https://ultralytics.com/images/bus.jpg", verbose=False) 
-        logging.info("YOLO model loaded successfully.")
-    else:
-        logging.error(f"YOLO model file not found at: {YOLO_MODEL_PATH}. Detection will not work with YOLO.")
-except Exception as e:
-    logging.error(f"Error loading YOLO model from {YOLO_MODEL_PATH}: {e}", exc_info=True)
-    yolo_model_global = None # Ensure it's None if loading failed
-
 # --- App Configuration ---
 
 # Secret key for session management
@@ -104,6 +94,20 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 app.config["UPLOAD_FOLDER"] = os.path.join(BASE_DIR, "static", "uploads")
 app.config["PROCESSED_FOLDER"] = os.path.join(BASE_DIR, "static", "processed_videos")
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max upload size
+# Larger files are sent in chunks (see chunked_upload.py); every chunk is one request below MAX_CONTENT_LENGTH
+app.config["UPLOAD_CHUNK_SIZE"] = int(os.environ.get("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024)) # Bytes per chunk
+app.config["UPLOAD_MAX_SIZE"] = int(os.environ.get("UPLOAD_MAX_SIZE", 2 * 1024 * 1024 * 1024)) # Max size of a chunked upload, bytes
+app.config["UPLOAD_PARTIAL_FOLDER"] = os.environ.get("UPLOAD_PARTIAL_FOLDER", os.path.join(app.instance_path, "partial_uploads")) # Same filesystem as UPLOAD_FOLDER, so finished uploads are renamed, not copied
+app.config["UPLOAD_PARTIAL_TTL"] = int(os.environ.get("UPLOAD_PARTIAL_TTL", 24 * 3600)) # Seconds an unfinished upload is kept for resuming
+
+# Thumbnails and video posters written next to uploads (see thumbnails.py)
+app.config["THUMBNAIL_SIZE"] = int(os.environ.get("THUMBNAIL_SIZE", 200)) # Max width/height in px; 0 = no thumbnails
+app.config["THUMBNAIL_FORMAT"] = os.environ.get("THUMBNAIL_FORMAT", "webp").lower() # webp or jpeg
+app.config["THUMBNAIL_QUALITY"] = int(os.environ.get("THUMBNAIL_QUALITY", 80)) # Encoder quality, 1-100
+from thumbnails import THUMBNAIL_FORMATS
+if app.config["THUMBNAIL_FORMAT"] not in THUMBNAIL_FORMATS:
+    logging.warning(f"Unknown THUMBNAIL_FORMAT '{app.config['THUMBNAIL_FORMAT']}'; using 'webp'.")
+    app.config["THUMBNAIL_FORMAT"] = "webp"
 
 # Create upload folder if it doesn't exist
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
@@ -111,21 +115,139 @@ os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 os.makedirs(app.config["PROCESSED_FOLDER"], exist_ok=True)
 logging.info(f"Ensured processed videos folder exists at: {app.config['PROCESSED_FOLDER']}")
 
+# Background video job queue (see job_queue.py)
+app.config["VIDEO_JOB_WORKERS"] = int(os.environ.get("VIDEO_JOB_WORKERS", 2)) # Worker processes running inference
+app.config["VIDEO_JOB_QUEUE_DEPTH"] = int(os.environ.get("VIDEO_JOB_QUEUE_DEPTH", 20)) # Max jobs waiting for a worker
+app.config["VIDEO_JOB_MAX_PER_USER"] = int(os.environ.get("VIDEO_JOB_MAX_PER_USER", 2)) # Max queued + running jobs per user
+app.config["VIDEO_JOB_RESULT_TTL"] = int(os.environ.get("VIDEO_JOB_RESULT_TTL", 3600)) # Seconds finished jobs stay queryable
+app.config["VIDEO_JOB_EVENT_BUFFER"] = int(os.environ.get("VIDEO_JOB_EVENT_BUFFER", 256)) # Recent events kept per job for /jobs/<id>/events
+app.config["VIDEO_JOB_EVENT_SEGMENT_FRAMES"] = int(os.environ.get("VIDEO_JOB_EVENT_SEGMENT_FRAMES", 30)) # Frames per detections event
+
+# Result cache for repeated uploads (see result_cache.py), keyed by file content and model version
+app.config["RESULT_CACHE_SIZE"] = int(os.environ.get("RESULT_CACHE_SIZE", 512)) # Cached uploads, LRU; 0 = no cache
+app.config["RESULT_CACHE_PHASH"] = os.environ.get("RESULT_CACHE_PHASH", "0") == "1" # Also match near-duplicate images
+app.config["RESULT_CACHE_PHASH_DISTANCE"] = int(os.environ.get("RESULT_CACHE_PHASH_DISTANCE", 4)) # Max differing dHash bits
+
+# Reports: server-rendered charts (see report_generator.render_chart) and exports (see report_export.py)
+app.config["REPORT_CHART_CACHE_SIZE"] = int(os.environ.get("REPORT_CHART_CACHE_SIZE", 64)) # Cached PNG charts, LRU; 0 = no cache
+app.config["REPORT_EXPORT_CHUNK_SIZE"] = int(os.environ.get("REPORT_EXPORT_CHUNK_SIZE", 5000)) # Rows fetched per chunk by /download_report
+
+# Frames per YOLO call when processing videos. Batching amortises the per-call overhead;
+# 8 is a good default for CPU inference, larger batches mostly just use more memory.
+app.config["VIDEO_BATCH_SIZE"] = int(os.environ.get("VIDEO_BATCH_SIZE", 8))
+# Capacity (in batches) of the bounded queues between the decode/infer/annotate/encode stages. With keyframe
+# sampling batches vary in length, so decoded frames in flight are also capped (at 3 x this x VIDEO_BATCH_SIZE).
+app.config["VIDEO_PIPELINE_QUEUE_SIZE"] = int(os.environ.get("VIDEO_PIPELINE_QUEUE_SIZE", 4))
+
+# Output of processed videos (see video_processing.py): 'mp4' is written by OpenCV and playable once complete;
+# 'fmp4' (fragmented MP4) and 'hls' (fMP4 segments + playlist, playable while the video is processed) are
+# encoded to H.264 by ffmpeg, with the preset/CRF/threads below. Without ffmpeg, 'mp4' is used.
+app.config["VIDEO_OUTPUT_FORMAT"] = os.environ.get("VIDEO_OUTPUT_FORMAT", "mp4") # mp4, fmp4 or hls
+app.config["FFMPEG_BINARY"] = os.environ.get("FFMPEG_BINARY", "ffmpeg") # Name on the PATH or full path
+app.config["VIDEO_ENCODER_PRESET"] = os.environ.get("VIDEO_ENCODER_PRESET", "veryfast") # libx264 preset; faster = less CPU, larger files
+app.config["VIDEO_ENCODER_CRF"] = int(os.environ.get("VIDEO_ENCODER_CRF", 23)) # libx264 quality, 0-51; lower = better, larger
+app.config["VIDEO_ENCODER_THREADS"] = int(os.environ.get("VIDEO_ENCODER_THREADS", 0)) # Encoder threads; 0 = automatic
+app.config["VIDEO_HLS_SEGMENT_SECONDS"] = int(os.environ.get("VIDEO_HLS_SEGMENT_SECONDS", 2)) # Segment/fragment length; also the keyframe interval
+
+# Detections are inserted in chunks of this many rows (one executemany + commit per chunk)
+app.config["DETECTION_INSERT_CHUNK_SIZE"] = int(os.environ.get("DETECTION_INSERT_CHUNK_SIZE", 1000))
+
+# Object tracking for videos (see tracking.py): one detection is stored per tracked object
+app.config["VIDEO_TRACKER_IOU_THRESHOLD"] = float(os.environ.get("VIDEO_TRACKER_IOU_THRESHOLD", 0.3)) # Min IoU to continue a track
+app.config["VIDEO_TRACKER_HIGH_CONF"] = float(os.environ.get("VIDEO_TRACKER_HIGH_CONF", 0.5)) # Detections that may start a track
+app.config["VIDEO_TRACKER_LOW_CONF"] = float(os.environ.get("VIDEO_TRACKER_LOW_CONF", 0.1)) # Detections that may only continue one
+app.config["VIDEO_TRACKER_MAX_AGE"] = int(os.environ.get("VIDEO_TRACKER_MAX_AGE", 30)) # Frames a track survives without a match
+app.config["VIDEO_TRACKER_MIN_HITS"] = int(os.environ.get("VIDEO_TRACKER_MIN_HITS", 2)) # Frames an object must be seen in to count
+
+# Keyframe sampling for videos (see frame_sampling.py); the sampling mode and stride can also be chosen per upload.
+# 'all' runs the model on every frame, 'stride' on every VIDEO_KEYFRAME_STRIDE-th frame and 'motion' when the
+# scene has changed by VIDEO_MOTION_THRESHOLD (or VIDEO_MAX_KEYFRAME_GAP frames have passed). Boxes of skipped
+# frames are interpolated between keyframes.
+app.config["VIDEO_SAMPLING_MODE"] = os.environ.get("VIDEO_SAMPLING_MODE", "all")
+app.config["VIDEO_KEYFRAME_STRIDE"] = int(os.environ.get("VIDEO_KEYFRAME_STRIDE", 5))
+app.config["VIDEO_MOTION_THRESHOLD"] = float(os.environ.get("VIDEO_MOTION_THRESHOLD", 0.02))
+app.config["VIDEO_MAX_KEYFRAME_GAP"] = int(os.environ.get("VIDEO_MAX_KEYFRAME_GAP", 30))
+
+# Inference backend (see inference.py). 'onnx' and 'openvino' need an export created with `flask export-model`;
+# without one the PyTorch model is used.
+app.config["INFERENCE_BACKEND"] = os.environ.get("INFERENCE_BACKEND", "pytorch") # pytorch, onnx or openvino
+app.config["INFERENCE_PRECISION"] = os.environ.get("INFERENCE_PRECISION", "fp32") # fp32; openvino also fp16 or int8
+app.config["EXPORTED_MODEL_FOLDER"] = os.environ.get("EXPORTED_MODEL_FOLDER", os.path.join(BASE_DIR, "models", "exported"))
+app.config["YOLO_MODEL_PATH"] = YOLO_MODEL_PATH
+
+# Micro-batching of livestream frames (see batching.py): frames of concurrent /process_frame requests are
+# collected for up to FRAME_BATCH_MAX_WAIT_MS and run through the model together. Stats: /process_frame/stats
+app.config["FRAME_BATCH_MAX_SIZE"] = int(os.environ.get("FRAME_BATCH_MAX_SIZE", 8)) # 1 = no batching
+app.config["FRAME_BATCH_MAX_WAIT_MS"] = float(os.environ.get("FRAME_BATCH_MAX_WAIT_MS", 5))
+# Upper limit for the livestream frame rate over the WebSocket; below it clients pace themselves by round-trip time
+app.config["LIVESTREAM_MAX_FPS"] = float(os.environ.get("LIVESTREAM_MAX_FPS", 15))
+# Motion gating of livestream frames (see motion_gate.py): while a stream's scene has changed by less than
+# LIVESTREAM_MOTION_THRESHOLD since the last inferred frame, its last detections are returned instead of running
+# the model, for at most LIVESTREAM_MAX_GATED_FRAMES frames in a row.
+app.config["LIVESTREAM_MOTION_THRESHOLD"] = float(os.environ.get("LIVESTREAM_MOTION_THRESHOLD", 0.01)) # 0 = no gating
+app.config["LIVESTREAM_MAX_GATED_FRAMES"] = int(os.environ.get("LIVESTREAM_MAX_GATED_FRAMES", 30))
+
+# Shared inference server (see inference_server.py): with INFERENCE_SERVER_SOCKET set, the model is not loaded in
+# this process; images are sent to the `flask inference-server` process(es) listening on the given socket path(s).
+app.config["INFERENCE_SERVER_SOCKET"] = os.environ.get("INFERENCE_SERVER_SOCKET") # Comma-separated for several servers
+app.config["INFERENCE_SERVER_TIMEOUT"] = float(os.environ.get("INFERENCE_SERVER_TIMEOUT", 5.0)) # Seconds per image
+app.config["INFERENCE_SERVER_FALLBACK"] = os.environ.get("INFERENCE_SERVER_FALLBACK", "1") == "1" # Load the model locally if no server answers
+# Load the model and run a dummy inference before serving (main.py) and in video workers,
+# instead of on the first request
+app.config["MODEL_WARMUP"] = os.environ.get("MODEL_WARMUP", "1") == "1"
+# Optional file the startup timing report is appended to (one JSON line per process start)
+app.config["STARTUP_TIMING_LOG"] = os.environ.get("STARTUP_TIMING_LOG")
+
 # Initialize Flask-Migrate
-migrate = Migrate(app, db)
+MIGRATIONS_DIR = os.path.join(BASE_DIR, "migrations")
+migrate = Migrate(app, db, directory=MIGRATIONS_DIR)
+
+
+def init_schema():
+    """
+    Creates the tables of an empty database and checks the revision of an existing one.
+
+    The schema of an existing database is owned by the migrations (`flask db upgrade`);
+    creating tables here would make the migrations that add them fail. An empty
+    database is created from the models and stamped with the latest revision.
+    """
+    from sqlalchemy import inspect
+    from alembic.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+    from flask_migrate import stamp
+
+    if not inspect(db.engine).get_table_names():
+        db.create_all()
+        stamp(directory=MIGRATIONS_DIR)
+        logging.info("Created the database tables and stamped them with the latest migration.")
+        return
+
+    with db.engine.connect() as connection:
+        current_heads = set(MigrationContext.configure(connection).get_current_heads())
+    script_heads = set(ScriptDirectory.from_config(migrate.get_config(MIGRATIONS_DIR)).get_heads())
+    if current_heads != script_heads:
+        logging.warning(
+            f"The database is at migration {', '.join(sorted(current_heads)) or 'none'}, "
+            f"not {', '.join(sorted(script_heads))}. Run `flask db upgrade` before serving requests."
+        )
+
 
 # Import models and routes (after initializing extensions)
 with app.app_context():
-    import models
-    # Make the loaded YOLO model accessible within the application context if needed,
-    # or directly in routes by importing yolo_model_global from app.
-    app.yolo_model = yolo_model_global
-    import routes
+    with startup_timer.phase('import_models'):
+        import models
+    with startup_timer.phase('import_routes'):
+        import routes
+        import commands # Registers the flask CLI commands
     
     # Initialize extensions with the app
     db.init_app(app)
     login_manager.init_app(app)
     login_manager.login_view = 'login' # Redirect to 'login' view if @login_required fails
+    sock.init_app(app)
     
-    # Create database tables
-    db.create_all()
+    # Create the tables of a new database; existing ones are upgraded with `flask db upgrade`
+    with startup_timer.phase('init_schema'):
+        init_schema()
+
+startup_timer.log(app.config["STARTUP_TIMING_LOG"])
@@ -0,0 +1,179 @@
+"""
+Dynamic micro-batching for single-frame requests (/process_frame).
+
+Concurrent requests put their frame on a queue and wait. A scheduler thread takes the
+oldest frame, collects more frames until it has `max_batch_size` of them or the oldest
+one has waited `max_wait_ms`, runs one batched model call and hands each request its
+own result. Larger batches make better use of the model at the cost of queue wait;
+BatchStats records both so the two limits can be tuned.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+import numpy as np
+from flask import current_app
+from inference import get_inference_backend # type: ignore
+
+logger = logging.getLogger(__name__)
+
+_batcher_lock = threading.Lock()
+
+
+class BatchStats:
+    """
+    Statistics of a MicroBatcher: batch-size histogram and, over the last `window`
+    requests/batches, queue wait, model time per batch and end-to-end request latency.
+    """
+
+    def __init__(self, max_batch_size, window=1000):
+        self.requests = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.batch_size_histogram = [0] * (max_batch_size + 1) # Index = batch size
+        self._queue_wait = deque(maxlen=window)
+        self._inference = deque(maxlen=window)
+        self._latency = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record_batch(self, queue_waits, inference_seconds, failed=False):
+        with self._lock:
+            self.batches += 1
+            self.failed_batches += int(failed)
+            self.batch_size_histogram[len(queue_waits)] += 1
+            self._queue_wait.extend(queue_waits)
+            self._inference.append(inference_seconds)
+
+    def record_request(self, latency_seconds):
+        with self._lock:
+            self.requests += 1
+            self._latency.append(latency_seconds)
+
+    def to_dict(self):
+        with self._lock:
+            histogram = list(self.batch_size_histogram)
+            total_frames = sum(size * count for size, count in enumerate(histogram))
+            return {
+                'requests': self.requests,
+                'batches': self.batches,
+                'failed_batches': self.failed_batches,
+                'mean_batch_size': round(total_frames / self.batches, 2) if self.batches else None,
+                'batch_size_histogram': {str(size): count for size, count in enumerate(histogram) if count},
+                'queue_wait_ms': _percentiles_ms(self._queue_wait),
+                'inference_ms': _percentiles_ms(self._inference),
+                'latency_ms': _percentiles_ms(self._latency),
+            }
+
+def _percentiles_ms(samples):
+    if not samples:
+        return None
+    p50, p95, p99 = np.percentile(np.fromiter(samples, float), [50, 95, 99]) * 1000
+    return {'p50': round(p50, 2), 'p95': round(p95, 2), 'p99': round(p99, 2), 'max': round(max(samples) * 1000, 2)}
+
+
+class _PendingFrame:
+    __slots__ = ('image', 'enqueued', 'done', 'result', 'error')
+
+    def __init__(self, image):
+        self.image = image
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Runs single-image predictions from concurrent callers as batched model calls.
+
+    Usage:
+        detections = batcher.predict(image) # Blocks until the frame's batch has run
+    """
+
+    def __init__(self, inference_backend, max_batch_size=8, max_wait_ms=5.0, timeout=30.0):
+        self.inference_backend = inference_backend
+        self.max_batch_size = max(int(max_batch_size), 1)
+        self.max_wait = max_wait_ms / 1000.0
+        self.timeout = timeout
+        self.stats = BatchStats(self.max_batch_size)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def predict(self, image):
+        """
+        Detects objects in one image (see InferenceBackend.predict).
+
+        Returns:
+            DetectionBatch of the image
+        """
+        pending = _PendingFrame(image)
+        self._ensure_thread()
+        self._queue.put(pending)
+        if not pending.done.wait(self.timeout):
+            raise TimeoutError(f"Frame was not processed within {self.timeout}s.")
+        self.stats.record_request(time.perf_counter() - pending.enqueued)
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._thread_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='frame-batcher', daemon=True)
+                    self._thread.start()
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = batch[0].enqueued + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                # Frames already waiting are always taken, even once the deadline has passed
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.perf_counter()
+            queue_waits = [started - pending.enqueued for pending in batch]
+            failed = False
+            try:
+                results = self.inference_backend.predict([pending.image for pending in batch])
+                for pending, detections in zip(batch, results):
+                    pending.result = detections
+            except Exception as e:
+                logger.error(f"Batched inference of {len(batch)} frame(s) failed: {e}", exc_info=True)
+                failed = True
+                for pending in batch:
+                    pending.error = e
+            self.stats.record_batch(queue_waits, time.perf_counter() - started, failed)
+            for pending in batch:
+                pending.done.set()
+
+
+def get_frame_batcher():
+    """
+    Returns the app's MicroBatcher for livestream frames, creating it on first use.
+
+    Returns:
+        MicroBatcher, or None if the model could not be loaded
+    """
+    extensions = current_app.extensions
+    if 'frame_batcher' not in extensions:
+        inference_backend = get_inference_backend()
+        if inference_backend is None:
+            return None
+        with _batcher_lock:
+            if 'frame_batcher' not in extensions:
+                extensions['frame_batcher'] = MicroBatcher(
+                    inference_backend,
+                    max_batch_size=current_app.config['FRAME_BATCH_MAX_SIZE'],
+                    max_wait_ms=current_app.config['FRAME_BATCH_MAX_WAIT_MS'],
+                )
+    return extensions['frame_batcher']
@@ -0,0 +1,271 @@
+"""
+Chunked, resumable uploads.
+
+Large files (e.g. drone or bodycam videos) are sent in chunks of UPLOAD_CHUNK_SIZE
+bytes, one request each, so no request exceeds MAX_CONTENT_LENGTH and an interrupted
+upload can be resumed: the client asks which chunks the server already has and only
+sends the missing ones.
+
+Every upload lives in UPLOAD_PARTIAL_FOLDER as three files:
+    <id>.json   - who uploads which file (written once, when the upload starts)
+    <id>.part   - the file itself, preallocated to its full size; each chunk is written
+                  at its offset, so chunks may arrive in any order and in parallel
+    <id>.chunks - one "<index> <sha256>" line per chunk that was completely written
+A chunk is only listed once its bytes are on disk and match the SHA-256 the client sent,
+so the listed chunks are exactly those that need not be sent again. The state is kept on
+disk, so uploads survive restarts and work with several web processes.
+
+When all chunks are there, the .part file is renamed into the upload folder (no copy as
+long as both folders are on the same filesystem) and processed like a regular upload.
+Uploads that see no activity for UPLOAD_PARTIAL_TTL seconds are deleted.
+"""
+import errno
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Same formats as UploadForm accepts
+ALLOWED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.mp4', '.avi', '.mov')
+
+_UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+_COPY_BLOCK_SIZE = 1024 * 1024
+_CLEANUP_INTERVAL = 60 # Seconds between sweeps for stale uploads
+
+_store_lock = threading.Lock()
+
+
+class ChunkedUploadError(Exception):
+    """Raised for chunked upload requests that can't be served; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class ChunkedUploadStore:
+    """
+    Partial uploads in a folder on disk (see the module docstring for the layout).
+
+    All methods that take an upload id also take the id of the requesting user, and
+    treat uploads of other users as not found.
+    """
+
+    def __init__(self, folder, chunk_size, max_size, ttl):
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.ttl = ttl
+        self._last_cleanup = 0
+        self._cleanup_lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, upload_id, extension):
+        if not _UPLOAD_ID_PATTERN.match(upload_id):
+            raise ChunkedUploadError("Upload not found.", 404)
+        return os.path.join(self.folder, upload_id + extension)
+
+    def create(self, user_id, filename, size):
+        """
+        Starts an upload of `size` bytes.
+
+        Returns:
+            Status dictionary of the new upload (see status())
+        """
+        extension = os.path.splitext(filename)[1].lower()
+        if extension not in ALLOWED_EXTENSIONS:
+            raise ChunkedUploadError(f"Unsupported file format: {extension or filename}.", 415)
+        if size <= 0:
+            raise ChunkedUploadError("The file is empty.")
+        if size > self.max_size:
+            raise ChunkedUploadError(f"The file is larger than {self.max_size // (1024 * 1024)} MB.", 413)
+        self.remove_stale()
+
+        upload_id = uuid.uuid4().hex
+        with open(self._path(upload_id, '.part'), 'wb') as part_file:
+            part_file.truncate(size)
+        open(self._path(upload_id, '.chunks'), 'a').close()
+        metadata = {
+            'user_id': user_id,
+            'filename': filename,
+            'size': size,
+            'chunk_size': self.chunk_size,
+            'created': time.time(),
+        }
+        metadata_path = self._path(upload_id, '.json')
+        with open(metadata_path + '.tmp', 'w') as metadata_file:
+            json.dump(metadata, metadata_file)
+        os.replace(metadata_path + '.tmp', metadata_path) # The upload exists once its metadata does
+        logger.info(f"Started chunked upload {upload_id} of {filename} ({size} bytes) for user {user_id}.")
+        return self._status(upload_id, metadata)
+
+    def get(self, upload_id, user_id):
+        """Metadata of an upload of the user; raises ChunkedUploadError (404) if there is none."""
+        try:
+            with open(self._path(upload_id, '.json')) as metadata_file:
+                metadata = json.load(metadata_file)
+        except FileNotFoundError:
+            raise ChunkedUploadError("Upload not found.", 404) from None
+        if metadata['user_id'] != user_id:
+            raise ChunkedUploadError("Upload not found.", 404)
+        return metadata
+
+    def received_chunks(self, upload_id):
+        """Indexes of the chunks that were written and verified, mapped to their SHA-256."""
+        try:
+            with open(self._path(upload_id, '.chunks')) as chunks_file:
+                lines = chunks_file.read().splitlines()
+        except FileNotFoundError:
+            return {}
+        received = {}
+        for line in lines:
+            index, _, checksum = line.partition(' ')
+            if checksum: # A line cut short by a crash is ignored; the chunk is sent again
+                received[int(index)] = checksum
+        return received
+
+    def status(self, upload_id, user_id):
+        return self._status(upload_id, self.get(upload_id, user_id))
+
+    def _status(self, upload_id, metadata):
+        return {
+            'upload_id': upload_id,
+            'filename': metadata['filename'],
+            'size': metadata['size'],
+            'chunk_size': metadata['chunk_size'],
+            'chunk_count': _chunk_count(metadata),
+            'received': sorted(self.received_chunks(upload_id)),
+        }
+
+    def write_chunk(self, upload_id, user_id, index, stream, checksum=None):
+        """
+        Writes chunk `index`, read from the binary `stream`, at its offset in the file.
+
+        Args:
+            checksum: SHA-256 (hex) of the chunk as computed by the client; if given and
+                the received bytes don't match it, the chunk is not recorded
+
+        Returns:
+            SHA-256 (hex) of the received chunk (of the first copy, if it was received before)
+        """
+        metadata = self.get(upload_id, user_id)
+        if not 0 <= index < _chunk_count(metadata):
+            raise ChunkedUploadError(f"Chunk {index} is out of range.")
+        received_checksum = self.received_chunks(upload_id).get(index)
+        if received_checksum is not None:
+            # Sent again, e.g. a retry whose first response was lost: keep the verified bytes
+            return received_checksum
+        offset = index * metadata['chunk_size']
+        length = min(metadata['chunk_size'], metadata['size'] - offset)
+
+        digest = hashlib.sha256()
+        try:
+            with open(self._path(upload_id, '.part'), 'r+b') as part_file:
+                part_file.seek(offset)
+                remaining = length
+                while remaining:
+                    block = stream.read(min(remaining, _COPY_BLOCK_SIZE))
+                    if not block:
+                        break
+                    digest.update(block)
+                    part_file.write(block)
+                    remaining -= len(block)
+                if remaining or stream.read(1):
+                    raise ChunkedUploadError(f"Chunk {index} must be exactly {length} bytes.")
+                part_file.flush()
+                os.fsync(part_file.fileno()) # On disk before it is listed as received
+        except FileNotFoundError:
+            raise ChunkedUploadError("Upload not found.", 404) from None
+
+        received_checksum = digest.hexdigest()
+        if checksum and checksum.lower() != received_checksum:
+            raise ChunkedUploadError(f"Checksum mismatch in chunk {index}; send it again.", 422)
+        # One short line per chunk, appended in a single write: safe with parallel chunks
+        with open(self._path(upload_id, '.chunks'), 'a') as chunks_file:
+            chunks_file.write(f"{index} {received_checksum}\n")
+        return received_checksum
+
+    def finish(self, upload_id, user_id, destination_path):
+        """
+        Moves the complete file to `destination_path` and forgets the upload.
+
+        Returns:
+            Metadata of the upload
+        """
+        metadata = self.get(upload_id, user_id)
+        missing = _chunk_count(metadata) - len(self.received_chunks(upload_id))
+        if missing:
+            raise ChunkedUploadError(f"The upload is missing {missing} chunk(s).", 409)
+        part_path = self._path(upload_id, '.part')
+        try:
+            os.replace(part_path, destination_path)
+        except FileNotFoundError:
+            raise ChunkedUploadError("Upload not found.", 404) from None
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            logger.warning("UPLOAD_PARTIAL_FOLDER is on another filesystem than the upload folder; copying the upload.")
+            shutil.move(part_path, destination_path)
+        self._remove(upload_id)
+        logger.info(f"Finished chunked upload {upload_id} as {destination_path}.")
+        return metadata
+
+    def discard(self, upload_id, user_id):
+        self.get(upload_id, user_id)
+        self._remove(upload_id)
+
+    def _remove(self, upload_id):
+        for extension in ('.json', '.chunks', '.part'):
+            try:
+                os.remove(self._path(upload_id, extension))
+            except FileNotFoundError:
+                pass
+
+    def remove_stale(self):
+        """Deletes uploads without activity for `ttl` seconds (at most once a minute)."""
+        now = time.time()
+        with self._cleanup_lock:
+            if now - self._last_cleanup < _CLEANUP_INTERVAL:
+                return
+            self._last_cleanup = now
+        for name in os.listdir(self.folder):
+            upload_id, extension = os.path.splitext(name)
+            if extension != '.part' or not _UPLOAD_ID_PATTERN.match(upload_id):
+                continue
+            try:
+                last_activity = max(os.path.getmtime(os.path.join(self.folder, upload_id + suffix))
+                                    for suffix in ('.part', '.chunks'))
+            except OSError:
+                last_activity = 0
+            if now - last_activity > self.ttl:
+                logger.info(f"Removing stale chunked upload {upload_id}.")
+                self._remove(upload_id)
+
+
+def _chunk_count(metadata):
+    return -(-metadata['size'] // metadata['chunk_size'])
+
+
+def get_upload_store():
+    """Returns the app's ChunkedUploadStore, creating it on first use."""
+    from flask import current_app
+
+    extensions = current_app.extensions
+    if 'chunked_uploads' not in extensions:
+        config = current_app.config
+        with _store_lock:
+            if 'chunked_uploads' not in extensions:
+                extensions['chunked_uploads'] = ChunkedUploadStore(
+                    config['UPLOAD_PARTIAL_FOLDER'],
+                    chunk_size=config['UPLOAD_CHUNK_SIZE'],
+                    max_size=config['UPLOAD_MAX_SIZE'],
+                    ttl=config['UPLOAD_PARTIAL_TTL'],
+                )
+    return extensions['chunked_uploads']
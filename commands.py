@@ -0,0 +1,215 @@
+import json
+import os
+import shutil
+import tempfile
+import click
+from flask import current_app
+from app import app, db # type: ignore
+from detections import match_detections, rebuild_daily_rollups # type: ignore
+from inference import (BACKEND_PYTORCH, EXPORT_PRECISIONS, check_parity, export_model, get_inference_backend, # type: ignore
+                       load_configured_backend, load_inference_backend, warmup_inference_backend)
+from thumbnails import IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, generate_thumbnails, is_derived_file # type: ignore
+
+# Commands import OpenCV (video_processing, frame_sampling) and PIL when they run:
+# this module is imported on every app start, including `flask db upgrade`.
+
+# Number of recent uploads used for the parity check when no sample images are given
+PARITY_SAMPLE_IMAGES = 8
+
+
+@app.cli.command('export-model')
+@click.option('--backend', type=click.Choice(list(EXPORT_PRECISIONS)), default=None,
+              help='Defaults to INFERENCE_BACKEND.')
+@click.option('--precision', type=click.Choice(['fp32', 'fp16', 'int8']), default=None,
+              help='Defaults to INFERENCE_PRECISION.')
+@click.option('--imgsz', type=int, default=640, help='Input size of the exported graph.')
+@click.option('--data', 'calibration_data', default=None, help='Dataset YAML for INT8 calibration.')
+@click.option('--sample', 'samples', multiple=True, type=click.Path(exists=True, dir_okay=False),
+              help='Image for the parity check (repeatable). Defaults to recent uploads.')
+@click.option('--min-agreement', type=float, default=0.95, show_default=True,
+              help='Share of boxes that must match the PyTorch model.')
+@click.option('--force', is_flag=True, help='Re-export even if a cached export exists.')
+def export_model_command(backend, precision, imgsz, calibration_data, samples, min_agreement, force):
+    """
+    Exports the YOLO checkpoint for ONNX Runtime or OpenVINO and checks it against PyTorch.
+
+    The export is cached in EXPORTED_MODEL_FOLDER and used on the next start when
+    INFERENCE_BACKEND/INFERENCE_PRECISION select it. An export whose detections on the
+    sample images disagree with the PyTorch model is deleted again.
+    """
+    config = current_app.config
+    backend = backend or config['INFERENCE_BACKEND']
+    precision = precision or config['INFERENCE_PRECISION']
+    if backend == BACKEND_PYTORCH:
+        raise click.ClickException("Choose a backend to export to with --backend (onnx or openvino).")
+    if precision not in EXPORT_PRECISIONS[backend]:
+        raise click.ClickException(f"Backend '{backend}' supports: {', '.join(EXPORT_PRECISIONS[backend])}.")
+    model_path = config['YOLO_MODEL_PATH']
+    if not os.path.exists(model_path):
+        raise click.ClickException(f"YOLO model file not found at: {model_path}")
+
+    artifact_path, exported = export_model(
+        model_path, backend, precision, config['EXPORTED_MODEL_FOLDER'],
+        imgsz=imgsz, calibration_data=calibration_data, force=force)
+    click.echo(f"{'Exported' if exported else 'Cached'} {backend} ({precision}) model: {artifact_path}")
+
+    sample_paths = list(samples) or _recent_upload_images(PARITY_SAMPLE_IMAGES)
+    if not sample_paths:
+        click.echo("No sample images for the parity check (pass --sample or upload some images); skipped.")
+        return
+    from PIL import Image
+    reference = load_inference_backend(model_path)
+    candidate = load_inference_backend(model_path, backend, precision, config['EXPORTED_MODEL_FOLDER'])
+    if reference is None or candidate is None or candidate.name != backend:
+        raise click.ClickException("Could not load the models for the parity check.")
+    images = [Image.open(path).convert("RGB") for path in sample_paths]
+    parity = check_parity(reference, candidate, images)
+    click.echo(f"Parity on {parity['images']} image(s): {parity['matched_boxes']} of "
+               f"{parity['reference_boxes']} (PyTorch) / {parity['candidate_boxes']} ({backend}) boxes match, "
+               f"agreement {parity['agreement']:.3f}, mean IoU {parity['mean_iou'] or 0:.3f}, "
+               f"max confidence diff {parity['max_confidence_diff'] or 0:.3f}")
+    if parity['agreement'] < min_agreement:
+        if os.path.isdir(artifact_path):
+            shutil.rmtree(artifact_path)
+        else:
+            os.remove(artifact_path)
+        os.remove(artifact_path + '.json')
+        raise click.ClickException(f"Agreement below {min_agreement}; the export was removed.")
+
+
+def _recent_upload_images(limit):
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    paths = [os.path.join(upload_folder, name) for name in os.listdir(upload_folder)
+             if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS and not is_derived_file(name)]
+    return sorted(paths, key=os.path.getmtime, reverse=True)[:limit]
+
+
+@app.cli.command('inference-server')
+@click.option('--socket', 'socket_path', default=None,
+              help='Unix socket to listen on. Defaults to the first path in INFERENCE_SERVER_SOCKET.')
+def inference_server(socket_path):
+    """Loads the model and serves it to the web and video workers over a Unix socket."""
+    from inference_server import InferenceServer
+
+    socket_path = socket_path or (current_app.config['INFERENCE_SERVER_SOCKET'] or '').split(',')[0]
+    if not socket_path:
+        raise click.ClickException("Pass --socket or set INFERENCE_SERVER_SOCKET.")
+    with current_app.extensions['startup_timer'].phase('model_load'):
+        inference_backend = load_configured_backend(current_app.config)
+    inference_backend = warmup_inference_backend(inference_backend)
+    if inference_backend is None:
+        raise click.ClickException("YOLO model could not be loaded.")
+    server = InferenceServer(socket_path, inference_backend)
+    click.echo(f"Serving {inference_backend.name} ({inference_backend.precision}) model on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@app.cli.command('startup-report')
+@click.option('--warmup', is_flag=True, help='Also load and warm up the model.')
+def startup_report(warmup):
+    """Prints how long this process took to start, per phase, and which heavy modules it loaded."""
+    if warmup:
+        warmup_inference_backend()
+    click.echo(json.dumps(current_app.extensions['startup_timer'].report(), indent=2))
+
+
+@app.cli.command('benchmark-video')
+@click.argument('video_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--stride', type=int, default=None, help='Keyframe stride for the stride mode.')
+@click.option('--motion-threshold', type=float, default=None, help='Motion threshold for the motion mode.')
+@click.option('--batch-size', type=int, default=None, help='Frames per model call.')
+def benchmark_video(video_path, stride, motion_threshold, batch_size):
+    """
+    Processes a video once per sampling mode and prints throughput and recall.
+
+    Recall is measured against the 'all' mode: the share of its boxes that are matched
+    (same class, IoU >= 0.5) by the boxes of the same frame in the other mode.
+    """
+    from frame_sampling import SAMPLING_MODES, KeyframeSelector
+    from video_processing import process_video
+
+    config = current_app.config
+    inference_backend = get_inference_backend()
+    if inference_backend is None:
+        raise click.ClickException("YOLO model is not loaded.")
+
+    reference = None
+    click.echo(f"{'mode':<8} {'frames':>7} {'keyframes':>10} {'fps':>8} {'recall':>7}")
+    for mode in SAMPLING_MODES:
+        selector = KeyframeSelector(
+            mode,
+            stride=stride or config['VIDEO_KEYFRAME_STRIDE'],
+            motion_threshold=motion_threshold if motion_threshold is not None else config['VIDEO_MOTION_THRESHOLD'],
+            max_gap=config['VIDEO_MAX_KEYFRAME_GAP'],
+        )
+        frames = {}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result = process_video(
+                inference_backend, os.path.abspath(video_path), os.path.join(tmp_dir, 'benchmark.mp4'),
+                batch_size=batch_size or config['VIDEO_BATCH_SIZE'],
+                queue_size=config['VIDEO_PIPELINE_QUEUE_SIZE'],
+                detections_callback=lambda frame_index, detections: frames.__setitem__(frame_index, detections),
+                keyframe_selector=selector,
+            )
+        if reference is None:
+            reference = frames
+        recall = _recall(reference, frames)
+        click.echo(f"{mode:<8} {result['frames_processed']:>7} {result['keyframes']:>10} "
+                   f"{result['processing_fps']:>8.1f} {recall:>7.3f}")
+
+
+def _recall(reference, frames, iou_threshold=0.5):
+    matched = total = 0
+    for frame_index, expected in reference.items():
+        total += len(expected)
+        found = frames.get(frame_index)
+        if found is not None:
+            pairs, _ = match_detections(expected, found, iou_threshold)
+            matched += len(pairs)
+    return matched / total if total else 1.0
+
+
+@app.cli.command('rebuild-rollups')
+@click.option('--user-id', type=int, default=None, help='Only rebuild the rollup of this user.')
+def rebuild_rollups(user_id):
+    """
+    Recomputes the daily detection rollup (used by the reports) from all detections.
+
+    The rollup is kept up to date when detections are saved; run this after changing
+    detection_result by other means, e.g. deleting or importing rows.
+    """
+    with db.engine.begin() as connection:
+        rows = rebuild_daily_rollups(connection, user_id)
+    click.echo(f"Rebuilt the daily rollup: {rows} row(s).")
+
+
+@app.cli.command('generate-thumbnails')
+@click.option('--force', is_flag=True, help='Regenerate thumbnails even if they are up to date.')
+def generate_thumbnails_command(force):
+    """
+    Writes the thumbnails and video posters of all uploads that don't have current ones.
+
+    Uploads get them when they are uploaded; run this once to backfill uploads from
+    before, or with --force after changing THUMBNAIL_SIZE/THUMBNAIL_FORMAT. Running it
+    again only processes new or changed uploads.
+    """
+    config = current_app.config
+    if config['THUMBNAIL_SIZE'] <= 0:
+        raise click.ClickException("Thumbnails are disabled (THUMBNAIL_SIZE=0).")
+    upload_folder = config['UPLOAD_FOLDER']
+    done = failed = 0
+    for name in sorted(os.listdir(upload_folder)):
+        if is_derived_file(name) or os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS + VIDEO_EXTENSIONS:
+            continue
+        paths = generate_thumbnails(os.path.join(upload_folder, name), config['THUMBNAIL_SIZE'],
+                                    config['THUMBNAIL_FORMAT'], config['THUMBNAIL_QUALITY'], force=force)
+        if paths is None:
+            failed += 1
+        else:
+            done += 1
+    click.echo(f"Thumbnails up to date for {done} upload(s); {failed} could not be read.")
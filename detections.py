@@ -0,0 +1,462 @@
+import logging
+from datetime import datetime
+import numpy as np
+from flask import current_app
+from sqlalchemy import bindparam, case, func, insert, select
+from app import db # type: ignore
+from models import DetectionDailyRollup, DetectionResult, VideoFrameDetection # type: ignore
+from tracking import greedy_match # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+def get_model_class_names(yolo_model):
+    """
+    Returns the class-id -> name mapping of a loaded YOLO model, falling back to
+    generic names if the model does not expose any.
+    """
+    if hasattr(yolo_model, 'names') and yolo_model.names:
+        return yolo_model.names
+    return {i: f'class_{i}' for i in range(80)}
+
+class DetectionBatch:
+    """
+    Columnar detections of one frame/image (or several concatenated frames).
+
+    Boxes, confidences and class ids are kept as NumPy arrays; dictionaries are only
+    built at the JSON boundary by to_dicts().
+
+    Attributes:
+        xyxy: float32 array of shape (N, 4) with x1, y1, x2, y2 pixel coordinates
+        conf: float32 array of shape (N,)
+        cls: int32 array of shape (N,)
+        names: Class-id -> name mapping of the model
+        masks_xy: For segmentation models, a list of N (K, 2) polygon arrays, else None
+    """
+    __slots__ = ('xyxy', 'conf', 'cls', 'names', 'masks_xy')
+
+    def __init__(self, xyxy, conf, cls, names, masks_xy=None):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+        self.names = names
+        self.masks_xy = masks_xy
+
+    @classmethod
+    def empty(cls, names):
+        return cls(np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int32), names)
+
+    @classmethod
+    def concatenate(cls, batches, names):
+        """Joins the detections of several frames into one batch."""
+        batches = [batch for batch in batches if len(batch)]
+        if not batches:
+            return cls.empty(names)
+        masks_xy = None
+        if all(batch.masks_xy is not None for batch in batches):
+            masks_xy = [polygon for batch in batches for polygon in batch.masks_xy]
+        return cls(
+            np.concatenate([batch.xyxy for batch in batches]),
+            np.concatenate([batch.conf for batch in batches]),
+            np.concatenate([batch.cls for batch in batches]),
+            names,
+            masks_xy,
+        )
+
+    def __len__(self):
+        return len(self.conf)
+
+    def scaled(self, scale_x, scale_y):
+        """Detections with coordinates multiplied by the given factors, e.g. to map them back from a downscaled frame."""
+        if scale_x == 1 and scale_y == 1:
+            return self
+        factors = np.array([scale_x, scale_y], np.float32)
+        masks_xy = None
+        if self.masks_xy is not None:
+            masks_xy = [polygon * factors for polygon in self.masks_xy]
+        return DetectionBatch(self.xyxy * np.tile(factors, 2), self.conf, self.cls, self.names, masks_xy)
+
+    def bbox_xywh(self):
+        """Integer x, y, width, height boxes, shape (N, 4)."""
+        xywh = np.empty((len(self), 4), np.int32)
+        xywh[:, :2] = self.xyxy[:, :2]
+        xywh[:, 2:] = self.xyxy[:, 2:] - self.xyxy[:, :2]
+        return xywh
+
+    def trash_types(self):
+        """Class name of every detection."""
+        return [self.names.get(class_id, f"Class_{class_id}") for class_id in self.cls.tolist()]
+
+    def to_rows(self):
+        """Compact form for the livestream socket: [x, y, width, height, confidence, class_id] per detection."""
+        return [
+            [x, y, w, h, round(confidence, 3), class_id]
+            for (x, y, w, h), confidence, class_id in zip(
+                self.bbox_xywh().tolist(), self.conf.tolist(), self.cls.tolist())
+        ]
+
+    def to_dicts(self):
+        """Converts the detections into the JSON format used by the API and frontend."""
+        detections = []
+        masks_xy = self.masks_xy
+        for i, (trash_type, confidence, (x, y, w, h)) in enumerate(
+                zip(self.trash_types(), self.conf.tolist(), self.bbox_xywh().tolist())):
+            detection = {
+                "trash_type": trash_type,
+                "confidence": confidence,
+                "bbox": {"x": x, "y": y, "width": w, "height": h},
+            }
+            if masks_xy is not None:
+                detection["mask_xy"] = np.rint(masks_xy[i]).astype(np.int32).tolist()
+            detections.append(detection)
+        return detections
+
+
+def match_detections(first, second, iou_threshold=0.5):
+    """
+    Matches the boxes of two DetectionBatches one-to-one, greedily by IoU (best first),
+    only pairing boxes of the same class.
+
+    Returns:
+        Tuple (pairs, ious): list of (index in first, index in second) and their IoUs
+    """
+    return greedy_match(first.xyxy, first.cls, second.xyxy, second.cls, iou_threshold)
+
+
+def parse_yolo_results_for_db(yolo_output_list, model_class_names):
+    """
+    Parses the output from a YOLO model (ultralytics format) into a DetectionBatch.
+
+    Boxes, confidences and classes are moved to the CPU with one transfer each for the
+    whole frame instead of one per box. Segmentation masks (results.masks) are kept as
+    polygons when the model provides them.
+    """
+    if not yolo_output_list or not yolo_output_list[0]: # yolo_output_list is a list of Results objects
+        logger.debug("parse_yolo_results_for_db: yolo_output_list is empty or invalid.")
+        return DetectionBatch.empty(model_class_names)
+
+    results = yolo_output_list[0]  # Process the first (and usually only) Results object
+
+    boxes_data = results.boxes # This is a Boxes object
+    if boxes_data is None:
+        logger.warning("parse_yolo_results_for_db: No 'boxes' attribute in YOLO results.")
+        return DetectionBatch.empty(model_class_names)
+
+    if not hasattr(boxes_data, 'xyxy') or not hasattr(boxes_data, 'conf') or not hasattr(boxes_data, 'cls'):
+        logger.warning("parse_yolo_results_for_db: YOLO results.boxes object missing xyxy, conf, or cls attributes.")
+        return DetectionBatch.empty(model_class_names)
+
+    if len(boxes_data) == 0:
+        return DetectionBatch.empty(model_class_names)
+
+    xyxy = _to_numpy(boxes_data.xyxy).astype(np.float32, copy=False).reshape(-1, 4)
+    conf = _to_numpy(boxes_data.conf).astype(np.float32, copy=False).reshape(-1)
+    cls = _to_numpy(boxes_data.cls).astype(np.int32).reshape(-1)
+
+    masks_xy = None
+    masks = getattr(results, 'masks', None)
+    if masks is not None and masks.xy is not None and len(masks.xy) == len(conf):
+        masks_xy = [np.asarray(polygon, dtype=np.float32) for polygon in masks.xy]
+
+    logger.debug(f"parse_yolo_results_for_db: Parsed {len(conf)} detections.")
+    return DetectionBatch(xyxy, conf, cls, model_class_names, masks_xy)
+
+def _to_numpy(values):
+    # Results may hold torch tensors (PyTorch backend) or plain NumPy arrays (exported models)
+    if hasattr(values, 'cpu'):
+        values = values.cpu().numpy()
+    return np.asarray(values)
+
+class _ChunkedTableWriter:
+    """
+    Base class for writers that insert rows into one table in fixed-size chunks.
+
+    Rows are buffered as plain mappings and inserted with a single Core executemany
+    per chunk, each chunk in its own transaction, so results reach the database while
+    later frames are still being processed and no ORM objects are kept around. The
+    writer uses its own connection from the engine, so it may be fed from a thread
+    without an app context (e.g. the video encode stage).
+    """
+    table = None
+
+    def __init__(self, chunk_size=None):
+        self.chunk_size = chunk_size or current_app.config['DETECTION_INSERT_CHUNK_SIZE']
+        self.rows_written = 0
+        self._engine = db.engine
+        self._rows = []
+
+    def _add_rows(self, rows):
+        self._rows.extend(rows)
+        while len(self._rows) >= self.chunk_size:
+            self._write_chunk(self._rows[:self.chunk_size])
+            del self._rows[:self.chunk_size]
+
+    def flush(self):
+        if self._rows:
+            self._write_chunk(self._rows)
+            self._rows = []
+
+    def _write_chunk(self, rows):
+        with self._engine.begin() as connection:
+            connection.execute(insert(self.table), rows)
+            self._after_insert(connection, rows)
+        self.rows_written += len(rows)
+        logger.debug(f"{type(self).__name__}: inserted {len(rows)} rows ({self.rows_written} total).")
+
+    def _after_insert(self, connection, rows):
+        """Hook for subclasses to update derived tables in the chunk's transaction."""
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Rows of frames that were fully processed are kept even if processing failed later
+        self.flush()
+        return False
+
+
+class DetectionWriter(_ChunkedTableWriter):
+    """
+    Writes detections to the detection_result table in chunks.
+
+    Usage:
+        with DetectionWriter(user_id, image_path) as writer:
+            writer.add(detections)
+
+    Every chunk also updates the daily rollup (see update_daily_rollups) in the same
+    transaction, so the rollup always matches the committed detections.
+    """
+    table = DetectionResult.__table__
+
+    def __init__(self, user_id, image_path, chunk_size=None):
+        super().__init__(chunk_size)
+        self.user_id = user_id
+        self.image_path = image_path
+
+    def add(self, detections):
+        """Buffers a DetectionBatch, flushing every time a full chunk is collected."""
+        if not len(detections):
+            return
+        detection_date = datetime.utcnow()
+        self._add_rows(
+            {
+                "user_id": self.user_id,
+                "image_path": self.image_path, # For videos, the path to the original uploaded video
+                "trash_type": trash_type,
+                "confidence": confidence,
+                "detection_date": detection_date,
+                "bbox_x": x,
+                "bbox_y": y,
+                "bbox_width": w,
+                "bbox_height": h,
+            }
+            for trash_type, confidence, (x, y, w, h) in zip(
+                detections.trash_types(), detections.conf.tolist(), detections.bbox_xywh().tolist())
+        )
+
+
+    def add_tracked_objects(self, video_id, fps, tracks, names):
+        """
+        Buffers one row per tracked video object (see tracking.Track), holding the box
+        and confidence of the object's best detection and when it was first/last seen.
+        """
+        detection_date = datetime.utcnow()
+        rows = []
+        for track in tracks:
+            x1, y1, x2, y2 = track.best_xyxy.tolist()
+            rows.append({
+                "user_id": self.user_id,
+                "image_path": self.image_path,
+                "trash_type": names.get(track.cls, f"Class_{track.cls}"),
+                "confidence": float(track.best_conf),
+                "detection_date": detection_date,
+                "bbox_x": int(x1),
+                "bbox_y": int(y1),
+                "bbox_width": int(x2 - x1),
+                "bbox_height": int(y2 - y1),
+                "video_id": video_id,
+                "track_id": track.track_id,
+                "first_seen_ms": int(round(track.first_frame * 1000 / fps)),
+                "last_seen_ms": int(round(track.last_frame * 1000 / fps)),
+            })
+        self._add_rows(rows)
+
+    def add_object_dicts(self, video_id, objects):
+        """
+        Buffers one row per tracked video object given as tracking.Track.to_dict()
+        dictionaries, e.g. the cached result of an earlier upload of the same video.
+        """
+        detection_date = datetime.utcnow()
+        self._add_rows(
+            {
+                "user_id": self.user_id,
+                "image_path": self.image_path,
+                "trash_type": obj["trash_type"],
+                "confidence": obj["confidence"],
+                "detection_date": detection_date,
+                "bbox_x": obj["bbox"]["x"],
+                "bbox_y": obj["bbox"]["y"],
+                "bbox_width": obj["bbox"]["width"],
+                "bbox_height": obj["bbox"]["height"],
+                "video_id": video_id,
+                "track_id": obj["track_id"],
+                "first_seen_ms": int(round(obj["first_seen"] * 1000)),
+                "last_seen_ms": int(round(obj["last_seen"] * 1000)),
+            }
+            for obj in objects
+        )
+
+
+    def _after_insert(self, connection, rows):
+        update_daily_rollups(connection, rows)
+
+
+def update_daily_rollups(connection, rows):
+    """
+    Adds detection_result rows (mappings as inserted by DetectionWriter) to the
+    detection_daily_rollup totals, with one upsert per (user, day, trash type).
+    """
+    totals = {}
+    for row in rows:
+        key = (row["user_id"], row["detection_date"].date(), row["trash_type"])
+        total = totals.get(key)
+        if total is None:
+            totals[key] = [1, row["confidence"], row["confidence"], row["detection_date"]]
+        else:
+            total[0] += 1
+            total[1] += row["confidence"]
+            total[2] = max(total[2], row["confidence"])
+            total[3] = max(total[3], row["detection_date"])
+    if not totals:
+        return
+    values = [
+        {"user_id": user_id, "day": day, "trash_type": trash_type, "count": count,
+         "confidence_sum": confidence_sum, "confidence_max": confidence_max, "last_detection_date": last_date}
+        for (user_id, day, trash_type), (count, confidence_sum, confidence_max, last_date) in totals.items()
+    ]
+
+    table = DetectionDailyRollup.__table__
+    dialect = connection.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        statement = upsert(table)
+        excluded = statement.excluded
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.day, table.c.trash_type],
+            set_={
+                "count": table.c.count + excluded.count,
+                "confidence_sum": table.c.confidence_sum + excluded.confidence_sum,
+                "confidence_max": case((excluded.confidence_max > table.c.confidence_max, excluded.confidence_max),
+                                       else_=table.c.confidence_max),
+                "last_detection_date": case((excluded.last_detection_date > table.c.last_detection_date,
+                                             excluded.last_detection_date), else_=table.c.last_detection_date),
+            },
+        ), values)
+        return
+
+    # Other databases: update existing groups, insert the new ones
+    key_columns = (table.c.user_id == bindparam("b_user_id")) & (table.c.day == bindparam("b_day")) \
+        & (table.c.trash_type == bindparam("b_trash_type"))
+    update_statement = table.update().where(key_columns).values(
+        count=table.c.count + bindparam("b_count"),
+        confidence_sum=table.c.confidence_sum + bindparam("b_confidence_sum"),
+        confidence_max=case((bindparam("b_confidence_max") > table.c.confidence_max, bindparam("b_confidence_max")),
+                            else_=table.c.confidence_max),
+        last_detection_date=case((bindparam("b_last_detection_date") > table.c.last_detection_date,
+                                  bindparam("b_last_detection_date")), else_=table.c.last_detection_date),
+    )
+    for value in values:
+        result = connection.execute(update_statement, {f"b_{name}": item for name, item in value.items()})
+        if not result.rowcount:
+            connection.execute(insert(table), value)
+
+
+def rebuild_daily_rollups(connection, user_id=None):
+    """
+    Recomputes detection_daily_rollup from detection_result (for one user, or all).
+
+    Returns:
+        Number of rollup rows written
+    """
+    table = DetectionDailyRollup.__table__
+    detections = DetectionResult.__table__
+    day = func.date(detections.c.detection_date)
+    query = select(
+        detections.c.user_id, day, detections.c.trash_type, func.count(), func.sum(detections.c.confidence),
+        func.max(detections.c.confidence), func.max(detections.c.detection_date),
+    ).where(detections.c.detection_date.isnot(None)).group_by(detections.c.user_id, day, detections.c.trash_type)
+    delete_statement = table.delete()
+    if user_id is not None:
+        query = query.where(detections.c.user_id == user_id)
+        delete_statement = delete_statement.where(table.c.user_id == user_id)
+    connection.execute(delete_statement)
+    result = connection.execute(table.insert().from_select(
+        ["user_id", "day", "trash_type", "count", "confidence_sum", "confidence_max", "last_detection_date"], query))
+    return result.rowcount
+
+
+class VideoFrameWriter(_ChunkedTableWriter):
+    """
+    Writes the per-frame detections of a video to the video_frame_detection table,
+    one row per frame that has detections, with the boxes packed into one column.
+    """
+    table = VideoFrameDetection.__table__
+
+    def __init__(self, video_id, fps, chunk_size=None):
+        super().__init__(chunk_size)
+        self.video_id = video_id
+        self.fps = fps
+
+    def add(self, frame_index, detections):
+        """Buffers the DetectionBatch of one frame."""
+        if not len(detections):
+            return
+        self._add_rows([{
+            "video_id": self.video_id,
+            "frame_index": frame_index,
+            "timestamp_ms": int(round(frame_index * 1000 / self.fps)),
+            "box_count": len(detections),
+            "boxes": pack_frame_boxes(detections),
+        }])
+
+
+# Packed layout of one box in VideoFrameDetection.boxes (24 bytes, little-endian)
+FRAME_BOX_DTYPE = np.dtype([
+    ('x1', '<f4'), ('y1', '<f4'), ('x2', '<f4'), ('y2', '<f4'), ('conf', '<f4'), ('cls', '<i4'),
+])
+
+def pack_frame_boxes(detections):
+    """Packs the boxes of a DetectionBatch into bytes for VideoFrameDetection.boxes."""
+    packed = np.empty(len(detections), FRAME_BOX_DTYPE)
+    packed['x1'], packed['y1'], packed['x2'], packed['y2'] = detections.xyxy.T
+    packed['conf'] = detections.conf
+    packed['cls'] = detections.cls
+    return packed.tobytes()
+
+def unpack_frame_boxes(boxes, names):
+    """Inverse of pack_frame_boxes: returns a DetectionBatch."""
+    packed = np.frombuffer(boxes, FRAME_BOX_DTYPE)
+    xyxy = np.stack([packed['x1'], packed['y1'], packed['x2'], packed['y2']], axis=1).astype(np.float32)
+    return DetectionBatch(xyxy, packed['conf'].astype(np.float32), packed['cls'].astype(np.int32), names)
+
+
+def save_detection_results(user_id, image_path, detections):
+    """
+    Saves the detections of one uploaded file to the database.
+
+    Args:
+        user_id: ID of the user who uploaded the file
+        image_path: Path of the upload relative to the 'static' folder
+        detections: DetectionBatch as returned by parse_yolo_results_for_db
+    """
+    if not len(detections): # Only attempt to save if there are results
+        current_app.logger.info("No detections found by YOLO, nothing to save to database for this file.")
+        return
+
+    with DetectionWriter(user_id, image_path) as writer:
+        writer.add(detections)
+    current_app.logger.info(f"{writer.rows_written} detections committed to database.")
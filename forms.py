@@ -1,7 +1,7 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed, FileRequired
-from wtforms import StringField, PasswordField, SubmitField, BooleanField, TextAreaField
-from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError
+from wtforms import StringField, PasswordField, SubmitField, BooleanField, TextAreaField, SelectField, IntegerField, FloatField
+from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, Optional, NumberRange
 from models import User
 
 class LoginForm(FlaskForm):
@@ -35,7 +35,20 @@ class RegistrationForm(FlaskForm):
 #     submit = SubmitField('Upload')
 
 # d:\PRATHMESH NIKAM\Downloads\VS\OceanWasteTracker(devesh)\OceanWasteTracker\forms.py
-class UploadForm(FlaskForm):
+class UploadOptionsForm(FlaskForm):
+    """Processing options of an upload; on its own, it finishes a chunked upload."""
+    # Video only: which frames get full detection (throughput vs. recall)
+    sampling_mode = SelectField('Frame Sampling', choices=[
+        ('', 'Server default'),
+        ('all', 'Every frame (best recall)'),
+        ('stride', 'Every Nth frame'),
+        ('motion', 'When the scene changes (fastest)')
+    ], default='')
+    keyframe_stride = IntegerField('Detect Every N Frames', validators=[Optional(), NumberRange(min=1, max=120)])
+    motion_threshold = FloatField('Motion Threshold', validators=[Optional(), NumberRange(min=0, max=1)])
+
+
+class UploadForm(UploadOptionsForm):
     file = FileField('Choose File', validators=[
         FileRequired(),
         FileAllowed(['jpg', 'jpeg', 'png', 'mp4', 'avi', 'mov'], 'Images and videos only!')
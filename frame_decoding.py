@@ -0,0 +1,121 @@
+"""
+Fast decoding of livestream frames straight to the model's input resolution.
+
+A 1280x720 canvas JPEG is much larger than the model input (imgsz, e.g. 640), so a
+full decode is mostly wasted work. FrameDecoder reads the image size from the JPEG/PNG
+header, decodes with the largest IMREAD_REDUCED_* factor that keeps the frame at least
+imgsz on its long side (for JPEG the reduction happens in the DCT, which is far faster
+than decoding at full size) and, if needed, resizes into a reused buffer so the long
+side is exactly imgsz. The model's letterbox then only pads the frame. Frames stay BGR,
+which is what ultralytics expects for NumPy arrays.
+
+The returned scale maps boxes back to the coordinates of the frame as it was sent.
+"""
+import struct
+import threading
+import numpy as np
+from flask import current_app
+from inference import get_inference_backend # type: ignore
+
+_decoder_lock = threading.Lock()
+
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def encoded_image_size(data):
+    """
+    Reads (width, height) from the header of a JPEG or PNG image without decoding it.
+
+    Returns:
+        Tuple (width, height), or None for other formats or a malformed header
+    """
+    if data[:8] == _PNG_SIGNATURE and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+    if data[:2] != b'\xff\xd8':
+        return None
+    # Walk the JPEG segments up to the start-of-frame segment, which holds the size
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF: # Fill byte
+            offset += 1
+            continue
+        segment_length, = struct.unpack('>H', data[offset + 2:offset + 4])
+        if marker in _JPEG_SOF_MARKERS and offset + 9 <= len(data):
+            height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + segment_length
+    return None
+
+
+class FrameDecoder:
+    """
+    Decodes encoded frames to (at most) the model input size. Thread-safe; resize
+    buffers are kept per thread and reused for frames of the same size, so a decoded
+    frame is only valid until the same thread decodes its next frame.
+    """
+
+    def __init__(self, imgsz):
+        import cv2 # Imported on first use to keep app startup fast
+        self._cv2 = cv2
+        self.imgsz = imgsz
+        self._reduced_flags = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                               (2, cv2.IMREAD_REDUCED_COLOR_2))
+        self._local = threading.local()
+
+    def decode(self, frame_bytes):
+        """
+        Returns:
+            Tuple (image_bgr, (scale_x, scale_y)); multiply box coordinates by the scale
+            to map them to the original frame. (None, None) if the frame can't be decoded.
+        """
+        cv2 = self._cv2
+        size = encoded_image_size(frame_bytes)
+        flags = cv2.IMREAD_COLOR
+        if size is not None:
+            long_side = max(size)
+            for factor, reduced_flag in self._reduced_flags:
+                if long_side // factor >= self.imgsz:
+                    flags = reduced_flag
+                    break
+        image = cv2.imdecode(np.frombuffer(frame_bytes, np.uint8), flags)
+        if image is None:
+            return None, None
+        if size is None:
+            size = (image.shape[1], image.shape[0])
+
+        height, width = image.shape[:2]
+        if max(width, height) > self.imgsz:
+            ratio = self.imgsz / max(width, height)
+            target = (max(round(width * ratio), 1), max(round(height * ratio), 1))
+            image = cv2.resize(image, target, dst=self._buffer(target), interpolation=cv2.INTER_AREA)
+        return image, (size[0] / image.shape[1], size[1] / image.shape[0])
+
+    def _buffer(self, target):
+        buffers = self._local.__dict__.setdefault('buffers', {})
+        key = (target[1], target[0])
+        if key not in buffers:
+            buffers.clear() # Only keep the buffer of the current frame size
+            buffers[key] = np.empty((target[1], target[0], 3), np.uint8)
+        return buffers[key]
+
+
+def get_frame_decoder():
+    """
+    Returns the app's FrameDecoder, sized for the model's input, creating it on first use.
+
+    Returns:
+        FrameDecoder, or None if the model could not be loaded
+    """
+    extensions = current_app.extensions
+    if 'frame_decoder' not in extensions:
+        inference_backend = get_inference_backend()
+        if inference_backend is None:
+            return None
+        with _decoder_lock:
+            if 'frame_decoder' not in extensions:
+                extensions['frame_decoder'] = FrameDecoder(inference_backend.imgsz)
+    return extensions['frame_decoder']
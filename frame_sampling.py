@@ -0,0 +1,99 @@
+import cv2
+import numpy as np
+from detections import DetectionBatch, match_detections # type: ignore
+
+# Sampling modes for video processing
+SAMPLING_ALL = 'all'        # Run the model on every frame
+SAMPLING_STRIDE = 'stride'  # Run the model on every Nth frame
+SAMPLING_MOTION = 'motion'  # Run the model when the scene has changed enough
+SAMPLING_MODES = (SAMPLING_ALL, SAMPLING_STRIDE, SAMPLING_MOTION)
+
+# Size of the grayscale thumbnail used for the motion score
+MOTION_THUMBNAIL_SIZE = (64, 36)
+
+
+class KeyframeSelector:
+    """
+    Decides which decoded frames are keyframes, i.e. get full model inference.
+
+    In 'stride' mode every `stride`-th frame is a keyframe. In 'motion' mode a frame is
+    a keyframe when the mean absolute difference between a tiny grayscale thumbnail of
+    it and of the last keyframe (0..1) reaches `motion_threshold`, or when `max_gap`
+    frames have passed since the last keyframe. The first frame is always a keyframe.
+    """
+
+    def __init__(self, mode=SAMPLING_ALL, stride=5, motion_threshold=0.02, max_gap=30):
+        if mode not in SAMPLING_MODES:
+            raise ValueError(f"Unknown sampling mode: {mode}")
+        self.mode = mode
+        self.stride = max(int(stride), 1)
+        self.motion_threshold = motion_threshold
+        self.max_gap = max(int(max_gap), 1)
+        self._frames_since_keyframe = None
+        self._keyframe_thumbnail = None
+
+    @property
+    def max_frames_between_keyframes(self):
+        if self.mode == SAMPLING_ALL:
+            return 1
+        return self.stride if self.mode == SAMPLING_STRIDE else self.max_gap
+
+    def is_keyframe(self, frame_bgr):
+        if self.mode == SAMPLING_ALL:
+            return True
+
+        first_frame = self._frames_since_keyframe is None
+        if self.mode == SAMPLING_STRIDE:
+            keyframe = first_frame or self._frames_since_keyframe + 1 >= self.stride
+        else:
+            thumbnail = cv2.resize(cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY), MOTION_THUMBNAIL_SIZE,
+                                   interpolation=cv2.INTER_AREA)
+            keyframe = (first_frame
+                        or self._frames_since_keyframe + 1 >= self.max_gap
+                        or motion_score(thumbnail, self._keyframe_thumbnail) >= self.motion_threshold)
+            if keyframe:
+                self._keyframe_thumbnail = thumbnail
+
+        self._frames_since_keyframe = 0 if keyframe else self._frames_since_keyframe + 1
+        return keyframe
+
+
+def motion_score(thumbnail, previous_thumbnail):
+    """Mean absolute difference of two grayscale thumbnails, scaled to 0..1."""
+    return float(cv2.absdiff(thumbnail, previous_thumbnail).mean()) / 255.0
+
+
+def interpolate_detections(start, end, fraction, iou_threshold=0.1):
+    """
+    Estimates the detections of a skipped frame between two keyframes.
+
+    Boxes of the same class that overlap between the two keyframes are treated as the
+    same object and linearly interpolated. Objects only present in the first keyframe
+    are kept for the first half of the gap, objects only present in the second one
+    appear for the second half.
+
+    Args:
+        start: DetectionBatch of the previous keyframe
+        end: DetectionBatch of the next keyframe
+        fraction: Position of the skipped frame between the keyframes (0 < fraction < 1)
+    """
+    pairs, _ = match_detections(start, end, iou_threshold)
+    used_start = {i for i, _ in pairs}
+    used_end = {j for _, j in pairs}
+
+    xyxy, conf, cls = [], [], []
+    for i, j in pairs:
+        xyxy.append(start.xyxy[i] + (end.xyxy[j] - start.xyxy[i]) * fraction)
+        conf.append(min(start.conf[i], end.conf[j]))
+        cls.append(start.cls[i])
+    unmatched, source = ((set(range(len(start))) - used_start), start) if fraction < 0.5 \
+        else ((set(range(len(end))) - used_end), end)
+    for k in sorted(unmatched):
+        xyxy.append(source.xyxy[k])
+        conf.append(source.conf[k])
+        cls.append(source.cls[k])
+
+    if not xyxy:
+        return DetectionBatch.empty(start.names)
+    return DetectionBatch(np.array(xyxy, np.float32), np.array(conf, np.float32),
+                          np.array(cls, np.int32), start.names)
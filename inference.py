@@ -0,0 +1,300 @@
+"""
+Inference backends for the YOLO model.
+
+The model can run with PyTorch (the .pt checkpoint) or from a graph exported with
+`flask export-model` for ONNX Runtime or OpenVINO, which is usually much faster on
+CPU-only machines. Exported graphs are cached in the models/exported folder, each with a
+small JSON file recording which checkpoint they were exported from, so a changed
+best.pt is detected and the stale export is not used.
+
+All backends are loaded through ultralytics, so pre- and post-processing (letterbox,
+NMS) is the same for each of them and the results parse the same way.
+
+ultralytics (and with it PyTorch) is only imported when a model is loaded or exported,
+and the app loads the model on first use or in an explicit warmup (see
+warmup_inference_backend), so app startup and CLI commands don't pay for it.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from functools import partial
+import numpy as np
+from flask import current_app
+from detections import get_model_class_names, match_detections, parse_yolo_results_for_db # type: ignore
+
+logger = logging.getLogger(__name__)
+
+BACKEND_PYTORCH = 'pytorch'
+BACKEND_ONNX = 'onnx'
+BACKEND_OPENVINO = 'openvino'
+
+# Precisions each exportable backend supports. ultralytics only exports FP16 ONNX
+# graphs on a GPU, so reduced precision on CPU is offered through OpenVINO.
+EXPORT_PRECISIONS = {
+    BACKEND_ONNX: ('fp32',),
+    BACKEND_OPENVINO: ('fp32', 'fp16', 'int8'),
+}
+BACKENDS = (BACKEND_PYTORCH,) + tuple(EXPORT_PRECISIONS)
+
+# Input size assumed when the model does not record the size it was trained with
+DEFAULT_IMGSZ = 640
+
+_load_lock = threading.Lock()
+
+
+class InferenceBackend:
+    """
+    A loaded YOLO model for one runtime.
+
+    Attributes:
+        name: Backend name ('pytorch', 'onnx' or 'openvino')
+        precision: 'fp32', 'fp16' or 'int8'
+        model_path: Path of the checkpoint or exported artifact the model was loaded from
+        names: Class-id -> name mapping of the model
+        imgsz: Input size the model was trained/exported with
+    """
+
+    def __init__(self, model, name, precision, model_path):
+        self.model = model
+        self.name = name
+        self.precision = precision
+        self.model_path = model_path
+        self.names = get_model_class_names(model)
+        imgsz = (getattr(model, 'overrides', None) or {}).get('imgsz') or DEFAULT_IMGSZ
+        self.imgsz = int(max(imgsz) if isinstance(imgsz, (list, tuple)) else imgsz)
+
+    def predict(self, images):
+        """
+        Runs detection on a list of images (PIL images or NumPy arrays) in one call.
+
+        Returns:
+            List with one DetectionBatch per image, in input order
+        """
+        if not images:
+            return []
+        raw_results = self.model(list(images), verbose=False)
+        return [parse_yolo_results_for_db([image_results], self.names) for image_results in raw_results]
+
+    def __repr__(self):
+        return f"<InferenceBackend {self.name} {self.precision} {self.model_path}>"
+
+
+def exported_model_path(model_path, backend, precision, export_folder):
+    """Path of the cached export of `model_path` for a backend and precision."""
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    if backend == BACKEND_ONNX:
+        return os.path.join(export_folder, f"{stem}_{precision}.onnx")
+    return os.path.join(export_folder, f"{stem}_{precision}_openvino_model")
+
+def file_sha256(path):
+    """Hex SHA-256 digest of a file, read in 1 MiB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _read_export_info(artifact_path):
+    try:
+        with open(artifact_path + '.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_export_current(model_path, artifact_path):
+    """True if the artifact exists and was exported from the current checkpoint."""
+    info = _read_export_info(artifact_path)
+    return (info is not None and os.path.exists(artifact_path)
+            and info.get('source_sha256') == file_sha256(model_path))
+
+
+def export_model(model_path, backend, precision, export_folder, imgsz=640, calibration_data=None, force=False):
+    """
+    Exports a YOLO checkpoint for ONNX Runtime or OpenVINO and caches the result.
+
+    Nothing is exported if an export of the same checkpoint (by content hash) already
+    exists, unless `force` is set.
+
+    Args:
+        model_path: Path of the .pt checkpoint
+        backend: 'onnx' or 'openvino'
+        precision: One of EXPORT_PRECISIONS[backend]
+        export_folder: Folder holding the cached exports
+        imgsz: Input size of the exported graph
+        calibration_data: Dataset YAML used to calibrate INT8 quantization
+        force: Re-export even if a current export exists
+
+    Returns:
+        Tuple (artifact_path, exported), `exported` being False for a cache hit
+    """
+    if precision not in EXPORT_PRECISIONS.get(backend, ()):
+        raise ValueError(f"Backend '{backend}' does not support precision '{precision}'.")
+    artifact_path = exported_model_path(model_path, backend, precision, export_folder)
+    if not force and is_export_current(model_path, artifact_path):
+        logger.info(f"Using cached {backend} export: {artifact_path}")
+        return artifact_path, False
+
+    export_args = {'format': backend, 'imgsz': imgsz, 'dynamic': True} # Dynamic batch for batched video inference
+    if precision == 'fp16':
+        export_args['half'] = True
+    elif precision == 'int8':
+        export_args['int8'] = True
+        if calibration_data:
+            export_args['data'] = calibration_data
+    logger.info(f"Exporting {model_path} with {export_args}")
+    from ultralytics import YOLO
+    exported_path = YOLO(model_path).export(**export_args)
+
+    # ultralytics writes the export next to the checkpoint; move it into the cache
+    os.makedirs(export_folder, exist_ok=True)
+    if os.path.isdir(artifact_path):
+        shutil.rmtree(artifact_path)
+    elif os.path.exists(artifact_path):
+        os.remove(artifact_path)
+    shutil.move(str(exported_path), artifact_path)
+    with open(artifact_path + '.json', 'w') as f:
+        json.dump({
+            'source': os.path.basename(model_path),
+            'source_sha256': file_sha256(model_path),
+            'backend': backend,
+            'precision': precision,
+            'imgsz': imgsz,
+        }, f, indent=2)
+    logger.info(f"Exported model cached at {artifact_path}")
+    return artifact_path, True
+
+
+def load_inference_backend(model_path, backend=BACKEND_PYTORCH, precision='fp32', export_folder=None):
+    """
+    Loads the model for the configured backend.
+
+    If the exported artifact for an ONNX/OpenVINO backend is missing or was exported
+    from a different checkpoint, the PyTorch model is loaded instead.
+
+    Returns:
+        InferenceBackend, or None if the model could not be loaded
+    """
+    if backend not in BACKENDS:
+        logger.error(f"Unknown inference backend '{backend}', using '{BACKEND_PYTORCH}'.")
+        backend = BACKEND_PYTORCH
+    if not os.path.exists(model_path):
+        logger.error(f"YOLO model file not found at: {model_path}. Detection will not work with YOLO.")
+        return None
+
+    load_path = model_path
+    if backend != BACKEND_PYTORCH:
+        artifact_path = exported_model_path(model_path, backend, precision, export_folder)
+        if is_export_current(model_path, artifact_path):
+            load_path = artifact_path
+        else:
+            logger.warning(f"No current {backend} ({precision}) export of {model_path}; "
+                           f"run 'flask export-model' to create it. Falling back to PyTorch.")
+            backend, precision = BACKEND_PYTORCH, 'fp32'
+
+    try:
+        logger.info(f"Attempting to load YOLO model ({backend}, {precision}) from: {load_path}")
+        from ultralytics import YOLO
+        model = YOLO(load_path)
+        logger.info("YOLO model loaded successfully.")
+    except Exception as e:
+        logger.error(f"Error loading YOLO model from {load_path}: {e}", exc_info=True)
+        return None
+    return InferenceBackend(model, backend, precision, load_path)
+
+
+def load_configured_backend(config):
+    """Loads the model in this process as configured by INFERENCE_BACKEND/INFERENCE_PRECISION."""
+    return load_inference_backend(
+        config['YOLO_MODEL_PATH'],
+        config['INFERENCE_BACKEND'],
+        config['INFERENCE_PRECISION'],
+        config['EXPORTED_MODEL_FOLDER'],
+    )
+
+def get_inference_backend():
+    """
+    Returns the app's inference backend, created on first use.
+
+    If INFERENCE_SERVER_SOCKET is set this is an inference_server.InferenceClient, which
+    sends the images to the inference server(s) and only loads the model in this process
+    as a fallback (INFERENCE_SERVER_FALLBACK). Otherwise the model is loaded here.
+
+    Returns:
+        InferenceBackend or InferenceClient, or None if the model could not be loaded
+    """
+    extensions = current_app.extensions
+    if 'inference_backend' not in extensions:
+        with _load_lock:
+            if 'inference_backend' not in extensions:
+                config = current_app.config
+                if config['INFERENCE_SERVER_SOCKET']:
+                    from inference_server import InferenceClient
+                    fallback = partial(load_configured_backend, config) if config['INFERENCE_SERVER_FALLBACK'] else None
+                    extensions['inference_backend'] = InferenceClient(
+                        config['INFERENCE_SERVER_SOCKET'].split(','),
+                        timeout=config['INFERENCE_SERVER_TIMEOUT'],
+                        fallback=fallback,
+                    )
+                else:
+                    with extensions['startup_timer'].phase('model_load'):
+                        extensions['inference_backend'] = load_configured_backend(config)
+    return extensions['inference_backend']
+
+def warmup_inference_backend(inference_backend=None):
+    """
+    Loads the model and runs one inference on a blank image, so that the first real
+    request doesn't pay for lazy initialisation in the runtime (memory allocation,
+    graph compilation), then logs the startup timing report. With an inference server
+    this checks the connection to it instead.
+
+    Args:
+        inference_backend: Backend to warm up; defaults to get_inference_backend()
+
+    Returns:
+        The backend, or None if the model could not be loaded
+    """
+    inference_backend = inference_backend or get_inference_backend()
+    timer = current_app.extensions['startup_timer']
+    if inference_backend is not None:
+        with timer.phase('model_warmup'):
+            inference_backend.predict([np.zeros((inference_backend.imgsz, inference_backend.imgsz, 3), np.uint8)])
+    timer.log(current_app.config['STARTUP_TIMING_LOG'])
+    return inference_backend
+
+
+def check_parity(reference, candidate, images, iou_threshold=0.5):
+    """
+    Compares the detections of two backends on the same images.
+
+    Boxes are matched one-to-one within the same class by IoU, so the agreement is the
+    share of boxes of each side found by the other (1.0 = identical detections).
+
+    Returns:
+        Dictionary with the box counts, agreement, mean IoU of the matched boxes and the
+        largest confidence difference of a matched pair
+    """
+    reference_boxes = candidate_boxes = matched = 0
+    ious, conf_diffs = [], []
+    for image in images:
+        expected, = reference.predict([image])
+        found, = candidate.predict([image])
+        reference_boxes += len(expected)
+        candidate_boxes += len(found)
+        pairs, pair_ious = match_detections(expected, found, iou_threshold)
+        matched += len(pairs)
+        ious.extend(pair_ious)
+        conf_diffs.extend(abs(float(expected.conf[i]) - float(found.conf[j])) for i, j in pairs)
+
+    total_boxes = max(reference_boxes, candidate_boxes)
+    return {
+        'images': len(images),
+        'reference_boxes': reference_boxes,
+        'candidate_boxes': candidate_boxes,
+        'matched_boxes': matched,
+        'agreement': matched / total_boxes if total_boxes else 1.0,
+        'mean_iou': float(np.mean(ious)) if ious else None,
+        'max_confidence_diff': max(conf_diffs) if conf_diffs else None,
+    }
@@ -0,0 +1,285 @@
+"""
+Out-of-process inference server and its client.
+
+`flask inference-server` starts a process that owns the model and serves detection
+requests over a Unix socket. Web workers (and video worker processes) then use an
+InferenceClient instead of loading their own copy of the model, so the number of web
+workers can be scaled without duplicating model weights in memory. Several servers can
+be run on different sockets; clients spread requests over them.
+
+Wire format (both directions): a 4-byte big-endian header length, a JSON header and
+the raw payload. Requests carry the images as raw uint8 pixel buffers, which are sent
+straight from the arrays' memory and received into a reused buffer that the server
+wraps with np.frombuffer, so pixels are not serialised or copied in between. Responses
+carry the boxes packed as in VideoFrameDetection.boxes (see detections.FRAME_BOX_DTYPE).
+"""
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+import numpy as np
+from detections import FRAME_BOX_DTYPE, DetectionBatch, pack_frame_boxes, unpack_frame_boxes # type: ignore
+
+logger = logging.getLogger(__name__)
+
+_HEADER_LENGTH = struct.Struct('>I')
+
+# After a failed request, servers are skipped (and the fallback used) for this many seconds
+SERVER_RETRY_INTERVAL = 5.0
+
+
+class InferenceServerError(Exception):
+    """Raised when the inference server cannot be reached or a request to it fails."""
+    pass
+
+
+class InferenceRequestError(InferenceServerError):
+    """Raised when the inference server answers a request with an error, e.g. for a bad image."""
+    pass
+
+
+def _recv_exactly(sock, view):
+    received = 0
+    while received < len(view):
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("Connection closed by peer.")
+        received += count
+
+def _send_message(sock, header, buffers=()):
+    header_bytes = json.dumps(header).encode()
+    sock.sendall(_HEADER_LENGTH.pack(len(header_bytes)) + header_bytes)
+    for buffer in buffers:
+        sock.sendall(buffer)
+
+def _recv_header(sock):
+    length = bytearray(_HEADER_LENGTH.size)
+    _recv_exactly(sock, memoryview(length))
+    header = bytearray(_HEADER_LENGTH.unpack(length)[0])
+    _recv_exactly(sock, memoryview(header))
+    return json.loads(header)
+
+def _image_array(image):
+    """uint8 HxWx3 array of an image, with the channel order the model expects for it."""
+    if isinstance(image, np.ndarray):
+        return np.ascontiguousarray(image, dtype=np.uint8)
+    # ultralytics reads PIL images as RGB and arrays as BGR
+    return np.ascontiguousarray(np.asarray(image.convert('RGB'))[:, :, ::-1])
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.buffer = bytearray() # Reused for the pixels of every request on this connection
+
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                header = _recv_header(self.request)
+            except (ConnectionError, OSError):
+                return
+            except ValueError as e:
+                logger.warning(f"Closing connection after a malformed request header: {e}")
+                return
+            payload_received = False
+            try:
+                if header.get('op') == 'info':
+                    _send_message(self.request, server.info)
+                    continue
+
+                shapes = [tuple(shape) for shape in header['shapes']]
+                total = sum(int(np.prod(shape)) for shape in shapes)
+                if len(self.buffer) < total:
+                    self.buffer = bytearray(total)
+                view = memoryview(self.buffer)
+                _recv_exactly(self.request, view[:total])
+                payload_received = True
+                images, offset = [], 0
+                for shape in shapes:
+                    size = int(np.prod(shape))
+                    images.append(np.frombuffer(self.buffer, np.uint8, size, offset).reshape(shape))
+                    offset += size
+
+                with server.model_lock:
+                    results = server.inference_backend.predict(images)
+                packed = [pack_frame_boxes(detections) for detections in results]
+                _send_message(self.request, {'counts': [len(detections) for detections in results]}, packed)
+            except (ConnectionError, OSError):
+                return
+            except Exception as e:
+                logger.error(f"Inference request failed: {e}", exc_info=True)
+                try:
+                    _send_message(self.request, {'error': str(e)})
+                except OSError:
+                    return
+                if not payload_received:
+                    return # The unread pixels would be taken for the next header
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves an InferenceBackend on a Unix socket. Connections are handled on their own
+    threads; model calls are serialised.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, inference_backend):
+        if os.path.exists(socket_path):
+            os.remove(socket_path) # Left over from a previous run
+        super().__init__(socket_path, _RequestHandler)
+        self.socket_path = socket_path
+        self.inference_backend = inference_backend
+        self.model_lock = threading.Lock()
+        self.info = {
+            'names': {str(class_id): name for class_id, name in inference_backend.names.items()},
+            'imgsz': inference_backend.imgsz,
+            'backend': inference_backend.name,
+            'precision': inference_backend.precision,
+        }
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+class InferenceClient:
+    """
+    Drop-in replacement for inference.InferenceBackend that sends requests to one or
+    more inference servers.
+
+    Each thread keeps its own connection per server. Requests are spread over the
+    servers round-robin; a server that cannot be reached or does not answer within
+    `timeout` seconds per image is skipped for SERVER_RETRY_INTERVAL seconds. If no
+    server is available, requests go to the local backend returned by `fallback`
+    (loaded on first use), or InferenceServerError is raised if there is none. A request
+    the server answers with an error raises InferenceRequestError; the server stays in use.
+
+    Note: instance segmentation masks are not sent back by the server.
+    """
+
+    def __init__(self, socket_paths, timeout=5.0, fallback=None):
+        self.socket_paths = list(socket_paths)
+        self.timeout = timeout
+        self.name = 'server'
+        self._fallback = fallback
+        self._fallback_backend = None
+        self._info = None
+        self._down_until = {}
+        self._next_server = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def names(self):
+        info = self._server_info()
+        if info is None:
+            return self._fallback_or_raise().names
+        return info['names']
+
+    @property
+    def imgsz(self):
+        info = self._server_info()
+        if info is None:
+            return self._fallback_or_raise().imgsz
+        return info['imgsz']
+
+    @property
+    def precision(self):
+        info = self._server_info()
+        return info['precision'] if info else None
+
+    def predict(self, images):
+        """Same as InferenceBackend.predict, run by an inference server."""
+        if not images:
+            return []
+        arrays = [_image_array(image) for image in images]
+        if self._server_info() is None:
+            return self._fallback_or_raise().predict(images)
+        names = self._info['names']
+        for socket_path in self._servers_to_try():
+            try:
+                sock = self._connection(socket_path, self.timeout * len(arrays))
+                _send_message(sock, {'op': 'predict', 'shapes': [array.shape for array in arrays]},
+                              [memoryview(array).cast('B') for array in arrays])
+                header = _recv_header(sock)
+                if 'error' in header:
+                    self._close(socket_path) # The server may have closed it without reading the pixels
+                    raise InferenceRequestError(header['error'])
+                results = []
+                for count in header['counts']:
+                    if not count:
+                        results.append(DetectionBatch.empty(names))
+                        continue
+                    boxes = bytearray(count * FRAME_BOX_DTYPE.itemsize)
+                    _recv_exactly(sock, memoryview(boxes))
+                    results.append(unpack_frame_boxes(boxes, names))
+                return results
+            except OSError as e: # Includes timeouts and closed connections
+                logger.warning(f"Inference server {socket_path} failed: {e}")
+                self._close(socket_path)
+                with self._lock:
+                    self._down_until[socket_path] = time.monotonic() + SERVER_RETRY_INTERVAL
+            except ValueError as e:
+                self._close(socket_path)
+                raise InferenceServerError(f"Malformed reply from inference server {socket_path}: {e}") from e
+        return self._fallback_or_raise().predict(images)
+
+    def _servers_to_try(self):
+        now = time.monotonic()
+        with self._lock:
+            start = self._next_server
+            self._next_server = (self._next_server + 1) % len(self.socket_paths)
+            ordered = self.socket_paths[start:] + self.socket_paths[:start]
+            return [path for path in ordered if self._down_until.get(path, 0) <= now]
+
+    def _server_info(self):
+        if self._info is None:
+            for socket_path in self._servers_to_try():
+                try:
+                    sock = self._connection(socket_path, self.timeout)
+                    _send_message(sock, {'op': 'info'})
+                    info = _recv_header(sock)
+                    info['names'] = {int(class_id): name for class_id, name in info['names'].items()}
+                    self._info = info
+                    break
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Inference server {socket_path} failed: {e}")
+                    self._close(socket_path)
+                    with self._lock:
+                        self._down_until[socket_path] = time.monotonic() + SERVER_RETRY_INTERVAL
+        return self._info
+
+    def _connection(self, socket_path, timeout):
+        connections = self._local.__dict__.setdefault('connections', {})
+        sock = connections.get(socket_path)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            connections[socket_path] = sock
+        sock.settimeout(timeout)
+        return sock
+
+    def _close(self, socket_path):
+        sock = self._local.__dict__.get('connections', {}).pop(socket_path, None)
+        if sock is not None:
+            sock.close()
+
+    def _fallback_or_raise(self):
+        if self._fallback is None:
+            raise InferenceServerError("No inference server available.")
+        with self._lock:
+            if self._fallback_backend is None:
+                logger.warning("No inference server available; loading the model in this process.")
+                self._fallback_backend = self._fallback()
+        if self._fallback_backend is None:
+            raise InferenceServerError("No inference server available and the local model could not be loaded.")
+        return self._fallback_backend
+
+    def __repr__(self):
+        return f"<InferenceClient {', '.join(self.socket_paths)}>"
@@ -0,0 +1,487 @@
+"""
+Background job queue for video uploads.
+
+Videos are processed by a pool of worker processes (so inference doesn't fight the
+web process for the GIL). The web process keeps the job table, hands jobs to the
+pool fairly across users and collects progress updates that the workers send back
+over a multiprocessing queue. A job's result comes back on the pool's own pipe, so a
+job is only finished once its worker's final 'done' event has been read from the
+progress queue as well; the events sent before it are never dropped.
+
+Note: the job table lives in the memory of the web process that accepted the upload,
+so /jobs/<id> must be served by the same process (true for the default single-process
+Flask server).
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+# Job states
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_FINISHED = 'finished'
+JOB_FAILED = 'failed'
+
+
+class JobQueueFull(Exception):
+    """Raised when the queue already holds the configured maximum of pending jobs."""
+    pass
+
+
+class UserJobLimitReached(Exception):
+    """Raised when a user already has the configured maximum of active jobs."""
+    pass
+
+
+class VideoJob:
+    """
+    State of one video processing job, as seen by the web process.
+
+    `events` holds the most recent (id, name, data) events of the job (state changes,
+    progress, segments of detections and 'playable' once an HLS output can be played
+    while it is still being written) for /jobs/<id>/events; ids increase by one, so
+    a client that reconnects can ask for the events after the last one it saw. Only
+    the newest `max_events` are kept.
+    """
+
+    def __init__(self, user_id, params, max_events=256):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.params = params
+        self.state = JOB_QUEUED
+        self.frames_done = 0
+        self.frames_total = 0
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.playable = False # Whether the processed video can be played (yet)
+        self.outcome = None # (result, error) of the finished future, until the worker's events are drained
+        self.events_drained = False # Whether the worker's 'done' event has been read
+        self.events = deque(maxlen=max_events)
+        self.last_event_id = 0
+
+    def add_event(self, name, data):
+        self.last_event_id += 1
+        self.events.append((self.last_event_id, name, data))
+
+    @property
+    def is_active(self):
+        return self.state in (JOB_QUEUED, JOB_RUNNING)
+
+    def eta_seconds(self):
+        """Estimated seconds until the job finishes, based on the frame rate so far."""
+        if self.state != JOB_RUNNING or not self.started_at or not self.frames_done or not self.frames_total:
+            return None
+        elapsed = time.time() - self.started_at
+        remaining_frames = max(self.frames_total - self.frames_done, 0)
+        return round(elapsed / self.frames_done * remaining_frames, 1)
+
+    def to_dict(self):
+        job_dict = {
+            'job_id': self.id,
+            'state': self.state,
+            'frames_done': self.frames_done,
+            'frames_total': self.frames_total,
+            'eta_seconds': self.eta_seconds(),
+            'processed_video_url': self.params.get('processed_video_url'),
+            'processed_video_type': self.params.get('processed_video_type', 'video/mp4'),
+            'playable': self.playable,
+        }
+        if self.state == JOB_FINISHED and self.result is not None:
+            job_dict['video_id'] = self.result.get('video_id')
+            job_dict['detections'] = self.result['detections'] # One entry per tracked object
+            job_dict['keyframes'] = self.result.get('keyframes')
+            job_dict['processing_fps'] = self.result.get('processing_fps')
+            job_dict['stage_timings'] = self.result.get('stage_timings')
+        if self.state == JOB_FAILED:
+            job_dict['error'] = self.error
+        return job_dict
+
+
+class VideoJobManager:
+    """
+    Keeps track of video jobs and dispatches them to a process pool.
+
+    Jobs wait in our own pending queue and are only handed to the pool when a worker
+    is free. The next job is taken from the user with the fewest running jobs, so one
+    user uploading many clips cannot starve everyone else.
+
+    Results of jobs submitted with a 'cache_key' (content hash, model version) in their
+    params are stored in `result_cache` (see result_cache.py) when they finish.
+    """
+
+    def __init__(self, max_workers=2, max_queue_depth=20, max_jobs_per_user=2, result_ttl=3600, result_cache=None,
+                 max_events=256):
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.max_jobs_per_user = max_jobs_per_user
+        self.result_ttl = result_ttl
+        self.result_cache = result_cache
+        self.max_events = max_events
+
+        self._lock = threading.Lock()
+        self._events_added = threading.Condition(self._lock)
+        self._jobs = {}
+        self._pending = deque()
+        self._running_per_user = {}
+        self._running_total = 0
+        self._executor = None
+        self._progress_queue = None
+        self._progress_thread = None
+
+    def submit(self, user_id, params):
+        """
+        Queues a new video job.
+
+        Raises:
+            JobQueueFull: If the pending queue is full
+            UserJobLimitReached: If the user already has too many active jobs
+        """
+        with self._lock:
+            self._prune_finished_locked()
+            if len(self._pending) >= self.max_queue_depth:
+                raise JobQueueFull("The processing queue is full. Please try again in a few minutes.")
+            active_for_user = sum(1 for job in self._jobs.values() if job.user_id == user_id and job.is_active)
+            if active_for_user >= self.max_jobs_per_user:
+                raise UserJobLimitReached(
+                    f"You already have {active_for_user} video(s) being processed. "
+                    "Please wait for them to finish before uploading more."
+                )
+
+            job = VideoJob(user_id, params, self.max_events)
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            logger.info(f"Queued video job {job.id} for user {user_id} ({len(self._pending)} pending).")
+            submitted = self._dispatch_locked()
+        self._watch(submitted)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._prune_finished_locked()
+            return self._jobs.get(job_id)
+
+    def wait_for_events(self, job, after_event_id, timeout):
+        """
+        Events of a job with an id above `after_event_id`, waiting up to `timeout`
+        seconds for new ones while the job is active.
+
+        Returns:
+            List of (id, name, data) tuples; empty if the wait timed out or the job has
+            no newer events and is done
+        """
+        with self._lock:
+            while True:
+                events = [event for event in job.events if event[0] > after_event_id]
+                if events or not job.is_active:
+                    return events
+                if not self._events_added.wait(timeout):
+                    return []
+
+    def _prune_finished_locked(self):
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if not job.is_active and job.finished_at and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _ensure_pool_locked(self):
+        if self._executor is not None:
+            return
+        # 'spawn' gives every worker a clean interpreter; forking a process that has
+        # already initialised torch/OpenCV threads can deadlock.
+        mp_context = multiprocessing.get_context('spawn')
+        if self._progress_queue is None:
+            self._progress_queue = mp_context.Queue()
+            self._progress_thread = threading.Thread(target=self._drain_progress, name='video-job-progress', daemon=True)
+            self._progress_thread.start()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(self._progress_queue,),
+        )
+        logger.info(f"Started video job pool with {self.max_workers} worker process(es).")
+
+    def _dispatch_locked(self):
+        """
+        Hands pending jobs to the pool while workers are free.
+
+        Returns:
+            List of (job id, future) pairs; pass them to `_watch` once the lock is
+            released
+        """
+        submitted = []
+        while self._pending and self._running_total < self.max_workers:
+            # Fair share: pick the oldest pending job of the user with the fewest running jobs
+            job = min(self._pending, key=lambda j: self._running_per_user.get(j.user_id, 0))
+            self._pending.remove(job)
+            self._ensure_pool_locked()
+            self._running_total += 1
+            self._running_per_user[job.user_id] = self._running_per_user.get(job.user_id, 0) + 1
+            try:
+                future = self._executor.submit(_run_video_job, job.id, job.user_id, job.params)
+            except BrokenProcessPool as e:
+                self._executor = None
+                self._finish_locked(job, error=e)
+                continue
+            submitted.append((job.id, future))
+        return submitted
+
+    def _watch(self, submitted):
+        # A future that is already done runs its callback inline, and `_on_job_done`
+        # takes the lock, so callbacks must never be added while holding it.
+        for job_id, future in submitted:
+            future.add_done_callback(partial(self._on_job_done, job_id))
+
+    def _on_job_done(self, job_id, future):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            error = future.exception()
+            if isinstance(error, BrokenProcessPool):
+                # A worker died (e.g. out of memory); start a fresh pool for the next jobs
+                self._executor = None
+            submitted = []
+            if job is not None:
+                job.outcome = (None if error else future.result(), error)
+                # A dead worker never sends its 'done' event
+                if job.events_drained or isinstance(error, BrokenProcessPool):
+                    submitted = self._finish_outcome_locked(job)
+        self._watch(submitted)
+
+    def _finish_outcome_locked(self, job):
+        result, error = job.outcome
+        self._finish_locked(job, result=result, error=error)
+        return self._dispatch_locked()
+
+    def _finish_locked(self, job, result=None, error=None):
+        self._running_total -= 1
+        self._running_per_user[job.user_id] -= 1
+        if not self._running_per_user[job.user_id]:
+            del self._running_per_user[job.user_id]
+        job.finished_at = time.time()
+        if error is not None:
+            logger.error(f"Video job {job.id} failed: {error}")
+            job.state = JOB_FAILED
+            job.error = str(error)
+            job.add_event('failed', {'error': job.error})
+        else:
+            logger.info(f"Video job {job.id} finished.")
+            job.state = JOB_FINISHED
+            job.playable = True
+            job.result = result
+            job.frames_done = result.get('frames_processed', job.frames_done)
+            job.frames_total = job.frames_done
+            cache_key = job.params.get('cache_key')
+            if self.result_cache is not None and cache_key:
+                from result_cache import ENTRY_VIDEO
+                self.result_cache.put(cache_key[0], cache_key[1], {
+                    'kind': ENTRY_VIDEO,
+                    'result': result,
+                    'processed_video_url': job.params['processed_video_url'],
+                    'processed_video_type': job.params.get('processed_video_type', 'video/mp4'),
+                    'processed_video_path': job.params['output_path'],
+                })
+            job.add_event('finished', job.to_dict())
+        self._events_added.notify_all()
+
+    def _drain_progress(self):
+        while True:
+            try:
+                job_id, event, data = self._progress_queue.get()
+            except (EOFError, OSError):
+                return
+            submitted = []
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or not job.is_active:
+                    continue
+                if event == 'done':
+                    # Last event of the job; finish it if its result has already arrived
+                    job.events_drained = True
+                    if job.outcome is not None:
+                        submitted = self._finish_outcome_locked(job)
+                elif event == 'started':
+                    job.state = JOB_RUNNING
+                    job.started_at = time.time()
+                    job.add_event('started', {'state': job.state, 'class_names': data.get('class_names')})
+                elif event == 'progress':
+                    job.frames_done = data['frames_done']
+                    job.frames_total = data['frames_total']
+                    job.add_event('progress', {'frames_done': job.frames_done, 'frames_total': job.frames_total,
+                                               'eta_seconds': job.eta_seconds()})
+                elif event == 'detections':
+                    job.add_event('detections', data)
+                elif event == 'playable' and not job.playable:
+                    job.playable = True
+                    job.add_event('playable', {'processed_video_url': job.params.get('processed_video_url'),
+                                               'processed_video_type': job.params.get('processed_video_type')})
+                self._events_added.notify_all()
+            self._watch(submitted)
+
+
+def get_job_manager():
+    """Returns the app's VideoJobManager, creating it from the app config on first use."""
+    from flask import current_app
+    from result_cache import get_result_cache
+    manager = current_app.extensions.get('video_jobs')
+    if manager is None:
+        manager = VideoJobManager(
+            max_workers=current_app.config['VIDEO_JOB_WORKERS'],
+            max_queue_depth=current_app.config['VIDEO_JOB_QUEUE_DEPTH'],
+            max_jobs_per_user=current_app.config['VIDEO_JOB_MAX_PER_USER'],
+            result_ttl=current_app.config['VIDEO_JOB_RESULT_TTL'],
+            result_cache=get_result_cache(),
+            max_events=current_app.config['VIDEO_JOB_EVENT_BUFFER'],
+        )
+        current_app.extensions['video_jobs'] = manager
+    return manager
+
+
+# --- Worker process side ---
+
+_worker_progress_queue = None
+
+def _init_worker(progress_queue):
+    """Runs once in every worker process: loads the app and warms up the YOLO model."""
+    global _worker_progress_queue
+    _worker_progress_queue = progress_queue
+    # Imported here rather than at module level: app.py imports routes, which imports this module.
+    from app import app
+    app.app_context().push()
+    if app.config['MODEL_WARMUP']:
+        from inference import warmup_inference_backend
+        warmup_inference_backend()
+
+def _report(job_id, event, data=None):
+    if _worker_progress_queue is not None:
+        _worker_progress_queue.put((job_id, event, data or {}))
+
+def _run_video_job(job_id, user_id, params):
+    try:
+        return _process_video_job(job_id, user_id, params)
+    finally:
+        # Sent after all other events of the job; the web process waits for it
+        _report(job_id, 'done')
+
+def _process_video_job(job_id, user_id, params):
+    import json
+    from flask import current_app
+    from app import db
+    from models import ProcessedVideo
+    from detections import DetectionWriter, VideoFrameWriter
+    from inference import get_inference_backend
+    from tracking import IoUTracker
+    from frame_sampling import KeyframeSelector
+    from video_processing import OUTPUT_HLS, probe_video, process_video
+
+    inference_backend = get_inference_backend()
+    if not inference_backend:
+        raise RuntimeError("Detection model is not loaded in the worker process.")
+
+    class_names = inference_backend.names
+    _report(job_id, 'started', {'class_names': class_names})
+    current_app.logger.info(f"Starting video job {job_id}: {params['input_path']}")
+
+    video_info = probe_video(params['input_path'])
+    video = ProcessedVideo(
+        user_id=user_id,
+        video_path=params['db_image_path'],
+        processed_video_path=params['db_processed_video_path'],
+        fps=video_info['fps'],
+        frame_width=video_info['width'],
+        frame_height=video_info['height'],
+        class_names=json.dumps(class_names),
+    )
+    db.session.add(video)
+    db.session.commit()
+
+    encoder = params.get('encoder')
+    # ffmpeg writes the HLS playlist once the first segment is complete; from then on the
+    # client can start playing the processed video while the rest is still being encoded
+    awaiting_playlist = [encoder is not None and encoder['format'] == OUTPUT_HLS]
+
+    def on_progress(frames_done, frames_total):
+        _report(job_id, 'progress', {'frames_done': frames_done, 'frames_total': frames_total})
+        if awaiting_playlist[0] and os.path.exists(params['output_path']):
+            awaiting_playlist[0] = False
+            _report(job_id, 'playable', {})
+
+    tracker = IoUTracker(
+        iou_threshold=current_app.config['VIDEO_TRACKER_IOU_THRESHOLD'],
+        high_conf=current_app.config['VIDEO_TRACKER_HIGH_CONF'],
+        low_conf=current_app.config['VIDEO_TRACKER_LOW_CONF'],
+        max_age=current_app.config['VIDEO_TRACKER_MAX_AGE'],
+        min_hits=current_app.config['VIDEO_TRACKER_MIN_HITS'],
+    )
+    tracked_objects = []
+
+    # Detections are also sent to the web process in segments of frames, for clients
+    # following /jobs/<id>/events; only the current segment is held here
+    segment_size = max(current_app.config['VIDEO_JOB_EVENT_SEGMENT_FRAMES'], 1)
+    segment = {'start_frame': 0, 'frames': [], 'objects': []}
+
+    def send_segment(end_frame):
+        if segment['frames'] or segment['objects']:
+            _report(job_id, 'detections', {'end_frame': end_frame, **segment})
+        segment.update(start_frame=end_frame + 1, frames=[], objects=[])
+
+    # Per-frame boxes and tracked objects are written in chunks while later frames
+    # are still being processed
+    with DetectionWriter(user_id, params['db_image_path']) as writer, \
+            VideoFrameWriter(video.id, video.fps) as frame_writer:
+        def on_frame_detections(frame_index, frame_detections):
+            frame_writer.add(frame_index, frame_detections)
+            finished_tracks = tracker.update(frame_index, frame_detections)
+            if finished_tracks:
+                writer.add_tracked_objects(video.id, video.fps, finished_tracks, class_names)
+                finished_objects = [track.to_dict(class_names, video.fps) for track in finished_tracks]
+                tracked_objects.extend(finished_objects)
+                segment['objects'].extend(finished_objects)
+            if len(frame_detections):
+                # Same compact rows as the livestream socket: [x, y, width, height, confidence, class_id]
+                segment['frames'].append([frame_index, int(round(frame_index * 1000 / video.fps)),
+                                          frame_detections.to_rows()])
+            if frame_index + 1 - segment['start_frame'] >= segment_size:
+                send_segment(frame_index)
+
+        result = process_video(
+            inference_backend, params['input_path'], params['output_path'],
+            progress_callback=on_progress,
+            batch_size=current_app.config['VIDEO_BATCH_SIZE'],
+            queue_size=current_app.config['VIDEO_PIPELINE_QUEUE_SIZE'],
+            detections_callback=on_frame_detections,
+            keyframe_selector=KeyframeSelector(**params['sampling']),
+            encoder=encoder,
+        )
+        finished_tracks = tracker.finish()
+        writer.add_tracked_objects(video.id, video.fps, finished_tracks, class_names)
+        finished_objects = [track.to_dict(class_names, video.fps) for track in finished_tracks]
+        tracked_objects.extend(finished_objects)
+        segment['objects'].extend(finished_objects)
+        # The last segment may only hold objects of tracks that ended with the video
+        segment['start_frame'] = min(segment['start_frame'], result['frames_processed'] - 1)
+        send_segment(result['frames_processed'] - 1)
+    current_app.logger.info(f"Video job {job_id}: {writer.rows_written} tracked objects committed to database.")
+
+    video.frame_count = result['frames_processed']
+    db.session.commit()
+    return {
+        'video_id': video.id,
+        'detections': tracked_objects,
+        'frames_processed': result['frames_processed'],
+        'keyframes': result['keyframes'],
+        'processing_fps': result['processing_fps'],
+        'stage_timings': result['stage_timings'],
+    }
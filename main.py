@@ -1,4 +1,11 @@
+import os
 from app import app
+from inference import warmup_inference_backend
 
 if __name__ == "__main__":
+    # With the debug reloader the server runs in a child process (WERKZEUG_RUN_MAIN is set there);
+    # warm up only in the process that serves requests.
+    if app.config["MODEL_WARMUP"] and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        with app.app_context():
+            warmup_inference_backend()
     app.run(host="0.0.0.0", port=5000, debug=True)
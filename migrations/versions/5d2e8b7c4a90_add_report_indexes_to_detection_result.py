@@ -0,0 +1,28 @@
+"""Add report indexes to DetectionResult table
+
+Revision ID: 5d2e8b7c4a90
+Revises: c41e7b9a2f6d
+Create Date: 2026-10-16 14:20:31.552841
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8b7c4a90'
+down_revision = 'c41e7b9a2f6d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('detection_result', schema=None) as batch_op:
+        batch_op.create_index('ix_detection_result_user_id_detection_date', ['user_id', 'detection_date'], unique=False)
+        batch_op.create_index('ix_detection_result_user_id_trash_type', ['user_id', 'trash_type'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('detection_result', schema=None) as batch_op:
+        batch_op.drop_index('ix_detection_result_user_id_trash_type')
+        batch_op.drop_index('ix_detection_result_user_id_detection_date')
@@ -0,0 +1,71 @@
+"""Add processed_video and video_frame_detection tables
+
+Revision ID: 8f3a2c1d9b47
+Revises: 37530ac4cc06
+Create Date: 2026-10-16 10:12:04.318220
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f3a2c1d9b47'
+down_revision = '37530ac4cc06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases started with an earlier version of app.py may already have the tables
+    # (created by db.create_all() at import); only the missing ones are created.
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('processed_video'):
+        _create_processed_video()
+    if not inspector.has_table('video_frame_detection'):
+        _create_video_frame_detection()
+
+
+def _create_processed_video():
+    op.create_table('processed_video',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('video_path', sa.String(length=256), nullable=False),
+        sa.Column('processed_video_path', sa.String(length=256), nullable=True),
+        sa.Column('fps', sa.Float(), nullable=False),
+        sa.Column('frame_count', sa.Integer(), nullable=True),
+        sa.Column('frame_width', sa.Integer(), nullable=False),
+        sa.Column('frame_height', sa.Integer(), nullable=False),
+        sa.Column('class_names', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('processed_video', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_processed_video_video_path'), ['video_path'], unique=False)
+
+
+def _create_video_frame_detection():
+    op.create_table('video_frame_detection',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('video_id', sa.Integer(), nullable=False),
+        sa.Column('frame_index', sa.Integer(), nullable=False),
+        sa.Column('timestamp_ms', sa.Integer(), nullable=False),
+        sa.Column('box_count', sa.Integer(), nullable=False),
+        sa.Column('boxes', sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(['video_id'], ['processed_video.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('video_frame_detection', schema=None) as batch_op:
+        batch_op.create_index('ix_video_frame_detection_video_id_timestamp_ms', ['video_id', 'timestamp_ms'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('video_frame_detection', schema=None) as batch_op:
+        batch_op.drop_index('ix_video_frame_detection_video_id_timestamp_ms')
+
+    op.drop_table('video_frame_detection')
+    with op.batch_alter_table('processed_video', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_processed_video_video_path'))
+
+    op.drop_table('processed_video')
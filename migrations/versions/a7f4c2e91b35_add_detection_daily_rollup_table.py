@@ -0,0 +1,52 @@
+"""Add detection_daily_rollup table
+
+Revision ID: a7f4c2e91b35
+Revises: 5d2e8b7c4a90
+Create Date: 2026-10-16 15:05:12.694207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7f4c2e91b35'
+down_revision = '5d2e8b7c4a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    # Databases started with an earlier version of app.py may already have the table,
+    # left empty by db.create_all() at import; an empty table is backfilled too.
+    if not sa.inspect(bind).has_table('detection_daily_rollup'):
+        _create_detection_daily_rollup()
+    elif bind.execute(sa.text("SELECT 1 FROM detection_daily_rollup LIMIT 1")).first() is not None:
+        return
+    # Backfill from the existing detections (same as `flask rebuild-rollups`)
+    op.execute(
+        "INSERT INTO detection_daily_rollup "
+        "(user_id, day, trash_type, count, confidence_sum, confidence_max, last_detection_date) "
+        "SELECT user_id, date(detection_date), trash_type, count(*), sum(confidence), max(confidence), max(detection_date) "
+        "FROM detection_result WHERE detection_date IS NOT NULL "
+        "GROUP BY user_id, date(detection_date), trash_type"
+    )
+
+
+def _create_detection_daily_rollup():
+    op.create_table('detection_daily_rollup',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('trash_type', sa.String(length=50), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('confidence_sum', sa.Float(), nullable=False),
+        sa.Column('confidence_max', sa.Float(), nullable=False),
+        sa.Column('last_detection_date', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('user_id', 'day', 'trash_type')
+    )
+
+
+def downgrade():
+    op.drop_table('detection_daily_rollup')
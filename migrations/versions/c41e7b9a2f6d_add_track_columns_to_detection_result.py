@@ -0,0 +1,34 @@
+"""Add tracked object columns to DetectionResult table
+
+Revision ID: c41e7b9a2f6d
+Revises: 8f3a2c1d9b47
+Create Date: 2026-10-16 11:02:47.905113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41e7b9a2f6d'
+down_revision = '8f3a2c1d9b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('detection_result', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('video_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('track_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('first_seen_ms', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('last_seen_ms', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_detection_result_video_id_processed_video', 'processed_video', ['video_id'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('detection_result', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_detection_result_video_id_processed_video', type_='foreignkey')
+        batch_op.drop_column('last_seen_ms')
+        batch_op.drop_column('first_seen_ms')
+        batch_op.drop_column('track_id')
+        batch_op.drop_column('video_id')
@@ -0,0 +1,28 @@
+"""Index DetectionResult by user, trash type and date
+
+Revision ID: e3b9d1f60c27
+Revises: a7f4c2e91b35
+Create Date: 2026-10-16 16:12:48.207315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3b9d1f60c27'
+down_revision = 'a7f4c2e91b35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('detection_result', schema=None) as batch_op:
+        batch_op.drop_index('ix_detection_result_user_id_trash_type')
+        batch_op.create_index('ix_detection_result_user_id_trash_type_detection_date', ['user_id', 'trash_type', 'detection_date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('detection_result', schema=None) as batch_op:
+        batch_op.drop_index('ix_detection_result_user_id_trash_type_detection_date')
+        batch_op.create_index('ix_detection_result_user_id_trash_type', ['user_id', 'trash_type'], unique=False)
@@ -28,6 +28,12 @@ class User(UserMixin, db.Model):
 
 
 class DetectionResult(db.Model):
+    __table_args__ = (
+        # Per-user detection list (/detections), newest first, optionally filtered by trash type
+        db.Index('ix_detection_result_user_id_detection_date', 'user_id', 'detection_date'),
+        db.Index('ix_detection_result_user_id_trash_type_detection_date', 'user_id', 'trash_type', 'detection_date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     image_path = db.Column(db.String(256), nullable=False)
@@ -38,6 +44,11 @@ class DetectionResult(db.Model):
     bbox_y = db.Column(db.Integer, nullable=True) # Bounding box y-coordinate
     bbox_width = db.Column(db.Integer, nullable=True) # Bounding box width
     bbox_height = db.Column(db.Integer, nullable=True) # Bounding box height
+    # Set for videos, where one row is stored per tracked object (bbox/confidence of its best detection)
+    video_id = db.Column(db.Integer, db.ForeignKey('processed_video.id'), nullable=True)
+    track_id = db.Column(db.Integer, nullable=True)
+    first_seen_ms = db.Column(db.Integer, nullable=True) # Offset into the video where the object first appears
+    last_seen_ms = db.Column(db.Integer, nullable=True)
     
     def __repr__(self):
         return f'<DetectionResult {self.id}>'
@@ -59,4 +70,81 @@ class DetectionResult(db.Model):
                 'width': self.bbox_width,
                 'height': self.bbox_height
             }
-        return result_dict
\ No newline at end of file
+        if self.track_id is not None:
+            result_dict['video_id'] = self.video_id
+            result_dict['track_id'] = self.track_id
+            result_dict['first_seen'] = self.first_seen_ms / 1000
+            result_dict['last_seen'] = self.last_seen_ms / 1000
+        return result_dict
+
+class ProcessedVideo(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    video_path = db.Column(db.String(256), nullable=False, index=True) # Original upload, relative to 'static'
+    processed_video_path = db.Column(db.String(256), nullable=True) # Annotated output, relative to 'static'
+    fps = db.Column(db.Float, nullable=False)
+    frame_count = db.Column(db.Integer, nullable=True) # Filled in once processing has finished
+    frame_width = db.Column(db.Integer, nullable=False)
+    frame_height = db.Column(db.Integer, nullable=False)
+    class_names = db.Column(db.Text, nullable=True) # JSON class-id -> name mapping of the model used
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    frames = db.relationship('VideoFrameDetection', backref='video', lazy='dynamic', cascade='all, delete-orphan')
+
+    def __repr__(self):
+        return f'<ProcessedVideo {self.id}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'video_path': self.video_path,
+            'processed_video_path': self.processed_video_path,
+            'fps': self.fps,
+            'frame_count': self.frame_count,
+            'frame_width': self.frame_width,
+            'frame_height': self.frame_height,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+
+class VideoFrameDetection(db.Model):
+    """
+    Detections of one video frame. Frames without detections have no row.
+
+    The boxes of the frame are stored packed into a single binary column (see
+    detections.pack_frame_boxes), so a crowded frame is one row instead of one row per box.
+    """
+    __table_args__ = (
+        # Time-range lookups within one video ("detections between 00:30 and 01:00")
+        db.Index('ix_video_frame_detection_video_id_timestamp_ms', 'video_id', 'timestamp_ms'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.Integer, db.ForeignKey('processed_video.id'), nullable=False)
+    frame_index = db.Column(db.Integer, nullable=False)
+    timestamp_ms = db.Column(db.Integer, nullable=False) # Offset of the frame from the start of the video
+    box_count = db.Column(db.Integer, nullable=False)
+    boxes = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f'<VideoFrameDetection video={self.video_id} frame={self.frame_index}>'
+
+
+class DetectionDailyRollup(db.Model):
+    """
+    Totals of detection_result per user, day and trash type, so reports read
+    O(days x types) rows instead of every detection.
+
+    Kept up to date by detections.DetectionWriter in the same transaction that inserts
+    the detections; `flask rebuild-rollups` recomputes it from detection_result.
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    trash_type = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+    confidence_sum = db.Column(db.Float, nullable=False)
+    confidence_max = db.Column(db.Float, nullable=False)
+    last_detection_date = db.Column(db.DateTime, nullable=False) # Latest detection_date in the group
+
+    def __repr__(self):
+        return f'<DetectionDailyRollup user={self.user_id} day={self.day} {self.trash_type}>'
@@ -0,0 +1,128 @@
+"""
+Motion gating for livestream frames.
+
+A camera pointed at a static scene sends nearly identical frames, and running the
+model on each of them wastes CPU. Every livestream session gets a MotionGate, which
+keeps a tiny grayscale thumbnail of the last frame the model ran on (the 'motion'
+KeyframeSelector of frame_sampling.py). While a new frame differs from it by less than
+LIVESTREAM_MOTION_THRESHOLD, the session's last detections are returned instead; after
+LIVESTREAM_MAX_GATED_FRAMES gated frames in a row the model runs again regardless.
+
+Gated and inferred frames are counted over all sessions (MotionGateStats), reported
+by /process_frame/stats.
+"""
+import threading
+from collections import OrderedDict
+from flask import current_app
+
+_gates_lock = threading.Lock()
+
+# Gates of /process_frame sessions that are kept; the least recently used ones are dropped
+MAX_GATED_SESSIONS = 256
+
+
+class MotionGateStats:
+    """Counts of livestream frames that were gated (reused detections) or run through the model."""
+
+    def __init__(self):
+        self.inferred = 0
+        self.gated = 0
+        self._lock = threading.Lock()
+
+    def record(self, gated):
+        with self._lock:
+            if gated:
+                self.gated += 1
+            else:
+                self.inferred += 1
+
+    def to_dict(self):
+        with self._lock:
+            total = self.inferred + self.gated
+            return {
+                'inferred': self.inferred,
+                'gated': self.gated,
+                'gated_share': round(self.gated / total, 3) if total else None,
+            }
+
+
+class MotionGate:
+    """
+    Decides per frame of one livestream session whether the model has to run.
+
+    Usage:
+        detections, gated = gate.detect(image_bgr, frame_batcher.predict)
+    """
+
+    def __init__(self, motion_threshold=0.01, max_gated_frames=30, stats=None):
+        from frame_sampling import SAMPLING_MOTION, KeyframeSelector # Imports OpenCV; loaded on first use
+        self._selector = KeyframeSelector(SAMPLING_MOTION, motion_threshold=motion_threshold,
+                                          max_gap=max_gated_frames + 1)
+        self.stats = stats
+        self.inferred = 0
+        self.gated = 0
+        self._last_detections = None
+        self._lock = threading.Lock()
+
+    def detect(self, image, predict):
+        """
+        Returns the detections of `image`, either by calling predict(image) or, if the
+        scene has not changed, the detections of the last inferred frame.
+
+        Args:
+            image: BGR frame (as passed to predict)
+            predict: Function that runs the model on one frame and returns its DetectionBatch
+
+        Returns:
+            Tuple (detections, gated)
+        """
+        with self._lock:
+            run_model = self._selector.is_keyframe(image) or self._last_detections is None
+            detections = self._last_detections
+        if run_model:
+            detections = predict(image)
+            with self._lock:
+                self._last_detections = detections
+                self.inferred += 1
+        else:
+            with self._lock:
+                self.gated += 1
+        if self.stats is not None:
+            self.stats.record(not run_model)
+        return detections, not run_model
+
+
+def get_motion_gate_stats():
+    """Returns the app's MotionGateStats, creating them on first use."""
+    extensions = current_app.extensions
+    if 'motion_gate_stats' not in extensions:
+        with _gates_lock:
+            extensions.setdefault('motion_gate_stats', MotionGateStats())
+    return extensions['motion_gate_stats']
+
+
+def create_motion_gate():
+    """Returns a new MotionGate configured from the app config, e.g. for one WebSocket connection."""
+    config = current_app.config
+    return MotionGate(config['LIVESTREAM_MOTION_THRESHOLD'], config['LIVESTREAM_MAX_GATED_FRAMES'],
+                      stats=get_motion_gate_stats())
+
+
+def get_motion_gate(session_key):
+    """
+    Returns the MotionGate of a /process_frame session, creating it on first use. Only
+    the MAX_GATED_SESSIONS most recently used gates are kept.
+    """
+    extensions = current_app.extensions
+    with _gates_lock:
+        gates = extensions.setdefault('motion_gates', OrderedDict())
+        gate = gates.get(session_key)
+        if gate is not None:
+            gates.move_to_end(session_key)
+            return gate
+    gate = create_motion_gate()
+    with _gates_lock:
+        gate = gates.setdefault(session_key, gate)
+        while len(gates) > MAX_GATED_SESSIONS:
+            gates.popitem(last=False)
+    return gate
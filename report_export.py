@@ -0,0 +1,151 @@
+"""
+Report export: a user's detections as CSV, XLSX or Parquet.
+
+Rows are read from a server-side cursor in chunks of REPORT_EXPORT_CHUNK_SIZE and
+written out chunk by chunk, so the memory used by an export does not grow with the
+number of detections. CSV is streamed to the client as it is produced; XLSX (written
+with xlsxwriter's constant_memory mode) and Parquet (one row group per chunk) are
+written to a temporary file that is then sent.
+
+Parquet needs pyarrow, which is not installed by default (`pip install pyarrow`).
+"""
+import csv
+import io
+import logging
+from collections import Counter
+from sqlalchemy import select
+from models import DetectionResult # type: ignore
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CSV = 'csv'
+EXPORT_XLSX = 'xlsx'
+EXPORT_PARQUET = 'parquet'
+
+EXPORT_MIMETYPES = {
+    EXPORT_CSV: 'text/csv',
+    EXPORT_XLSX: 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    EXPORT_PARQUET: 'application/vnd.apache.parquet',
+}
+
+EXPORT_COLUMNS = ('ID', 'Image Path', 'Trash Type', 'Confidence', 'Detection Date', 'Detection Time')
+
+# constant_memory writes every row out immediately, so the widths can't be fitted to the data
+_XLSX_COLUMN_WIDTHS = (10, 50, 20, 12, 15, 15)
+
+
+def iter_detection_chunks(engine, user_id, chunk_size):
+    """
+    Reads a user's detections, newest first, with a server-side cursor.
+
+    Args:
+        engine: SQLAlchemy engine (db.engine); the generator needs no app context
+        user_id: ID of the user
+        chunk_size: Rows fetched per chunk
+
+    Yields:
+        Lists of (id, image_path, trash_type, confidence, detection_date) rows
+    """
+    table = DetectionResult.__table__
+    query = (
+        select(table.c.id, table.c.image_path, table.c.trash_type, table.c.confidence, table.c.detection_date)
+        .where(table.c.user_id == user_id)
+        .order_by(table.c.detection_date.desc(), table.c.id.desc())
+    )
+    with engine.connect() as connection:
+        result = connection.execution_options(yield_per=chunk_size).execute(query)
+        for partition in result.partitions():
+            yield partition
+
+
+def _date_and_time(detection_date):
+    if detection_date is None:
+        return '', ''
+    return detection_date.strftime('%Y-%m-%d'), detection_date.strftime('%H:%M:%S')
+
+
+def stream_csv(chunks):
+    """Yields the CSV report piece by piece: the header, then one piece per chunk."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            (detection_id, image_path, trash_type, f"{confidence:.2f}", *_date_and_time(detection_date))
+            for detection_id, image_path, trash_type, confidence, detection_date in chunk
+        )
+        yield buffer.getvalue()
+
+
+def write_xlsx(chunks, output):
+    """
+    Writes the XLSX report to `output` (a path or binary file object): the detections
+    sheet, plus a 'Trash Summary' sheet with the counts per trash type and a pie chart.
+    """
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Trash Detections')
+    header_format = workbook.add_format({'bold': True})
+    confidence_format = workbook.add_format({'num_format': '0.00'})
+    for column, width in enumerate(_XLSX_COLUMN_WIDTHS):
+        worksheet.set_column(column, column, width, confidence_format if column == 3 else None)
+    worksheet.write_row(0, 0, EXPORT_COLUMNS, header_format)
+
+    trash_counts = Counter()
+    row = 1
+    for chunk in chunks:
+        for detection_id, image_path, trash_type, confidence, detection_date in chunk:
+            worksheet.write_row(row, 0, (detection_id, image_path, trash_type, confidence,
+                                         *_date_and_time(detection_date)))
+            trash_counts[trash_type] += 1
+            row += 1
+
+    if trash_counts:
+        summary_sheet = workbook.add_worksheet('Trash Summary')
+        summary_sheet.set_column(0, 0, 20)
+        summary_sheet.write_row(0, 0, ('Trash Type', 'Count'), header_format)
+        for summary_row, (trash_type, count) in enumerate(trash_counts.most_common(), start=1):
+            summary_sheet.write_row(summary_row, 0, (trash_type, count))
+
+        pie_chart = workbook.add_chart({'type': 'pie'})
+        pie_chart.add_series({
+            'name': 'Trash Distribution',
+            'categories': ['Trash Summary', 1, 0, len(trash_counts), 0],
+            'values': ['Trash Summary', 1, 1, len(trash_counts), 1],
+        })
+        pie_chart.set_title({'name': 'Distribution of Trash Types'})
+        summary_sheet.insert_chart('D2', pie_chart)
+    workbook.close()
+    logger.debug(f"XLSX report written with {row - 1} rows.")
+
+
+def write_parquet(chunks, output):
+    """
+    Writes the detections as a Parquet file to `output` (a path or binary file object),
+    one row group per chunk. Columns keep their database names and types, for analytics
+    tools rather than people.
+
+    Raises:
+        ImportError: If pyarrow is not installed
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('image_path', pa.string()),
+        ('trash_type', pa.string()),
+        ('confidence', pa.float64()),
+        ('detection_date', pa.timestamp('us')),
+    ])
+    with pq.ParquetWriter(output, schema) as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(zip(*chunk), schema)],
+                schema=schema,
+            ))
+
@@ -1,92 +1,205 @@
-import pandas as pd
+from collections import OrderedDict
 from datetime import datetime
-import matplotlib.pyplot as plt
+import hashlib
 import io
 import base64
+import json
+import threading
+from flask import current_app
+from sqlalchemy import func
+from app import db # type: ignore
+from models import DetectionDailyRollup, DetectionResult # type: ignore
+from report_export import write_xlsx # type: ignore
 
-def generate_trash_summary(detections):
+# matplotlib is imported inside the functions that use it: it is slow
+# to import and most requests (and all CLI commands) don't need it.
+
+def generate_trash_summary(user_id):
     """
-    Generate summary statistics from detection results
+    Generate summary statistics of a user's detection results.
+
+    The statistics are read from the daily rollup (DetectionDailyRollup), which holds
+    one row per day and trash type, so the cost grows with days x types rather than
+    with the number of detections. A user with detections but no rollup rows has their
+    rollup rebuilt first.
     
     Args:
-        detections: List of DetectionResult objects
+        user_id: ID of the user
     
     Returns:
-        Dictionary with summary statistics
+        Dictionary with summary statistics; 'daily_counts' maps 'YYYY-MM-DD' to the
+        number of detections on that day, in date order
     """
-    if not detections:
+    per_type_query = (
+        db.session.query(
+            DetectionDailyRollup.trash_type,
+            func.sum(DetectionDailyRollup.count),
+            func.sum(DetectionDailyRollup.confidence_sum),
+            func.max(DetectionDailyRollup.last_detection_date),
+        )
+        .filter(DetectionDailyRollup.user_id == user_id)
+        .group_by(DetectionDailyRollup.trash_type)
+    )
+    per_type = per_type_query.all()
+    if not per_type and _has_detections(user_id):
+        # Detections without rollup rows were saved before the rollup existed
+        # (or the rollup was cleared); rebuild this user's rollup once.
+        from detections import rebuild_daily_rollups # type: ignore
+        rebuild_daily_rollups(db.session.connection(), user_id)
+        db.session.commit()
+        per_type = per_type_query.all()
+    if not per_type:
         return {
             'total_detections': 0,
             'trash_counts': {},
+            'unique_trash_types': 0,
             'average_confidence': 0,
-            'detection_dates': []
+            'latest_detection_date': None,
+            'daily_counts': {}
         }
-    
-    # Count occurrences of each trash type
-    trash_counts = {}
-    confidences = []
-    dates = []
-    
-    for detection in detections:
-        # Count trash types
-        trash_type = detection.trash_type
-        if trash_type in trash_counts:
-            trash_counts[trash_type] += 1
-        else:
-            trash_counts[trash_type] = 1
-        
-        # Collect confidences and dates
-        confidences.append(detection.confidence)
-        dates.append(detection.detection_date)
-    
-    # Calculate average confidence
-    avg_confidence = sum(confidences) / len(confidences) if confidences else 0
-    
+
+    trash_counts = {trash_type: int(count) for trash_type, count, _, _ in per_type}
+    total_detections = sum(trash_counts.values())
+    confidence_sum = sum(confidence_total for _, _, confidence_total, _ in per_type)
+
+    per_day = (
+        db.session.query(DetectionDailyRollup.day, func.sum(DetectionDailyRollup.count))
+        .filter(DetectionDailyRollup.user_id == user_id)
+        .group_by(DetectionDailyRollup.day)
+        .order_by(DetectionDailyRollup.day)
+        .all()
+    )
+
     return {
-        'total_detections': len(detections),
+        'total_detections': total_detections,
         'trash_counts': trash_counts,
-        'average_confidence': avg_confidence,
-        'detection_dates': dates
+        'unique_trash_types': len(trash_counts),
+        'average_confidence': confidence_sum / total_detections if total_detections else 0,
+        'latest_detection_date': max(latest for _, _, _, latest in per_type),
+        'daily_counts': {day.isoformat(): int(count) for day, count in per_day}
     }
 
-def generate_time_series_chart(dates):
+def _has_detections(user_id):
+    return db.session.query(
+        db.session.query(DetectionResult.id)
+        .filter(DetectionResult.user_id == user_id, DetectionResult.detection_date.isnot(None))
+        .exists()
+    ).scalar()
+
+# Rendered charts, keyed by a hash of the chart kind and its input counts. Rendering is
+# serialized: matplotlib is not thread-safe, even through the object-oriented API.
+_chart_cache = OrderedDict()
+_chart_cache_lock = threading.Lock()
+_chart_render_lock = threading.Lock()
+
+CHART_TRASH_TYPES = 'trash_types'
+CHART_TIME_SERIES = 'time_series'
+
+
+def chart_key(kind, counts):
+    """Cache key (and ETag) of a chart: SHA-256 of its kind and input counts."""
+    payload = json.dumps([kind, sorted(counts.items())], separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def render_chart(kind, counts):
+    """
+    Render a chart as PNG, reusing the cached image if the same counts were rendered before.
+
+    Args:
+        kind: CHART_TRASH_TYPES (counts per trash type) or CHART_TIME_SERIES (counts per 'YYYY-MM-DD')
+        counts: Dictionary with the counts, as in the summary
+
+    Returns:
+        Tuple (png_bytes, key), or (None, None) if there are no counts
+    """
+    if not counts:
+        return None, None
+    renderer = _CHART_RENDERERS[kind]
+    key = chart_key(kind, counts)
+    png = _get_cached_chart(key)
+    if png is None:
+        with _chart_render_lock:
+            png = _get_cached_chart(key) # Rendered by a concurrent request meanwhile
+            if png is None:
+                png = renderer(counts)
+                _put_cached_chart(key, png)
+    return png, key
+
+def _get_cached_chart(key):
+    with _chart_cache_lock:
+        png = _chart_cache.get(key)
+        if png is not None:
+            _chart_cache.move_to_end(key)
+        return png
+
+def _put_cached_chart(key, png):
+    max_entries = current_app.config['REPORT_CHART_CACHE_SIZE']
+    if max_entries <= 0:
+        return
+    with _chart_cache_lock:
+        _chart_cache[key] = png
+        _chart_cache.move_to_end(key)
+        while len(_chart_cache) > max_entries:
+            _chart_cache.popitem(last=False)
+
+def _new_figure(figsize):
+    # Figure + Agg canvas directly: no pyplot, so no global figure state or backend selection
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    return figure
+
+def _figure_png(figure):
+    buf = io.BytesIO()
+    figure.savefig(buf, format='png')
+    return buf.getvalue()
+
+def _render_time_series_chart(daily_counts):
+    days = [datetime.strptime(day, '%Y-%m-%d').date() for day in daily_counts]
+
+    figure = _new_figure((10, 6))
+    ax = figure.add_subplot()
+    ax.plot(days, list(daily_counts.values()), marker='o', linestyle='-')
+    ax.set_title('Trash Detections Over Time')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Number of Detections')
+    ax.tick_params(axis='x', labelrotation=45)
+    figure.tight_layout()
+    return _figure_png(figure)
+
+def _render_trash_type_chart(trash_counts):
+    # Sort by count (descending)
+    sorted_counts = sorted(trash_counts.items(), key=lambda x: x[1], reverse=True)
+    labels = [item[0] for item in sorted_counts]
+    values = [item[1] for item in sorted_counts]
+
+    figure = _new_figure((10, 8))
+    ax = figure.add_subplot()
+    ax.pie(values, labels=labels, autopct='%1.1f%%', startangle=90)
+    ax.set_title('Distribution of Detected Trash Types')
+    ax.axis('equal')
+    figure.tight_layout()
+    return _figure_png(figure)
+
+_CHART_RENDERERS = {
+    CHART_TRASH_TYPES: _render_trash_type_chart,
+    CHART_TIME_SERIES: _render_time_series_chart,
+}
+
+def generate_time_series_chart(daily_counts):
     """
     Generate time series chart of detections
     
     Args:
-        dates: List of detection dates
+        daily_counts: Dictionary with the number of detections per day ('YYYY-MM-DD'), as in the summary
     
     Returns:
         Base64 encoded PNG image
     """
-    if not dates:
-        return None
-    
-    # Convert to pandas Series for easier date handling
-    date_series = pd.Series(dates)
-    
-    # Count detections by day
-    counts_by_day = date_series.dt.date.value_counts().sort_index()
-    
-    # Create figure and plot
-    plt.figure(figsize=(10, 6))
-    plt.plot(counts_by_day.index, counts_by_day.values, marker='o', linestyle='-')
-    plt.title('Trash Detections Over Time')
-    plt.xlabel('Date')
-    plt.ylabel('Number of Detections')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    
-    # Save plot to in-memory file
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    
-    # Encode to base64 for embedding in HTML
-    img_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-    plt.close()
-    
-    return img_base64
+    png, _ = render_chart(CHART_TIME_SERIES, daily_counts)
+    return base64.b64encode(png).decode('utf-8') if png else None
 
 def generate_trash_type_chart(trash_counts):
     """
@@ -98,32 +211,8 @@ def generate_trash_type_chart(trash_counts):
     Returns:
         Base64 encoded PNG image
     """
-    if not trash_counts:
-        return None
-    
-    # Create figure and plot
-    plt.figure(figsize=(10, 8))
-    
-    # Sort by count (descending)
-    sorted_counts = sorted(trash_counts.items(), key=lambda x: x[1], reverse=True)
-    labels = [item[0] for item in sorted_counts]
-    values = [item[1] for item in sorted_counts]
-    
-    plt.pie(values, labels=labels, autopct='%1.1f%%', startangle=90)
-    plt.title('Distribution of Detected Trash Types')
-    plt.axis('equal')
-    plt.tight_layout()
-    
-    # Save plot to in-memory file
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    
-    # Encode to base64 for embedding in HTML
-    img_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-    plt.close()
-    
-    return img_base64
+    png, _ = render_chart(CHART_TRASH_TYPES, trash_counts)
+    return base64.b64encode(png).decode('utf-8') if png else None
 
 def generate_excel_report(detections):
     """
@@ -135,47 +224,9 @@ def generate_excel_report(detections):
     Returns:
         BytesIO object containing Excel file
     """
-    # Create DataFrame from detections
-    data = []
-    for detection in detections:
-        data.append({
-            'ID': detection.id,
-            'Image Path': detection.image_path,
-            'Trash Type': detection.trash_type,
-            'Confidence (%)': round(detection.confidence * 100, 2),
-            'Detection Date': detection.detection_date.strftime('%Y-%m-%d'),
-            'Detection Time': detection.detection_date.strftime('%H:%M:%S')
-        })
-    
-    df = pd.DataFrame(data)
-    
-    # Create Excel file in memory
+    # Same workbook as the /download_report export (see report_export.write_xlsx)
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, sheet_name='Trash Detections', index=False)
-        
-        # Get the xlsxwriter workbook and worksheet objects
-        workbook = writer.book
-        worksheet = writer.sheets['Trash Detections']
-        
-        # Add a chart sheet for trash type distribution
-        if data:
-            # Count trash types
-            trash_counts = df['Trash Type'].value_counts()
-            
-            # Create a separate sheet for trash counts
-            trash_counts.to_excel(writer, sheet_name='Trash Summary')
-            summary_sheet = writer.sheets['Trash Summary']
-            
-            # Create a pie chart
-            pie_chart = workbook.add_chart({'type': 'pie'})
-            pie_chart.add_series({
-                'name': 'Trash Distribution',
-                'categories': ['Trash Summary', 1, 0, len(trash_counts), 0],
-                'values': ['Trash Summary', 1, 1, len(trash_counts), 1],
-            })
-            pie_chart.set_title({'name': 'Distribution of Trash Types'})
-            summary_sheet.insert_chart('D2', pie_chart)
-    
+    write_xlsx([[(detection.id, detection.image_path, detection.trash_type, detection.confidence,
+                  detection.detection_date) for detection in detections]], output)
     output.seek(0)
     return output
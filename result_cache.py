@@ -0,0 +1,165 @@
+"""
+Result cache for uploads.
+
+Field teams often upload the same photos and clips again. Results are cached under the
+SHA-256 of the uploaded file plus the model version (a digest of the checkpoint and the
+configured backend/precision), so a repeated upload returns the stored detections (and,
+for videos, the already encoded processed video) without running the model. Changing
+the model file changes the version, which empties the cache. Video entries point at the
+processed video of the user who uploaded the clip, so their key also holds the user id.
+
+The cache lives in the memory of the web process, holds at most RESULT_CACHE_SIZE
+entries and evicts the least recently used one. With RESULT_CACHE_PHASH, images that are
+not byte-identical but have a near-identical perceptual hash (dHash) and the same size,
+e.g. the same photo re-saved by a phone, also count as hits.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from flask import current_app
+from inference import file_sha256 # type: ignore
+
+logger = logging.getLogger(__name__)
+
+_cache_lock = threading.Lock()
+_version_lock = threading.Lock()
+_model_digests = {} # (path, size, mtime_ns) -> SHA-256 of the model file
+
+# Entry kinds
+ENTRY_IMAGE = 'image'
+ENTRY_VIDEO = 'video'
+
+
+def model_version(config):
+    """
+    Version string of the configured model. The checkpoint is only re-hashed when its
+    size or modification time changes.
+    """
+    model_path = config['YOLO_MODEL_PATH']
+    try:
+        stat = os.stat(model_path)
+    except OSError:
+        return None
+    stat_key = (model_path, stat.st_size, stat.st_mtime_ns)
+    with _version_lock:
+        digest = _model_digests.get(stat_key)
+        if digest is None:
+            _model_digests.clear()
+            digest = _model_digests[stat_key] = file_sha256(model_path)
+    return f"{digest[:16]}-{config['INFERENCE_BACKEND']}-{config['INFERENCE_PRECISION']}"
+
+
+def image_dhash(image):
+    """
+    64-bit difference hash of a PIL image: whether each pixel of a 9x8 grayscale
+    thumbnail is brighter than its right neighbour. Near-identical images have hashes
+    that differ in only a few bits.
+    """
+    from PIL import Image
+    pixels = list(image.convert('L').resize((9, 8), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | int(pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+class ResultCache:
+    """
+    LRU cache of upload results, keyed by (content hash, model version).
+
+    Entries are dicts with at least a 'kind' (ENTRY_IMAGE or ENTRY_VIDEO). Image entries
+    hold 'detections' (DetectionBatch), 'size' and optionally 'dhash'; video entries
+    hold the finished job's 'result' and the processed video's paths.
+    """
+
+    def __init__(self, max_entries=512, dhash_distance=None):
+        self.max_entries = max(int(max_entries), 1)
+        self.dhash_distance = dhash_distance # Max differing dHash bits for a near-duplicate hit; None = exact only
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, content_hash, version, dhash=None, size=None):
+        """
+        Returns the cached entry for a file, or None. If the exact file is not cached and
+        `dhash`/`size` are given, the closest image entry of the same size within
+        `dhash_distance` bits is returned.
+        """
+        if version is None:
+            return None
+        with self._lock:
+            self._check_version_locked(version)
+            entry = self._entries.get(content_hash)
+            if entry is not None:
+                self._entries.move_to_end(content_hash)
+                self.hits += 1
+                return entry
+            if dhash is not None and self.dhash_distance is not None:
+                best_key, best_distance = None, self.dhash_distance + 1
+                for key, candidate in self._entries.items():
+                    if candidate['kind'] != ENTRY_IMAGE or candidate.get('dhash') is None or candidate['size'] != size:
+                        continue
+                    distance = bin(candidate['dhash'] ^ dhash).count('1')
+                    if distance < best_distance:
+                        best_key, best_distance = key, distance
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.near_hits += 1
+                    return self._entries[best_key]
+            self.misses += 1
+            return None
+
+    def put(self, content_hash, version, entry):
+        if version is None:
+            return
+        with self._lock:
+            self._check_version_locked(version)
+            self._entries[content_hash] = entry
+            self._entries.move_to_end(content_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, content_hash):
+        with self._lock:
+            self._entries.pop(content_hash, None)
+
+    def _check_version_locked(self, version):
+        if version != self._version:
+            if self._entries:
+                logger.info(f"Model version changed to {version}; dropping {len(self._entries)} cached result(s).")
+            self._entries.clear()
+            self._version = version
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'near_hits': self.near_hits,
+                'misses': self.misses,
+            }
+
+
+def get_result_cache():
+    """
+    Returns the app's ResultCache, creating it on first use.
+
+    Returns:
+        ResultCache, or None if RESULT_CACHE_SIZE is 0
+    """
+    extensions = current_app.extensions
+    if 'result_cache' not in extensions:
+        config = current_app.config
+        with _cache_lock:
+            if 'result_cache' not in extensions:
+                extensions['result_cache'] = ResultCache(
+                    config['RESULT_CACHE_SIZE'],
+                    dhash_distance=config['RESULT_CACHE_PHASH_DISTANCE'] if config['RESULT_CACHE_PHASH'] else None,
+                ) if config['RESULT_CACHE_SIZE'] > 0 else None
+    return extensions['result_cache']
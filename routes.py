@@ -1,19 +1,31 @@
+import base64
 import os
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from io import BytesIO
 import json # For handling detection data if needed
-import pandas as pd
-from flask import render_template, url_for, flash, redirect, request, jsonify, send_file, current_app
+import struct
+import tempfile
+import time
+from flask import render_template, url_for, flash, redirect, request, jsonify, send_file, current_app, session, Response
 from flask_login import login_user, current_user, logout_user, login_required # type: ignore
+from sqlalchemy import and_, or_
 from werkzeug.utils import secure_filename
 from PIL import Image # For image processing
-import cv2 # For video processing and livestream frame decoding
-import numpy as np
-from app import app, db # type: ignore
-from models import User, DetectionResult # type: ignore
-from forms import LoginForm, RegistrationForm, UploadForm, ContactForm # type: ignore
-from report_generator import generate_trash_summary, generate_trash_type_chart # Import report generator functions
+from app import app, db, sock # type: ignore
+from models import User, DetectionResult, ProcessedVideo, VideoFrameDetection # type: ignore
+from forms import LoginForm, RegistrationForm, UploadForm, UploadOptionsForm, ContactForm # type: ignore
+from report_generator import CHART_TIME_SERIES, CHART_TRASH_TYPES, generate_trash_summary, render_chart # Import report generator functions
+from report_export import EXPORT_CSV, EXPORT_MIMETYPES, EXPORT_PARQUET, EXPORT_XLSX, iter_detection_chunks, stream_csv, write_parquet, write_xlsx # type: ignore
+from detections import DetectionWriter, save_detection_results, unpack_frame_boxes # type: ignore
+from inference import file_sha256, get_inference_backend # type: ignore
+from batching import get_frame_batcher # type: ignore
+from frame_decoding import get_frame_decoder # type: ignore
+from motion_gate import create_motion_gate, get_motion_gate, get_motion_gate_stats # type: ignore
+from job_queue import get_job_manager, JobQueueFull, UserJobLimitReached # type: ignore
+from chunked_upload import ChunkedUploadError, get_upload_store # type: ignore
+from thumbnails import generate_upload_thumbnails, poster_path, thumbnail_path # type: ignore
+from result_cache import ENTRY_IMAGE, get_result_cache, image_dhash, model_version # type: ignore
 
 @app.route('/')
 @app.route('/home')
@@ -22,54 +34,6 @@ def home():
         return redirect(url_for('login'))
     return render_template('home.html', title='Home')
 
-def parse_yolo_results_for_db(yolo_output_list, model_class_names):
-    """
-    Parses the output from a YOLO model (ultralytics format) into a list of detections
-    suitable for database storage and frontend display.
-    Each detection includes trash_type, confidence, and bbox.
-    """
-    detections = []
-    if not yolo_output_list or not yolo_output_list[0]: # yolo_output_list is a list of Results objects
-        current_app.logger.warning("parse_yolo_results_for_db: yolo_output_list is empty or invalid.")
-        return detections
-
-    results = yolo_output_list[0]  # Process the first (and usually only) Results object
-
-    # Ensure boxes, confidences, and classes are available and on CPU as numpy arrays
-    if results.boxes is None:
-        current_app.logger.warning("parse_yolo_results_for_db: No 'boxes' attribute in YOLO results.")
-        return detections
-        
-    boxes_data = results.boxes # This is a Boxes object
-    
-    if not hasattr(boxes_data, 'xyxy') or not hasattr(boxes_data, 'conf') or not hasattr(boxes_data, 'cls'):
-        current_app.logger.warning("parse_yolo_results_for_db: YOLO results.boxes object missing xyxy, conf, or cls attributes.")
-        return detections
-
-    if len(boxes_data.xyxy) == 0:
-        current_app.logger.info("parse_yolo_results_for_db: YOLO results.boxes.xyxy is empty (no detections).")
-        return detections
-
-    # Iterate through detected boxes
-    for i in range(len(boxes_data.xyxy)):
-        try:
-            x1, y1, x2, y2 = boxes_data.xyxy[i].cpu().numpy()
-            confidence = boxes_data.conf[i].cpu().numpy()
-            class_id = int(boxes_data.cls[i].cpu().numpy())
-            
-            detections.append({
-                "trash_type": model_class_names.get(class_id, f"Class_{class_id}"), # Use .get for safety
-                "confidence": float(confidence),
-                "bbox": {"x": int(x1), "y": int(y1), "width": int(x2 - x1), "height": int(y2 - y1)}
-                # If you want to include segmentation masks (polygons) later:
-                # "mask_xy": results.masks.xy[i].tolist() if results.masks and results.masks.xy else None 
-            })
-        except Exception as e:
-            current_app.logger.error(f"parse_yolo_results_for_db: Error processing individual detection {i}: {e}", exc_info=True)
-            continue # Skip this problematic detection
-    current_app.logger.info(f"parse_yolo_results_for_db: Parsed {len(detections)} detections.")
-    return detections
-
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
@@ -116,168 +80,360 @@ def about():
 @login_required
 def upload():
     form = UploadForm()
-    yolo_model = current_app.yolo_model # Get the loaded YOLO model
+    inference_backend = get_inference_backend() # Loads the model on first use
 
     if form.validate_on_submit(): # This will work with fetch if FormData is sent
         file = form.file.data
-        filename_prefix_uuid = str(uuid.uuid4())
-        filename = filename_prefix_uuid + '_' + secure_filename(file.filename)
+        filename = upload_filename(file.filename)
         # Absolute path for saving the file
         absolute_file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(absolute_file_path)
         current_app.logger.info(f"File saved to absolute path: {absolute_file_path}")
-        # Relative path for database and url_for, relative to 'static' folder
-        file_path_for_db_and_url = f'uploads/{filename}' # e.g., 'uploads/image.jpg'
+        return process_upload(filename, form, inference_backend)
         
-        detection_results_list = []
+    return render_template('upload.html', title='Upload', form=form)
 
-        if not yolo_model:
-            current_app.logger.error("YOLO model not loaded. Cannot process file for AJAX request.")
-            return jsonify({"success": False, "message": "Detection model is not loaded on the server."}), 503
+def upload_filename(original_filename):
+    """Unique name in the upload folder for an uploaded file."""
+    filename_prefix_uuid = str(uuid.uuid4())
+    return filename_prefix_uuid + '_' + secure_filename(original_filename)
 
-        file_ext = os.path.splitext(filename)[1].lower()
-        
-        try:
-            if file_ext in ['.jpg', '.jpeg', '.png']:
-                current_app.logger.info(f"Processing image with YOLO: {absolute_file_path}")
-                img_pil = Image.open(absolute_file_path).convert("RGB") # Ensure RGB
-                yolo_raw_results = yolo_model(img_pil, verbose=False) # verbose=False to reduce console spam
-                current_app.logger.debug(f"Raw YOLO results for image: {yolo_raw_results}")
-
-                model_names = yolo_model.names if hasattr(yolo_model, 'names') and yolo_model.names else {i: f'class_{i}' for i in range(80)}
-                detection_results_list = parse_yolo_results_for_db(yolo_raw_results, model_names)
-                current_app.logger.info(f"YOLO image detection results: {detection_results_list}")
-
-            elif file_ext in ['.mp4', '.avi', '.mov']:
-                current_app.logger.info(f"Starting full video processing with YOLO: {absolute_file_path}")
-
-                # Define output path for processed video
-                output_extension = '.mp4' # Standardize output to MP4
-                input_filename_base = os.path.splitext(filename)[0] # Contains UUID and original name
-                processed_video_filename = f"processed_{input_filename_base}{output_extension}" # Always .mp4
-                processed_video_path_abs = os.path.join(app.config['PROCESSED_FOLDER'], processed_video_filename) # Absolute path
-                processed_video_url_for_frontend = url_for('static', filename=f'processed_videos/{processed_video_filename}')
-
-                cap = cv2.VideoCapture(absolute_file_path)
-                if not cap.isOpened():
-                    current_app.logger.error(f"Could not open video file for processing: {absolute_file_path}")
-                    return jsonify({"success": False, "message": "Could not open video file."}), 500
-
-                fps = cap.get(cv2.CAP_PROP_FPS) # Get FPS from original video
-                if fps <= 0 or fps > 120: # Sanity check and default for FPS
-                    current_app.logger.warning(f"Original video FPS ({fps}) is invalid or out of range. Defaulting to 25 FPS for output.")
-                    fps = 25.0
-
-                frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                
-                # Use H.264 (avc1) for MP4 output. Fallback to mp4v if avc1 fails.
-                # H.264 is highly compatible for web playback.
-                fourcc_h264 = cv2.VideoWriter_fourcc(*'avc1') # Preferred for MP4/H.264
-                fourcc_mp4v = cv2.VideoWriter_fourcc(*'mp4v') # Fallback MPEG-4
-
-                out_writer = cv2.VideoWriter(processed_video_path_abs, fourcc_h264, fps, (frame_width, frame_height))
-                
-                if not out_writer.isOpened():
-                    current_app.logger.warning(f"VideoWriter failed to open with H.264 (avc1) for {processed_video_path_abs}. Trying fallback MPEG-4 (mp4v).")
-                    out_writer = cv2.VideoWriter(processed_video_path_abs, fourcc_mp4v, fps, (frame_width, frame_height))
-
-                if not out_writer.isOpened():
-                    current_app.logger.error(f"Could not open VideoWriter for: {processed_video_path_abs} even with fallback FourCC.")
-                    cap.release()
-                    return jsonify({"success": False, "message": "Could not initialize video writer for output."}), 500
-                current_app.logger.info(f"VideoWriter opened successfully for {processed_video_path_abs}")
-                all_video_detections_summary = [] # Store aggregated detections for JSON response
-
-                while True:
-                    ret, frame_cv2 = cap.read()
-                    if not ret:
-                        break 
-
-                    img_rgb = cv2.cvtColor(frame_cv2, cv2.COLOR_BGR2RGB)
-                    yolo_raw_results = yolo_model(img_rgb, verbose=False)
-                    
-                    model_names = yolo_model.names if hasattr(yolo_model, 'names') and yolo_model.names else {i: f'class_{i}' for i in range(80)}
-                    frame_detections = parse_yolo_results_for_db(yolo_raw_results, model_names)
-                    
-                    for det in frame_detections:
-                        bbox = det['bbox']
-                        x, y, w, h = bbox['x'], bbox['y'], bbox['width'], bbox['height']
-                        label = f"{det['trash_type']}: {det['confidence']:.2f}"
-                        color = (0, 255, 0) 
-                        cv2.rectangle(frame_cv2, (x, y), (x + w, y + h), color, 2)
-                        cv2.putText(frame_cv2, label, (x, y - 10 if y - 10 > 10 else y + 10), 
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-                    
-                    out_writer.write(frame_cv2)
-                    all_video_detections_summary.extend(frame_detections) 
-                    detection_results_list.extend(frame_detections) # Also add to the main list for DB saving
-
-                cap.release()
-                out_writer.release()
-                current_app.logger.info(f"Processed video saved to: {processed_video_path_abs}")
-                
-                # For videos, we return JSON directly with the processed video URL
-                # and also save all detections to DB below
+def process_upload(filename, form, inference_backend):
+    """
+    Runs detection on a file saved in the upload folder (by upload() or a finished
+    chunked upload) and returns the JSON response for the client.
+
+    Args:
+        filename: Name of the file in UPLOAD_FOLDER
+        form: UploadOptionsForm (or UploadForm) with the video options
+        inference_backend: As returned by get_inference_backend()
+    """
+    absolute_file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    # Relative path for database and url_for, relative to 'static' folder
+    file_path_for_db_and_url = f'uploads/{filename}' # e.g., 'uploads/image.jpg'
 
+    if not inference_backend:
+        current_app.logger.error("YOLO model not loaded. Cannot process file for AJAX request.")
+        return jsonify({"success": False, "message": "Detection model is not loaded on the server."}), 503
+
+    file_ext = os.path.splitext(filename)[1].lower()
+    
+    try:
+        # Files uploaded before are answered from the result cache (see result_cache.py)
+        result_cache = get_result_cache()
+        if result_cache is not None:
+            content_hash = file_sha256(absolute_file_path)
+            cache_version = model_version(app.config)
+
+        if file_ext in ['.jpg', '.jpeg', '.png']:
+            img_pil = Image.open(absolute_file_path).convert("RGB") # Ensure RGB
+            cached = None
+            if result_cache is not None:
+                dhash = image_dhash(img_pil) if result_cache.dhash_distance is not None else None
+                cached = result_cache.get(content_hash, cache_version, dhash, img_pil.size)
+            if cached is not None:
+                current_app.logger.info(f"Using cached detections for image: {absolute_file_path}")
+                detection_results = cached['detections']
             else:
-                current_app.logger.warning(f"Unsupported file format for YOLO: {file_ext}")
-                return jsonify({"success": False, "message": f"Unsupported file format: {file_ext}. Please upload an image or video."}), 415
+                current_app.logger.info(f"Processing image with YOLO: {absolute_file_path}")
+                detection_results, = inference_backend.predict([img_pil])
+                if result_cache is not None:
+                    result_cache.put(content_hash, cache_version, {
+                        'kind': ENTRY_IMAGE, 'detections': detection_results, 'size': img_pil.size, 'dhash': dhash})
+            current_app.logger.info(f"YOLO image detection results: {len(detection_results)} detections")
 
             # Save detection results to database
-            if detection_results_list: # Only attempt to save if there are results
-                current_app.logger.info(f"Preparing to save {len(detection_results_list)} detections to database.")
-                for result_item in detection_results_list:
-                    bbox_data = result_item.get('bbox') 
-                    # For videos, image_path will be the path to the original uploaded video
-                    detection = DetectionResult(
-                        user_id=current_user.id,
-                        image_path=file_path_for_db_and_url, # Use relative path for DB
-                        trash_type=result_item['trash_type'],
-                        confidence=result_item['confidence'],
-                        bbox_x=bbox_data.get('x') if bbox_data else None,
-                        bbox_y=bbox_data.get('y') if bbox_data else None,
-                        bbox_width=bbox_data.get('width') if bbox_data else None,
-                        bbox_height=bbox_data.get('height') if bbox_data else None
-                    )
-                    db.session.add(detection)
-                db.session.commit()
-                current_app.logger.info("Detections committed to database.")
-            else:
-                current_app.logger.info("No detections found by YOLO, nothing to save to database for this file.")
+            save_detection_results(current_user.id, file_path_for_db_and_url, detection_results)
+            generate_upload_thumbnails(app.config, absolute_file_path, img_pil)
+
+            return jsonify({
+                "success": True,
+                "message": "Image uploaded and analyzed successfully!" if len(detection_results) else "Image processed, but no trash was detected.",
+                "image_url": url_for('static', filename=file_path_for_db_and_url.replace("\\", "/")),
+                "thumbnail_url": upload_thumbnail_url(file_path_for_db_and_url),
+                "detections": detection_results.to_dicts(),
+                "cached": cached is not None,
+            })
 
-            # Return JSON response based on file type
-            if file_ext in ['.mp4', '.avi', '.mov', '.mkv', '.webm', '.wmv', '.flv']: # Check original extension
+        elif file_ext in ['.mp4', '.avi', '.mov']:
+            sampling = {
+                "mode": form.sampling_mode.data or app.config['VIDEO_SAMPLING_MODE'],
+                "stride": form.keyframe_stride.data or app.config['VIDEO_KEYFRAME_STRIDE'],
+                "motion_threshold": form.motion_threshold.data if form.motion_threshold.data is not None else app.config['VIDEO_MOTION_THRESHOLD'],
+                "max_gap": app.config['VIDEO_MAX_KEYFRAME_GAP'],
+            }
+            # The poster frame is shown while the video is processed and in the reports
+            thumbnails = generate_upload_thumbnails(app.config, absolute_file_path)
+            poster_url = url_for('static', filename=poster_path(file_path_for_db_and_url)) if thumbnails else None
+            cached = None
+            if result_cache is not None:
+                # Other sampling settings give other results, so they are part of the key. A hit reuses the
+                # ProcessedVideo row and output of the earlier upload, so entries are per user.
+                content_hash = f"{content_hash}:{current_user.id}:{json.dumps(sampling, sort_keys=True)}"
+                cached = result_cache.get(content_hash, cache_version)
+            if cached is not None and os.path.exists(cached['processed_video_path']):
+                # Same video processed before: reuse its processed video and tracked objects
+                result = cached['result']
+                with DetectionWriter(current_user.id, file_path_for_db_and_url) as writer:
+                    writer.add_object_dicts(result['video_id'], result['detections'])
+                current_app.logger.info(f"Using cached result of video {result['video_id']} for: {absolute_file_path}")
                 return jsonify({
                     "success": True,
-                    "processed_video_url": processed_video_url_for_frontend, # URL to the processed .mp4 file
-                    "processed_video_type": "video/mp4", # MIME type is now consistently video/mp4
-                    "detections": all_video_detections_summary 
+                    "message": "This video was processed before; showing the stored result.",
+                    "cached": True,
+                    "video_id": result['video_id'],
+                    "detections": result['detections'],
+                    "processed_video_url": cached['processed_video_url'],
+                    "processed_video_type": cached.get('processed_video_type', 'video/mp4'),
+                    "poster_url": poster_url,
                 })
-            elif file_ext in ['.jpg', '.jpeg', '.png']:
-                return jsonify({
-                    "success": True,
-                    "message": "Image uploaded and analyzed successfully!" if detection_results_list else "Image processed, but no trash was detected.",
-                    "image_url": url_for('static', filename=file_path_for_db_and_url.replace("\\", "/")),
-                    "detections": detection_results_list
+            if cached is not None:
+                result_cache.discard(content_hash) # Processed video was deleted
+
+            # Define output path for processed video (an MP4, or a folder with an HLS playlist)
+            from video_processing import OUTPUT_MIMETYPES, processed_video_name, video_encoder_settings # Imports OpenCV; loaded on first use
+            encoder = video_encoder_settings(app.config)
+            processed_video_type = OUTPUT_MIMETYPES[encoder['format']]
+            input_filename_base = os.path.splitext(filename)[0] # Contains UUID and original name
+            processed_video_filename = processed_video_name(input_filename_base, encoder['format'])
+            processed_video_path_abs = os.path.join(app.config['PROCESSED_FOLDER'], processed_video_filename) # Absolute path
+            processed_video_url_for_frontend = url_for('static', filename=f'processed_videos/{processed_video_filename}')
+
+            # Videos are processed by the background worker pool; the client polls /jobs/<id>
+            try:
+                job = get_job_manager().submit(current_user.id, {
+                    "input_path": absolute_file_path,
+                    "db_image_path": file_path_for_db_and_url,
+                    "output_path": processed_video_path_abs,
+                    "db_processed_video_path": f'processed_videos/{processed_video_filename}',
+                    "processed_video_url": processed_video_url_for_frontend,
+                    "processed_video_type": processed_video_type,
+                    "encoder": encoder,
+                    "sampling": sampling,
+                    "cache_key": [content_hash, cache_version] if result_cache is not None else None,
                 })
+            except (JobQueueFull, UserJobLimitReached) as e:
+                current_app.logger.warning(f"Rejected video job for user {current_user.id}: {e}")
+                return jsonify({"success": False, "message": str(e)}), 429
+
+            current_app.logger.info(f"Queued video {absolute_file_path} as job {job.id}")
+            return jsonify({
+                "success": True,
+                "message": "Video uploaded and queued for processing.",
+                "job_id": job.id,
+                "status_url": url_for('job_status', job_id=job.id),
+                "events_url": url_for('job_events', job_id=job.id),
+                "processed_video_url": processed_video_url_for_frontend,
+                "processed_video_type": processed_video_type,
+                "poster_url": poster_url,
+            }), 202
 
-        except Exception as e:
-            current_app.logger.error(f"Error during YOLO processing for upload: {e}", exc_info=True)
-            return jsonify({"success": False, "message": f"Error processing file: {str(e)}"}), 500
-        
-    return render_template('upload.html', title='Upload', form=form)
+        else:
+            current_app.logger.warning(f"Unsupported file format for YOLO: {file_ext}")
+            return jsonify({"success": False, "message": f"Unsupported file format: {file_ext}. Please upload an image or video."}), 415
+
+    except Exception as e:
+        current_app.logger.error(f"Error during YOLO processing for upload: {e}", exc_info=True)
+        return jsonify({"success": False, "message": f"Error processing file: {str(e)}"}), 500
+
+@app.route('/upload/sessions', methods=['POST'])
+@login_required
+def create_chunked_upload():
+    """
+    Starts a chunked upload (see chunked_upload.py). Expects JSON {"filename", "size"};
+    returns the upload id, the chunk size and count, and the chunks received so far.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        size = int(data.get('size', 0))
+        status = get_upload_store().create(current_user.id, str(data.get('filename', '')), size)
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid file size."}), 400
+    except ChunkedUploadError as e:
+        return jsonify({"success": False, "message": str(e)}), e.status
+    return jsonify({"success": True, **status}), 201
+
+@app.route('/upload/sessions/<upload_id>', methods=['GET', 'DELETE'])
+@login_required
+def chunked_upload_status(upload_id):
+    """Chunks received so far (to resume an interrupted upload), or DELETE to abandon the upload."""
+    store = get_upload_store()
+    try:
+        if request.method == 'DELETE':
+            store.discard(upload_id, current_user.id)
+            return jsonify({"success": True})
+        return jsonify({"success": True, **store.status(upload_id, current_user.id)})
+    except ChunkedUploadError as e:
+        return jsonify({"success": False, "message": str(e)}), e.status
+
+@app.route('/upload/sessions/<upload_id>/chunks/<int:index>', methods=['PUT'])
+@login_required
+def put_upload_chunk(upload_id, index):
+    """
+    Stores one chunk, sent as the raw request body. With an X-Chunk-SHA256 header the
+    chunk is only accepted if its SHA-256 matches.
+    """
+    try:
+        checksum = get_upload_store().write_chunk(
+            upload_id, current_user.id, index, request.stream, request.headers.get('X-Chunk-SHA256'))
+    except ChunkedUploadError as e:
+        return jsonify({"success": False, "message": str(e)}), e.status
+    return jsonify({"success": True, "index": index, "sha256": checksum})
+
+@app.route('/upload/sessions/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_chunked_upload(upload_id):
+    """
+    Finishes a chunked upload: the file is moved into the upload folder and processed
+    like a regular upload, with the video options of the posted form. The response is
+    the same as that of /upload.
+    """
+    form = UploadOptionsForm()
+    if not form.validate_on_submit():
+        errors = '; '.join(error for field_errors in form.errors.values() for error in field_errors)
+        return jsonify({"success": False, "message": errors or "Invalid upload options."}), 400
+    inference_backend = get_inference_backend() # Loads the model on first use
+
+    store = get_upload_store()
+    try:
+        metadata = store.get(upload_id, current_user.id)
+        filename = upload_filename(metadata['filename'])
+        store.finish(upload_id, current_user.id, os.path.join(app.config['UPLOAD_FOLDER'], filename))
+    except ChunkedUploadError as e:
+        return jsonify({"success": False, "message": str(e)}), e.status
+    current_app.logger.info(f"Chunked upload {upload_id} saved as: {filename}")
+    return process_upload(filename, form, inference_backend)
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    job = get_job_manager().get(job_id)
+    # Don't reveal whether other users' job ids exist
+    if job is None or job.user_id != current_user.id:
+        return jsonify({"success": False, "message": "Job not found."}), 404
+    return jsonify({"success": True, **job.to_dict()})
+
+# Seconds between keep-alive comments on an idle event stream
+JOB_EVENTS_HEARTBEAT = 15
+
+@app.route('/jobs/<job_id>/events')
+@login_required
+def job_events(job_id):
+    """
+    Server-Sent Events stream of a video job: 'started', 'progress', 'detections'
+    (per segment of frames: [frame_index, timestamp_ms, rows] for every frame with
+    detections, plus the objects whose tracks ended) and finally 'finished' (the same
+    data as /jobs/<id>) or 'failed'.
+
+    Only the most recent VIDEO_JOB_EVENT_BUFFER events are kept per job. A client that
+    reconnects (EventSource does this with the Last-Event-ID header) gets the events it
+    missed, as far as they are still buffered; the full per-frame data of a finished
+    video is at /videos/<video_id>/detections.
+    """
+    manager = get_job_manager()
+    job = manager.get(job_id)
+    # Don't reveal whether other users' job ids exist
+    if job is None or job.user_id != current_user.id:
+        return jsonify({"success": False, "message": "Job not found."}), 404
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('after') or 0)
+    except ValueError:
+        last_event_id = 0
+
+    def generate():
+        after = last_event_id
+        while True:
+            events = manager.wait_for_events(job, after, JOB_EVENTS_HEARTBEAT)
+            if not events:
+                if not job.is_active:
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            for event_id, name, data in events:
+                yield f"id: {event_id}\nevent: {name}\ndata: {json.dumps(data)}\n\n"
+            after = events[-1][0]
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def parse_time_offset(value):
+    """
+    Parses a time offset into seconds. Accepts seconds ('90', '90.5'),
+    'mm:ss' ('01:30') or 'hh:mm:ss' ('00:01:30').
+    """
+    parts = value.strip().split(':')
+    if not 1 <= len(parts) <= 3:
+        raise ValueError(f"Invalid time offset: {value}")
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + float(part)
+    if seconds < 0:
+        raise ValueError(f"Invalid time offset: {value}")
+    return seconds
+
+@app.route('/videos/<int:video_id>/detections')
+@login_required
+def video_detections(video_id):
+    """
+    Per-frame detections of a processed video, optionally limited to a time range,
+    e.g. /videos/3/detections?start=00:30&end=01:00
+    """
+    video = ProcessedVideo.query.filter_by(id=video_id, user_id=current_user.id).first()
+    if video is None:
+        return jsonify({"success": False, "message": "Video not found."}), 404
+
+    try:
+        start_seconds = parse_time_offset(request.args.get('start', '0'))
+        end_seconds = parse_time_offset(request.args['end']) if request.args.get('end') else None
+        limit = min(int(request.args.get('limit', 1000)), 5000)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    # Served by the (video_id, timestamp_ms) index
+    query = VideoFrameDetection.query.filter(
+        VideoFrameDetection.video_id == video.id,
+        VideoFrameDetection.timestamp_ms >= int(start_seconds * 1000)
+    )
+    if end_seconds is not None:
+        query = query.filter(VideoFrameDetection.timestamp_ms <= int(end_seconds * 1000))
+    frames = query.order_by(VideoFrameDetection.timestamp_ms).limit(limit + 1).all()
+
+    class_names = {int(class_id): name for class_id, name in json.loads(video.class_names or '{}').items()}
+    return jsonify({
+        "success": True,
+        "video": video.to_dict(),
+        "truncated": len(frames) > limit,
+        "frames": [
+            {
+                "frame_index": frame.frame_index,
+                "timestamp": frame.timestamp_ms / 1000,
+                "detections": unpack_frame_boxes(frame.boxes, class_names).to_dicts()
+            }
+            for frame in frames[:limit]
+        ]
+    })
 
 @app.route('/livestream')
 @login_required
 def livestream():
     return render_template('livestream.html', title='Live Stream')
 
+def decode_frame(frame_bytes):
+    """
+    Decodes an encoded (JPEG/PNG) livestream frame at the model's input size (see frame_decoding.py).
+
+    Returns:
+        Tuple (image_bgr, (scale_x, scale_y)) with the factors that map boxes back to the
+        sent frame, or (None, None) if the frame can't be decoded
+    """
+    return get_frame_decoder().decode(frame_bytes)
+
 @app.route('/process_frame', methods=['POST'])
 @login_required
 def process_frame():
-    yolo_model = current_app.yolo_model
-    if not yolo_model:
+    # Frames from concurrent requests are run through the model in batches (see batching.py)
+    frame_batcher = get_frame_batcher()
+    if not frame_batcher:
         current_app.logger.error("YOLO model not loaded, cannot process frame.")
         return jsonify({"success": False, "error": "Detection model not available"}), 500
 
@@ -287,22 +443,16 @@ def process_frame():
     frame_file = request.files['frame']
     
     try:
-        # Read the image file stream into a numpy array
-        filestr = frame_file.read()
-        npimg = np.frombuffer(filestr, np.uint8)
-        # Decode the image from the numpy array using OpenCV
-        img_cv2 = cv2.imdecode(npimg, cv2.IMREAD_COLOR)
+        image, scale = decode_frame(frame_file.read())
         
-        if img_cv2 is None:
+        if image is None:
             current_app.logger.error("Could not decode frame from blob.")
             return jsonify({"success": False, "error": "Could not decode frame"}), 400
         
-        # YOLO expects RGB, OpenCV loads as BGR
-        img_rgb = cv2.cvtColor(img_cv2, cv2.COLOR_BGR2RGB)
-        
-        yolo_raw_results = yolo_model(img_rgb, verbose=False)
-        model_names = yolo_model.names if hasattr(yolo_model, 'names') and yolo_model.names else {i: f'class_{i}' for i in range(80)}
-        detection_results_list = parse_yolo_results_for_db(yolo_raw_results, model_names)
+        # Frames of a static scene reuse the session's last detections (see motion_gate.py)
+        motion_gate = get_motion_gate(session.setdefault('livestream_id', uuid.uuid4().hex))
+        detection_results, gated = motion_gate.detect(image, frame_batcher.predict)
+        detection_results = detection_results.scaled(*scale)
 
         # Save significant detections to database (optional for livestream, adjust as needed)
         # For livestream, you might not want to save every frame's detections to DB.
@@ -310,77 +460,268 @@ def process_frame():
         # Also, image_path for livestream frames needs careful consideration.
         # For now, let's not save livestream frames to DB to keep it simpler.
         # If you need to save them, you'd save the frame to a file first.
-        # significant_results = [r for r in detection_results_list if r['confidence'] > 0.7]
+        # significant_results = detection_results.conf > 0.7
         # if significant_results:
         #     # temp_frame_path = os.path.join(app.config['UPLOAD_FOLDER'], f'live_frame_{uuid.uuid4()}.jpg')
         #     # cv2.imwrite(temp_frame_path, img_cv2) # Save the BGR frame
         #     # ... save to DB ...
 
-        return jsonify({"success": True, "results": detection_results_list})
+        return jsonify({"success": True, "results": detection_results.to_dicts(), "gated": gated})
     except Exception as e:
         current_app.logger.error(f"Error processing livestream frame with YOLO: {e}", exc_info=True)
         return jsonify({"success": False, "error": str(e)}), 500
 
+@sock.route('/ws/livestream')
+def livestream_socket(ws):
+    """
+    Persistent livestream connection, used instead of /process_frame by livestream.js.
+
+    The client sends binary messages: a 4-byte big-endian sequence number followed by
+    the JPEG frame. The server answers every processed frame with a JSON message
+    {"type": "detections", "seq", "boxes": [[x, y, width, height, confidence, class_id], ...],
+    "server_ms", "dropped", "gated"}; class names and the model input size (imgsz, which the
+    client caps its capture size at) are sent once in the initial "hello" message.
+    Frames that arrive while the previous one is being processed are dropped, only the
+    newest one is processed next (latest frame wins), so a slow server never works
+    through a backlog of stale frames. While the scene does not change, the model is not
+    run and the last detections are sent again ("gated": true, see motion_gate.py).
+    """
+    if not current_user.is_authenticated:
+        ws.close(reason=1008, message='Login required')
+        return
+    frame_batcher = get_frame_batcher()
+    if not frame_batcher:
+        current_app.logger.error("YOLO model not loaded, cannot process frame.")
+        ws.send(json.dumps({"type": "error", "error": "Detection model not available"}))
+        return
+
+    ws.send(json.dumps({
+        "type": "hello",
+        "names": frame_batcher.inference_backend.names,
+        "imgsz": frame_batcher.inference_backend.imgsz,
+        "max_fps": current_app.config['LIVESTREAM_MAX_FPS'],
+    }))
+    motion_gate = create_motion_gate()
+    dropped = 0
+    while True:
+        message = ws.receive()
+        # Latest frame wins: skip to the newest frame that has arrived
+        while True:
+            newer = ws.receive(timeout=0)
+            if newer is None:
+                break
+            message = newer
+            dropped += 1
+        if not isinstance(message, (bytes, bytearray)) or len(message) <= 4:
+            continue
+
+        started = time.perf_counter()
+        seq, = struct.unpack('>I', message[:4])
+        try:
+            image, scale = decode_frame(message[4:])
+            if image is None:
+                ws.send(json.dumps({"type": "error", "seq": seq, "error": "Could not decode frame"}))
+                continue
+            detection_results, gated = motion_gate.detect(image, frame_batcher.predict)
+            detection_results = detection_results.scaled(*scale)
+        except Exception as e:
+            current_app.logger.error(f"Error processing livestream frame with YOLO: {e}", exc_info=True)
+            ws.send(json.dumps({"type": "error", "seq": seq, "error": str(e)}))
+            continue
+        ws.send(json.dumps({
+            "type": "detections",
+            "seq": seq,
+            "boxes": detection_results.to_rows(),
+            "server_ms": round((time.perf_counter() - started) * 1000, 1),
+            "dropped": dropped,
+            "gated": gated,
+        }, separators=(',', ':')))
+
+@app.route('/process_frame/stats')
+@login_required
+def process_frame_stats():
+    frame_batcher = current_app.extensions.get('frame_batcher')
+    if frame_batcher is None:
+        return jsonify({"success": True, "stats": None}) # No frame processed yet
+    return jsonify({
+        "success": True,
+        "max_batch_size": frame_batcher.max_batch_size,
+        "max_wait_ms": frame_batcher.max_wait * 1000,
+        "stats": frame_batcher.stats.to_dict(),
+        "motion_gate": get_motion_gate_stats().to_dict(),
+    })
+
+def upload_thumbnail_url(media_path):
+    """
+    URL of the thumbnail of an upload (path relative to 'static'), or None if it has
+    none (yet), e.g. uploads from before thumbnails were generated.
+    """
+    if app.config['THUMBNAIL_SIZE'] <= 0:
+        return None
+    path = thumbnail_path(media_path, app.config['THUMBNAIL_FORMAT'])
+    if not os.path.exists(os.path.join(app.static_folder, path)):
+        return None
+    return url_for('static', filename=path)
+
+def encode_detections_cursor(detection):
+    """Opaque cursor pointing after `detection` in the newest-first detection list."""
+    return base64.urlsafe_b64encode(f"{detection.detection_date.isoformat()}|{detection.id}".encode()).decode()
+
+def decode_detections_cursor(cursor):
+    """Inverse of encode_detections_cursor: returns (detection_date, id)."""
+    try:
+        detection_date, detection_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(detection_date), int(detection_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def _query_arg(name, parse, message):
+    """
+    Parses the query parameter `name` with `parse`; None if it is missing or empty.
+    Raises ValueError(message) if it can't be parsed, so the client is told which
+    parameter is wrong rather than shown the parser's error.
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return parse(value)
+    except ValueError:
+        raise ValueError(message) from None
+
+@app.route('/detections')
+@login_required
+def list_detections():
+    """
+    Detections of the current user, newest first, one page at a time (used by the
+    reports table), e.g. /detections?trash_type=bottle&start=2026-01-01&end=2026-01-31&min_confidence=0.5
+
+    Pages are selected by keyset pagination on (detection_date, id): pass the
+    `next_cursor` of a page as `cursor` to get the next one. Unlike OFFSET, every page is
+    a range scan of the (user_id, detection_date) or (user_id, trash_type, detection_date)
+    index, so late pages are as fast as the first.
+    """
+    def parse_date(value):
+        return datetime.strptime(value, '%Y-%m-%d')
+
+    try:
+        limit = _query_arg('limit', int, "limit must be an integer")
+        limit = min(max(limit if limit is not None else 50, 1), 200)
+        cursor = decode_detections_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        start = _query_arg('start', parse_date, "start must be YYYY-MM-DD")
+        end = _query_arg('end', parse_date, "end must be YYYY-MM-DD")
+        if end is not None:
+            end += timedelta(days=1)
+        min_confidence = _query_arg('min_confidence', float, "min_confidence must be a number")
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    query = DetectionResult.query.filter(DetectionResult.user_id == current_user.id)
+    if request.args.get('trash_type'):
+        query = query.filter(DetectionResult.trash_type == request.args['trash_type'])
+    if start is not None:
+        query = query.filter(DetectionResult.detection_date >= start)
+    if end is not None:
+        query = query.filter(DetectionResult.detection_date < end) # End date is inclusive
+    if min_confidence is not None:
+        query = query.filter(DetectionResult.confidence >= min_confidence)
+    if cursor is not None:
+        cursor_date, cursor_id = cursor
+        query = query.filter(or_(
+            DetectionResult.detection_date < cursor_date,
+            and_(DetectionResult.detection_date == cursor_date, DetectionResult.id < cursor_id),
+        ))
+    detections = query.order_by(DetectionResult.detection_date.desc(), DetectionResult.id.desc()).limit(limit + 1).all()
+
+    has_more = len(detections) > limit
+    detections = detections[:limit]
+    thumbnail_urls = {} # Rows of one upload share its thumbnail
+    for detection in detections:
+        if detection.image_path not in thumbnail_urls:
+            thumbnail_urls[detection.image_path] = upload_thumbnail_url(detection.image_path)
+    return jsonify({
+        "success": True,
+        "detections": [
+            {**detection.to_dict(), "media_url": url_for('static', filename=detection.image_path),
+             "thumbnail_url": thumbnail_urls[detection.image_path]}
+            for detection in detections
+        ],
+        "next_cursor": encode_detections_cursor(detections[-1]) if has_more else None,
+    })
+
 @app.route('/reports')
 @login_required
 def reports():
-    # Fetch all detections for the current user
-    detections = DetectionResult.query.filter_by(user_id=current_user.id).order_by(DetectionResult.detection_date.desc()).all()
-    
-    # Generate summary statistics using the report_generator
-    summary_data = generate_trash_summary(detections)
-    
-    # Generate pie chart for trash types
-    pie_chart_base64 = None
-    if summary_data['trash_counts']:
-        pie_chart_base64 = generate_trash_type_chart(summary_data['trash_counts'])
-        
-    return render_template('reports.html', title='Reports', 
-                           detections=detections, # Still pass individual detections if needed for a table
-                           summary=summary_data, pie_chart=pie_chart_base64)
+    # Summary statistics come from the daily rollup; the detection table loads its pages from /detections
+    summary_data = generate_trash_summary(current_user.id)
+    return render_template('reports.html', title='Reports', summary=summary_data)
+
+@app.route('/reports/charts/<kind>.png')
+@login_required
+def report_chart(kind):
+    """
+    PNG version of a reports chart (trash_types or time_series), e.g. for saving or
+    embedding elsewhere. Charts are cached by their input counts and served with the
+    cache key as ETag, so unchanged charts are neither re-rendered nor re-sent.
+    """
+    summary_data = generate_trash_summary(current_user.id)
+    if kind == CHART_TRASH_TYPES:
+        counts = summary_data['trash_counts']
+    elif kind == CHART_TIME_SERIES:
+        counts = summary_data['daily_counts']
+    else:
+        return jsonify({'success': False, 'message': 'Unknown chart.'}), 404
+    png, key = render_chart(kind, counts)
+    if png is None:
+        return jsonify({'success': False, 'message': 'No detections to chart yet.'}), 404
+    # no-cache + ETag: browsers revalidate and get a 304 while the counts are unchanged
+    return send_file(BytesIO(png), mimetype='image/png', etag=key, download_name=f'trash_{kind}.png')
 
 @app.route('/download_report')
 @login_required
 def download_report():
-    detections = DetectionResult.query.filter_by(user_id=current_user.id).order_by(DetectionResult.detection_date.desc()).all()
-    
-    # Create DataFrame from detections
-    data = []
-    for detection in detections:
-        data.append({
-            'ID': detection.id,
-            'Image Path': detection.image_path,
-            'Trash Type': detection.trash_type,
-            'Confidence': f"{detection.confidence:.2f}",
-            'Detection Date': detection.detection_date.strftime('%Y-%m-%d'),
-            'Detection Time': detection.detection_date.strftime('%H:%M:%S')
-        })
-    
-    df = pd.DataFrame(data)
-    
-    # Create Excel file in memory
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, sheet_name='Trash Detections', index=False)
-        
-        # Adjust column widths
-        worksheet = writer.sheets['Trash Detections']
-        for i, col in enumerate(df.columns):
-            max_width = max(
-                df[col].astype(str).map(len).max(),
-                len(col)
-            ) + 2
-            worksheet.set_column(i, i, max_width)
-    
-    output.seek(0)
+    """
+    Download all of the user's detections as ?format=xlsx (default), csv or parquet.
+    Rows are streamed from the database in chunks (see report_export.py).
+    """
+    export_format = request.args.get('format', EXPORT_XLSX)
+    if export_format not in EXPORT_MIMETYPES:
+        flash('Unknown report format.', 'danger')
+        return redirect(url_for('reports'))
+
+    chunks = iter_detection_chunks(db.engine, current_user.id, current_app.config['REPORT_EXPORT_CHUNK_SIZE'])
     
     # Generate filename with timestamp
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"trash_detection_report_{timestamp}.xlsx"
+    filename = f"trash_detection_report_{timestamp}.{export_format}"
+
+    if export_format == EXPORT_CSV:
+        return Response(stream_csv(chunks), mimetype=EXPORT_MIMETYPES[EXPORT_CSV],
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+    # XLSX and Parquet are written to a temporary file, deleted when the response is closed
+    output = tempfile.TemporaryFile()
+    try:
+        if export_format == EXPORT_PARQUET:
+            write_parquet(chunks, output)
+        else:
+            write_xlsx(chunks, output)
+    except ImportError as e:
+        output.close()
+        # xlsxwriter and pyarrow are optional; name the one that is missing
+        missing_module = e.name.split('.')[0] if e.name else 'a required library'
+        format_name = 'Parquet' if export_format == EXPORT_PARQUET else 'Excel'
+        current_app.logger.warning(f"{format_name} export requested but {missing_module} is not installed.")
+        flash(f'{format_name} export is not available on this server ({missing_module} is not installed).', 'warning')
+        return redirect(url_for('reports'))
+    except Exception:
+        output.close()
+        raise
+    output.seek(0)
     
     return send_file(
         output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        mimetype=EXPORT_MIMETYPES[export_format],
         as_attachment=True,
         download_name=filename
     )
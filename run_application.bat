@@ -39,7 +39,7 @@ echo Upload directory checked.
 
 REM Initialize database
 echo Initializing database...
-python -c "from app import app, db; app.app_context().push(); db.create_all(); print('Database tables initialized/checked.')"
+python -m flask db upgrade
 
 REM Run the Flask application
 echo Starting Flask application...
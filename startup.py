@@ -0,0 +1,60 @@
+"""
+Startup timing report.
+
+app.py records how long each phase of booting the application takes (importing
+models/routes, creating tables, loading and warming up the model). The report is
+logged once the app is imported and again after the model warmup, printed by
+`flask startup-report` and, if STARTUP_TIMING_LOG is set, appended to that file as
+JSON lines so the startup cost can be tracked over time.
+"""
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Modules that are slow to import and should only be loaded when they are needed
+HEAVY_MODULES = ('ultralytics', 'torch', 'tensorflow', 'pandas', 'matplotlib', 'cv2')
+
+
+class StartupTimer:
+    """Collects the duration of named startup phases, in order."""
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def report(self):
+        return {
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+            'command': ' '.join([os.path.basename(sys.argv[0])] + sys.argv[1:]),
+            'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            'total_seconds': round(time.perf_counter() - self.started, 3),
+            'heavy_modules_loaded': [name for name in HEAVY_MODULES if name in sys.modules],
+        }
+
+    def log(self, log_path=None):
+        """Logs the report and appends it to `log_path` (JSON lines) if given."""
+        report = self.report()
+        phases = ', '.join(f"{name} {seconds:.3f}s" for name, seconds in report['phases'].items())
+        logger.info(f"Startup took {report['total_seconds']:.3f}s ({phases}); "
+                    f"heavy modules loaded: {', '.join(report['heavy_modules_loaded']) or 'none'}")
+        if log_path:
+            try:
+                with open(log_path, 'a') as f:
+                    f.write(json.dumps(report) + '\n')
+            except OSError as e:
+                logger.warning(f"Could not write startup timing log {log_path}: {e}")
+        return report
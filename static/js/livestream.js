@@ -6,9 +6,22 @@ let stream = null;
 let videoElement = null;
 let canvasElement = null;
 let canvasContext = null;
-let streamInterval = null;
+let streamInterval = null; // HTTP fallback only
 let isStreaming = false;
 
+// WebSocket streaming state (see /ws/livestream in routes.py)
+const FRAME_TIMEOUT_MS = 5000; // Give up waiting for the answer to a frame after this long
+let socket = null;
+let socketReady = false;
+let classNames = {};
+let minFrameInterval = 1000; // From the server's max frame rate
+let modelInputSize = null; // From the server: frames are captured no larger than this
+let frameSeq = 0;
+let inFlight = null; // Frame sent but not answered yet: {seq, sentAt}
+let lastFrameSentAt = 0;
+let rttEstimate = null; // Smoothed round-trip time in ms
+let nextFrameTimer = null;
+
 function initLivestreamPage() {
     console.log('Initializing livestream page');
     
@@ -64,13 +77,8 @@ async function startStreaming() {
             videoElement.srcObject = stream;
             videoElement.play();
             
-            // Set the canvas size to match the video
-            videoElement.addEventListener('loadedmetadata', () => {
-                if (canvasElement) {
-                    canvasElement.width = videoElement.videoWidth;
-                    canvasElement.height = videoElement.videoHeight;
-                }
-            });
+            // Set the canvas size to match the video (capped at the model input size)
+            videoElement.addEventListener('loadedmetadata', resizeCaptureCanvas);
             
             isStreaming = true;
             
@@ -87,7 +95,7 @@ async function startStreaming() {
             if (stopButton) stopButton.style.display = 'inline-block';
             
             // Start processing frames
-            streamInterval = setInterval(processFrame, 1000); // Process one frame per second
+            connectSocket();
         }
     } catch (err) {
         console.error('Error accessing camera:', err);
@@ -106,6 +114,17 @@ function stopStreaming() {
         clearInterval(streamInterval);
         streamInterval = null;
     }
+    if (nextFrameTimer) {
+        clearTimeout(nextFrameTimer);
+        nextFrameTimer = null;
+    }
+    isStreaming = false;
+    if (socket) {
+        socket.close();
+        socket = null;
+    }
+    socketReady = false;
+    inFlight = null;
     
     // Stop the video tracks
     if (stream) {
@@ -128,7 +147,138 @@ function stopStreaming() {
 }
 
 /**
- * Process a video frame for trash detection
+ * Size the capture canvas to the video, scaled down so that its long side is at most
+ * the model input size: larger frames would only be downscaled again by the server.
+ */
+function resizeCaptureCanvas() {
+    if (!canvasElement || !videoElement || !videoElement.videoWidth) return;
+    const width = videoElement.videoWidth;
+    const height = videoElement.videoHeight;
+    const scale = modelInputSize ? Math.min(1, modelInputSize / Math.max(width, height)) : 1;
+    canvasElement.width = Math.round(width * scale);
+    canvasElement.height = Math.round(height * scale);
+}
+
+/**
+ * Open the livestream WebSocket. Frames are sent one at a time: the next frame is
+ * captured when the answer to the previous one has arrived, so the frame rate follows
+ * the round-trip time (capped by the server's max frame rate).
+ */
+function connectSocket() {
+    if (!('WebSocket' in window)) {
+        startHttpFallback();
+        return;
+    }
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    socket = new WebSocket(`${protocol}//${window.location.host}/ws/livestream`);
+    socket.binaryType = 'arraybuffer';
+    socket.addEventListener('message', onSocketMessage);
+    socket.addEventListener('close', () => {
+        const wasReady = socketReady;
+        socket = null;
+        socketReady = false;
+        inFlight = null;
+        if (!isStreaming) return;
+        if (wasReady) {
+            setTimeout(() => { if (isStreaming && !socket) connectSocket(); }, 1000); // Reconnect
+        } else {
+            startHttpFallback(); // Server without WebSocket support
+        }
+    });
+}
+
+/**
+ * Fall back to uploading one frame per second over HTTP
+ */
+function startHttpFallback() {
+    console.warn('WebSocket not available, sending frames over HTTP instead.');
+    if (!streamInterval) {
+        streamInterval = setInterval(processFrame, 1000);
+    }
+}
+
+function onSocketMessage(event) {
+    const message = JSON.parse(event.data);
+    if (message.type === 'hello') {
+        classNames = message.names;
+        minFrameInterval = 1000 / message.max_fps;
+        modelInputSize = message.imgsz || null;
+        resizeCaptureCanvas();
+        socketReady = true;
+        sendFrame();
+        return;
+    }
+
+    if (inFlight && message.seq === inFlight.seq) {
+        const rtt = performance.now() - inFlight.sentAt;
+        rttEstimate = rttEstimate === null ? rtt : 0.8 * rttEstimate + 0.2 * rtt;
+        inFlight = null;
+        scheduleNextFrame();
+    }
+
+    if (message.type === 'detections') {
+        updateResults(message.boxes.map(([x, y, width, height, confidence, classId]) => ({
+            trash_type: classNames[classId] || `Class_${classId}`,
+            confidence: confidence,
+            bbox: { x, y, width, height }
+        })));
+        updateStreamStats(message.server_ms);
+    } else if (message.type === 'error') {
+        console.error('Error processing frame:', message.error);
+    }
+}
+
+function scheduleNextFrame() {
+    if (nextFrameTimer) clearTimeout(nextFrameTimer);
+    const interval = Math.max(minFrameInterval, rttEstimate || 0);
+    const elapsed = performance.now() - lastFrameSentAt;
+    nextFrameTimer = setTimeout(sendFrame, Math.max(0, interval - elapsed));
+}
+
+/**
+ * Capture the current video frame and send it over the WebSocket as
+ * [4-byte sequence number][JPEG bytes]
+ */
+function sendFrame() {
+    nextFrameTimer = null;
+    if (!isStreaming || !socketReady || inFlight || !videoElement || !canvasElement || !canvasContext) return;
+
+    canvasContext.drawImage(videoElement, 0, 0, canvasElement.width, canvasElement.height);
+    const seq = frameSeq = (frameSeq + 1) >>> 0;
+    inFlight = { seq, sentAt: performance.now() };
+    lastFrameSentAt = inFlight.sentAt;
+
+    canvasElement.toBlob(async (blob) => {
+        if (!blob || !socket || socket.readyState !== WebSocket.OPEN) {
+            inFlight = null;
+            scheduleNextFrame(); // e.g. the video size isn't known yet
+            return;
+        }
+        const jpeg = new Uint8Array(await blob.arrayBuffer());
+        const message = new Uint8Array(4 + jpeg.byteLength);
+        new DataView(message.buffer).setUint32(0, seq);
+        message.set(jpeg, 4);
+        socket.send(message);
+    }, 'image/jpeg', 0.8);
+
+    // A frame that never gets an answer must not stall the stream
+    setTimeout(() => {
+        if (inFlight && inFlight.seq === seq) {
+            inFlight = null;
+            sendFrame();
+        }
+    }, FRAME_TIMEOUT_MS);
+}
+
+function updateStreamStats(serverMs) {
+    const statsElement = document.getElementById('stream-stats');
+    if (!statsElement || rttEstimate === null) return;
+    const fps = 1000 / Math.max(minFrameInterval, rttEstimate);
+    statsElement.textContent = `${fps.toFixed(1)} fps · round trip ${Math.round(rttEstimate)} ms · server ${Math.round(serverMs)} ms`;
+}
+
+/**
+ * Process a video frame for trash detection (HTTP fallback)
  */
 function processFrame() {
     if (!isStreaming || !videoElement || !canvasElement || !canvasContext) return;
@@ -234,12 +384,21 @@ function drawLiveDetectionBoxes(results, videoElement, canvasOverlay) {
     
     // Clear previous drawings
     ctx.clearRect(0, 0, canvasOverlay.width, canvasOverlay.height);
+
+    // Boxes are in capture canvas coordinates, which may be smaller than the video
+    const scaleX = canvasElement && canvasElement.width ? canvasOverlay.width / canvasElement.width : 1;
+    const scaleY = canvasElement && canvasElement.height ? canvasOverlay.height / canvasElement.height : 1;
     
     // Draw each bounding box
     results.forEach(result => {
         if (!result.bbox) return;
         
-        const bbox = result.bbox;
+        const bbox = {
+            x: result.bbox.x * scaleX,
+            y: result.bbox.y * scaleY,
+            width: result.bbox.width * scaleX,
+            height: result.bbox.height * scaleY
+        };
         const confidence = (result.confidence * 100).toFixed(1);
         
         // Draw bounding box
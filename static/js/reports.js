@@ -0,0 +1,133 @@
+/**
+ * JavaScript for the reports page: the detection table is loaded page by page
+ * from /detections (keyset pagination, see list_detections in routes.py)
+ */
+
+const DETECTIONS_PAGE_SIZE = 50;
+let detectionsUrl = null;
+let nextCursor = null;
+let loadingDetections = false;
+let detectionsRequest = 0; // Incremented when the filters change, so stale pages are ignored
+
+function initReportsPage() {
+    const tableBody = document.getElementById('detections-table-body');
+    if (!tableBody) return; // No detections yet
+
+    detectionsUrl = tableBody.dataset.url;
+    const filters = document.getElementById('detection-filters');
+    const loadMoreButton = document.getElementById('load-more-detections');
+
+    filters.addEventListener('change', () => reloadDetections());
+    filters.addEventListener('submit', (e) => {
+        e.preventDefault();
+        reloadDetections();
+    });
+    loadMoreButton.addEventListener('click', () => loadDetectionsPage());
+
+    // Load the next page when the button scrolls into view
+    if ('IntersectionObserver' in window) {
+        new IntersectionObserver((entries) => {
+            if (entries.some(entry => entry.isIntersecting) && nextCursor) {
+                loadDetectionsPage();
+            }
+        }, { rootMargin: '200px' }).observe(loadMoreButton);
+    }
+
+    reloadDetections();
+}
+
+/**
+ * Clear the table and load the first page for the current filters
+ */
+function reloadDetections() {
+    detectionsRequest++;
+    nextCursor = null;
+    loadingDetections = false;
+    document.getElementById('detections-table-body').innerHTML = '';
+    loadDetectionsPage(true);
+}
+
+/**
+ * Fetch the next page of detections and append it to the table
+ * @param {boolean} firstPage - Load the first page instead of the one after nextCursor
+ */
+async function loadDetectionsPage(firstPage = false) {
+    if (loadingDetections || (!firstPage && !nextCursor)) return;
+    loadingDetections = true;
+    const request = detectionsRequest;
+
+    const params = new URLSearchParams({ limit: DETECTIONS_PAGE_SIZE });
+    const trashType = document.getElementById('filter-trash-type').value;
+    const start = document.getElementById('filter-start').value;
+    const end = document.getElementById('filter-end').value;
+    const minConfidence = document.getElementById('filter-min-confidence').value;
+    if (trashType) params.set('trash_type', trashType);
+    if (start) params.set('start', start);
+    if (end) params.set('end', end);
+    if (minConfidence) params.set('min_confidence', minConfidence / 100);
+    if (!firstPage) params.set('cursor', nextCursor);
+
+    const status = document.getElementById('detections-status');
+    const loadMoreButton = document.getElementById('load-more-detections');
+    status.textContent = 'Loading...';
+
+    try {
+        const response = await fetch(`${detectionsUrl}?${params}`);
+        const data = await response.json();
+        if (request !== detectionsRequest) return; // Filters changed meanwhile
+        if (!data.success) {
+            status.textContent = data.message || 'Could not load detections.';
+            return;
+        }
+
+        const tableBody = document.getElementById('detections-table-body');
+        tableBody.insertAdjacentHTML('beforeend', data.detections.map(renderDetectionRow).join(''));
+        nextCursor = data.next_cursor;
+        loadMoreButton.style.display = nextCursor ? 'inline-block' : 'none';
+        status.textContent = tableBody.children.length ? '' : 'No detections match these filters.';
+    } catch (err) {
+        console.error('Error loading detections:', err);
+        if (request === detectionsRequest) status.textContent = 'Could not load detections.';
+    } finally {
+        if (request === detectionsRequest) loadingDetections = false;
+    }
+}
+
+/**
+ * Table row of one detection. Rows show the upload's thumbnail (or video poster) and
+ * link to the full file, so long tables don't download every upload or create a video
+ * player per row. Uploads without a thumbnail fall back to the image itself or a link.
+ */
+function renderDetectionRow(detection) {
+    const extension = detection.image_path.split('.').pop().toLowerCase();
+    const mediaUrl = escapeHtml(detection.media_url);
+    const isImage = ['jpg', 'jpeg', 'png', 'gif'].includes(extension);
+    const isVideo = ['mp4', 'avi', 'mov', 'webm'].includes(extension);
+    let media;
+    if (detection.thumbnail_url && (isImage || isVideo)) {
+        const thumbnail = `<img src="${escapeHtml(detection.thumbnail_url)}" alt="${isVideo ? 'Video' : 'Detection Image'}" class="img-thumbnail" width="100" loading="lazy">`;
+        media = `<a href="${mediaUrl}" target="_blank" rel="noopener">${thumbnail}${isVideo ? '<i class="fas fa-video ms-1"></i>' : ''}</a>`;
+    } else if (isImage) {
+        media = `<img src="${mediaUrl}" alt="Detection Image" class="img-thumbnail" width="100" loading="lazy">`;
+    } else if (isVideo) {
+        media = `<a href="${mediaUrl}" target="_blank" rel="noopener"><i class="fas fa-video me-1"></i>Video</a>`;
+    } else {
+        media = `<span class="text-muted">[Media: ${escapeHtml(detection.image_path)}]</span>`;
+    }
+    // detection_date is 'YYYY-MM-DD HH:MM:SS'; shown as stored, like the server-rendered pages
+    const date = new Date(detection.detection_date.replace(' ', 'T'));
+    return `
+        <tr>
+            <td>${media}</td>
+            <td>${escapeHtml(detection.trash_type)}</td>
+            <td>${(detection.confidence * 100).toFixed(1)}%</td>
+            <td>${formatDate(date)}</td>
+            <td>${formatTime(date)}</td>
+        </tr>`;
+}
+
+function escapeHtml(value) {
+    const element = document.createElement('div');
+    element.textContent = value;
+    return element.innerHTML.replace(/"/g, '&quot;');
+}
@@ -74,11 +74,15 @@ function initUploadPage() {
             
             // Replace traditional form submission with fetch API
             try {
-                const response = await fetch(uploadForm.action, { // Assumes uploadForm.action is the correct endpoint
-                    method: 'POST',
-                    body: formData
-                    // 'Content-Type': 'multipart/form-data' is automatically set by browser with boundary for FormData
-                });
+                // Files larger than one chunk are sent in parallel chunks and can be resumed
+                const chunkSize = Number(uploadForm.dataset.chunkSize);
+                const response = uploadForm.dataset.chunkedUrl && file.size > chunkSize
+                    ? await uploadInChunks(file, uploadForm, resultsArea)
+                    : await fetch(uploadForm.action, { // Assumes uploadForm.action is the correct endpoint
+                        method: 'POST',
+                        body: formData
+                        // 'Content-Type': 'multipart/form-data' is automatically set by browser with boundary for FormData
+                    });
 
                 hideSpinner(resultsArea); // Hide spinner once response is received
 
@@ -105,7 +109,14 @@ function initUploadPage() {
                 if (contentType && contentType.indexOf("application/json") !== -1) {
                     const data = await response.json(); // This should now be safer
 
-                    if (data.success && (data.processed_video_url || data.image_url || data.message)) {
+                    if (data.success && data.job_id) {
+                        // Videos are processed in the background; poll the job until it's done
+                        if (data.events_url && window.EventSource) {
+                            followVideoJob(data, resultsArea);
+                        } else {
+                            pollVideoJob(data.status_url, resultsArea, data.poster_url);
+                        }
+                    } else if (data.success && (data.processed_video_url || data.image_url || data.message)) {
                         // If success and we have a media URL or at least a message, display results/info
                         displayProcessedVideoAndResults(data, resultsArea);
                     } else if (data.success) { // Success but no specific media URL or message in expected fields
@@ -136,6 +147,325 @@ function initUploadPage() {
     }
 }
 
+const UPLOAD_PARALLEL_CHUNKS = 3; // Chunks in flight at once
+const UPLOAD_CHUNK_ATTEMPTS = 4;
+
+/**
+ * Upload a file in chunks (see chunked_upload.py) and finish it with the form's options.
+ * The upload id is kept in localStorage, so submitting the same file again after an
+ * interruption only sends the chunks the server doesn't have yet.
+ * @param {File} file - File to upload
+ * @param {HTMLFormElement} uploadForm - Upload form (video options and CSRF token)
+ * @param {HTMLElement} resultsArea - Container for the upload progress
+ * @returns {Promise<Response>} Response of the completing request, like that of /upload
+ */
+async function uploadInChunks(file, uploadForm, resultsArea) {
+    const sessionsUrl = uploadForm.dataset.chunkedUrl;
+    const storageKey = `chunked-upload:${file.name}:${file.size}:${file.lastModified}`;
+
+    let upload = null;
+    const savedUploadId = localStorage.getItem(storageKey);
+    if (savedUploadId) {
+        const response = await fetch(`${sessionsUrl}/${savedUploadId}`);
+        if (response.ok) upload = await response.json(); // Otherwise expired; start over
+    }
+    if (!upload) {
+        const response = await fetch(sessionsUrl, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size })
+        });
+        upload = await response.json();
+        if (!response.ok || !upload.success) {
+            throw new Error(upload.message || `Could not start the upload (${response.status}).`);
+        }
+        localStorage.setItem(storageKey, upload.upload_id);
+    }
+
+    const uploadUrl = `${sessionsUrl}/${upload.upload_id}`;
+    const received = new Set(upload.received);
+    const pending = [];
+    for (let index = 0; index < upload.chunk_count; index++) {
+        if (!received.has(index)) pending.push(index);
+    }
+    let done = received.size;
+    resultsArea.innerHTML = renderUploadProgress(done, upload.chunk_count);
+
+    const sendPending = async () => {
+        while (pending.length) {
+            await sendChunk(uploadUrl, file, upload.chunk_size, pending.shift());
+            done++;
+            resultsArea.innerHTML = renderUploadProgress(done, upload.chunk_count);
+        }
+    };
+    await Promise.all(Array.from({ length: UPLOAD_PARALLEL_CHUNKS }, sendPending));
+
+    showSpinner(resultsArea);
+    const formData = new FormData(uploadForm);
+    formData.delete('file');
+    const response = await fetch(`${uploadUrl}/complete`, { method: 'POST', body: formData });
+    if (response.ok || response.status === 404) localStorage.removeItem(storageKey);
+    return response;
+}
+
+/**
+ * Send one chunk with its SHA-256 (where the browser can compute it), retrying
+ * network errors, server errors and checksum mismatches
+ */
+async function sendChunk(uploadUrl, file, chunkSize, index) {
+    const chunk = file.slice(index * chunkSize, Math.min((index + 1) * chunkSize, file.size));
+    const headers = { 'Content-Type': 'application/octet-stream' };
+    if (window.crypto && crypto.subtle) { // Only available on HTTPS and localhost
+        const digest = await crypto.subtle.digest('SHA-256', await chunk.arrayBuffer());
+        headers['X-Chunk-SHA256'] = Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    for (let attempt = 1; ; attempt++) {
+        let response = null;
+        try {
+            response = await fetch(`${uploadUrl}/chunks/${index}`, { method: 'PUT', headers, body: chunk });
+            if (response.ok) return;
+        } catch (error) {
+            if (attempt >= UPLOAD_CHUNK_ATTEMPTS) throw error;
+        }
+        if (response) {
+            const retryable = response.status >= 500 || response.status === 422;
+            if (!retryable || attempt >= UPLOAD_CHUNK_ATTEMPTS) {
+                const data = await response.json().catch(() => ({}));
+                throw new Error(data.message || `Uploading part ${index + 1} failed (${response.status}).`);
+            }
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+    }
+}
+
+/**
+ * Build the progress display of a chunked upload
+ * @returns {string} HTML
+ */
+function renderUploadProgress(done, total) {
+    const percent = total ? Math.round(done / total * 100) : 0;
+    return `
+        <p class="mb-2">Uploading: part ${done} of ${total}</p>
+        <div class="progress">
+            <div class="progress-bar" role="progressbar" style="width: ${percent}%; background-color: var(--primary-color)"
+                aria-valuenow="${percent}" aria-valuemin="0" aria-valuemax="100">${percent}%</div>
+        </div>
+    `;
+}
+
+/**
+ * Follow a background video job through its event stream (/jobs/<id>/events), showing
+ * progress and the detections found so far; falls back to polling if the stream fails
+ * @param {object} upload - Response of the upload (job_id, events_url, status_url, poster_url)
+ * @param {HTMLElement} resultsArea - Container for progress and results
+ */
+function followVideoJob(upload, resultsArea) {
+    const source = new EventSource(upload.events_url);
+    let progress = { state: 'queued', frames_done: 0, frames_total: 0 };
+    let classNames = {};
+    const foundCounts = {}; // Detections per trash type in the frames processed so far
+    let objectsTracked = 0;
+    let finished = false;
+
+    const render = () => {
+        resultsArea.innerHTML = renderJobProgress(progress) + renderLiveDetections(foundCounts, objectsTracked);
+    };
+
+    source.addEventListener('started', (e) => {
+        classNames = JSON.parse(e.data).class_names || {};
+        progress = { ...progress, state: 'running' };
+        render();
+    });
+    source.addEventListener('progress', (e) => {
+        progress = { state: 'running', ...JSON.parse(e.data) };
+        render();
+    });
+    source.addEventListener('detections', (e) => {
+        const segment = JSON.parse(e.data);
+        segment.frames.forEach(([, , rows]) => rows.forEach(row => {
+            const name = classNames[row[5]] || `Class_${row[5]}`;
+            foundCounts[name] = (foundCounts[name] || 0) + 1;
+        }));
+        objectsTracked += segment.objects.length;
+        render();
+    });
+    source.addEventListener('finished', (e) => {
+        finished = true;
+        source.close();
+        displayProcessedVideoAndResults({ success: true, poster_url: upload.poster_url, ...JSON.parse(e.data) }, resultsArea);
+    });
+    source.addEventListener('playable', (e) => {
+        // HLS output: the segments written so far can be played while processing continues
+        showProcessedVideo({ poster_url: upload.poster_url, ...JSON.parse(e.data) });
+    });
+    source.addEventListener('failed', (e) => {
+        finished = true;
+        source.close();
+        showError(`Video processing failed: ${JSON.parse(e.data).error || 'unknown error'}`);
+        resultsArea.innerHTML = '<p class="text-danger">Video processing failed on the server.</p>';
+    });
+    source.onerror = () => {
+        // EventSource reconnects by itself while the server is reachable; give up on the
+        // stream only if it was closed for good (e.g. the job is no longer known)
+        if (!finished && source.readyState === EventSource.CLOSED) {
+            pollVideoJob(upload.status_url, resultsArea, upload.poster_url);
+        }
+    };
+    render();
+}
+
+/**
+ * Build the list of detections found so far in a video that is being processed
+ * @param {object} counts - Detections per trash type (box count over all frames)
+ * @param {number} objectsTracked - Objects whose tracks have ended
+ * @returns {string} HTML
+ */
+function renderLiveDetections(counts, objectsTracked) {
+    const types = Object.keys(counts).sort((a, b) => counts[b] - counts[a]);
+    if (!types.length) return '';
+    const items = types.map(type =>
+        `<li class="list-group-item d-flex justify-content-between"><span>${type}</span><span class="badge bg-secondary rounded-pill">${counts[type]}</span></li>`
+    ).join('');
+    return `
+        <p class="mt-3 mb-1">Found so far (boxes over all frames; ${objectsTracked} object(s) tracked):</p>
+        <ul class="list-group list-group-flush">${items}</ul>
+    `;
+}
+
+/**
+ * Poll a background video job until it finishes, showing progress in the results area
+ * @param {string} statusUrl - URL of the job status endpoint (/jobs/<id>)
+ * @param {HTMLElement} resultsArea - Container for progress and results
+ * @param {string} [posterUrl] - Poster frame of the uploaded video, shown on the processed video
+ */
+async function pollVideoJob(statusUrl, resultsArea, posterUrl = null) {
+    const pollIntervalMs = 2000;
+
+    while (true) {
+        let job;
+        try {
+            const response = await fetch(statusUrl);
+            job = await response.json();
+            if (!response.ok || !job.success) {
+                showError(job.message || `Could not get job status (${response.status}).`);
+                resultsArea.innerHTML = '<p class="text-danger">Lost track of the video processing job.</p>';
+                return;
+            }
+        } catch (error) {
+            console.error('Error polling video job:', error);
+            showError('Could not reach the server to check on video processing.');
+            return;
+        }
+
+        if (job.state === 'finished') {
+            displayProcessedVideoAndResults({ success: true, poster_url: posterUrl, ...job }, resultsArea);
+            return;
+        }
+        if (job.state === 'failed') {
+            showError(`Video processing failed: ${job.error || 'unknown error'}`);
+            resultsArea.innerHTML = '<p class="text-danger">Video processing failed on the server.</p>';
+            return;
+        }
+
+        if (job.playable) showProcessedVideo({ poster_url: posterUrl, ...job });
+        resultsArea.innerHTML = renderJobProgress(job);
+        await new Promise(resolve => setTimeout(resolve, pollIntervalMs));
+    }
+}
+
+/**
+ * Build the progress display for a queued or running video job
+ * @param {object} job - Job status as returned by /jobs/<id>
+ * @returns {string} HTML
+ */
+function renderJobProgress(job) {
+    if (job.state === 'queued') {
+        return '<div class="spinner-container"><div class="spinner"></div><p class="mt-3">Video queued for processing...</p></div>';
+    }
+    const percent = job.frames_total ? Math.min(100, Math.round(job.frames_done / job.frames_total * 100)) : 0;
+    const eta = job.eta_seconds !== null && job.eta_seconds !== undefined ? ` &middot; about ${Math.ceil(job.eta_seconds)}s left` : '';
+    return `
+        <p class="mb-2">Processing video: frame ${job.frames_done} of ${job.frames_total || '?'}${eta}</p>
+        <div class="progress">
+            <div class="progress-bar" role="progressbar" style="width: ${percent}%; background-color: var(--primary-color)"
+                aria-valuenow="${percent}" aria-valuemin="0" aria-valuemax="100">${percent}%</div>
+        </div>
+    `;
+}
+
+const HLS_MIME_TYPE = 'application/vnd.apple.mpegurl';
+const HLS_JS_URL = 'https://cdn.jsdelivr.net/npm/hls.js@1';
+
+/**
+ * Show the processed video in the media preview, unless it is already shown there
+ * @param {object} data - processed_video_url, processed_video_type and poster_url
+ * @returns {HTMLVideoElement}
+ */
+function showProcessedVideo(data) {
+    const mediaPreviewContainer = document.getElementById('media-preview-server');
+    const current = mediaPreviewContainer.querySelector('video');
+    if (current && current.dataset.src === data.processed_video_url) return current;
+
+    mediaPreviewContainer.innerHTML = '';
+    const videoElement = document.createElement('video');
+    videoElement.controls = true;
+    videoElement.dataset.src = data.processed_video_url;
+    if (data.poster_url) videoElement.poster = data.poster_url;
+    videoElement.style.maxWidth = '100%';
+    videoElement.style.display = 'block';
+    attachVideoSource(videoElement, data.processed_video_url, data.processed_video_type || 'video/mp4');
+    mediaPreviewContainer.appendChild(videoElement);
+    return videoElement;
+}
+
+/**
+ * Set the source of a video element. HLS playlists are played natively where the browser
+ * supports them (Safari) and with hls.js (loaded on first use) elsewhere.
+ * @param {HTMLVideoElement} videoElement
+ * @param {string} url - Video file or HLS playlist
+ * @param {string} type - MIME type of the video
+ */
+async function attachVideoSource(videoElement, url, type) {
+    if (type === HLS_MIME_TYPE && !videoElement.canPlayType(HLS_MIME_TYPE)) {
+        try {
+            await loadHlsJs();
+            if (window.Hls.isSupported()) {
+                // The playlist may still be growing; start at its beginning, not its live edge
+                const hls = new window.Hls({ startPosition: 0 });
+                hls.loadSource(url);
+                hls.attachMedia(videoElement);
+                return;
+            }
+        } catch (error) {
+            console.error('Could not load hls.js:', error);
+        }
+    }
+    const sourceElement = document.createElement('source');
+    sourceElement.src = url;
+    sourceElement.type = type;
+    videoElement.appendChild(sourceElement);
+    videoElement.appendChild(document.createTextNode('Your browser does not support the video tag.'));
+}
+
+let hlsJsLoading = null;
+
+function loadHlsJs() {
+    if (!hlsJsLoading) {
+        hlsJsLoading = new Promise((resolve, reject) => {
+            const script = document.createElement('script');
+            script.src = HLS_JS_URL;
+            script.onload = resolve;
+            script.onerror = () => {
+                hlsJsLoading = null;
+                reject(new Error(`Could not load ${HLS_JS_URL}`));
+            };
+            document.head.appendChild(script);
+        });
+    }
+    return hlsJsLoading;
+}
+
 /**
  * Prevent default drag and drop behavior
  */
@@ -229,25 +559,13 @@ function displayProcessedVideoAndResults(data, resultsContainerElement) { // res
         return;
     }
 
-    // Clear both containers
-    mediaPreviewContainer.innerHTML = '';
+    // Clear both containers (a player started while the video was processed keeps playing)
+    if (!data.processed_video_url) mediaPreviewContainer.innerHTML = '';
     resultsContainerElement.innerHTML = '';
 
     if (data.processed_video_url) {
         // Handle processed video
-        const videoElement = document.createElement('video');
-        videoElement.controls = true;
-        videoElement.style.maxWidth = '100%';
-        videoElement.style.display = 'block';
-        // videoElement.style.marginBottom = '20px'; // Parent div 'media-preview-server' has mb-3
-        
-        const sourceElement = document.createElement('source');
-        sourceElement.src = data.processed_video_url;
-        sourceElement.type = data.processed_video_type || 'video/mp4';
-        videoElement.appendChild(sourceElement);
-        videoElement.appendChild(document.createTextNode('Your browser does not support the video tag.'));
-        
-        mediaPreviewContainer.appendChild(videoElement); // VIDEO GOES INTO MEDIA PREVIEW
+        showProcessedVideo(data); // VIDEO GOES INTO MEDIA PREVIEW
 
         // Message and detection list (if any) go into resultsContainerElement
         const videoResultsTitle = document.createElement('h4');
@@ -0,0 +1,137 @@
+"""
+Thumbnails and video poster frames of uploads.
+
+When a file is uploaded, a small thumbnail (THUMBNAIL_SIZE px on the long side, in
+THUMBNAIL_FORMAT) is written next to it, and for videos also a full-size JPEG poster
+frame. The reports table and the /detections API show the thumbnails, so browsers
+don't download full uploads or video headers for every row.
+
+Derived files are named after the upload, e.g. for 'uploads/<uuid>_clip.mp4':
+'uploads/<uuid>_clip.poster.jpg' and 'uploads/<uuid>_clip.thumb.webp'. Generation is
+idempotent: a file is only (re)written if it is missing or older than the upload, so
+`flask generate-thumbnails` can backfill existing uploads at any time.
+"""
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov')
+
+_THUMBNAIL_SUFFIX = '.thumb'
+_POSTER_SUFFIX = '.poster'
+_FORMAT_EXTENSIONS = {'webp': '.webp', 'jpeg': '.jpg'}
+THUMBNAIL_FORMATS = tuple(_FORMAT_EXTENSIONS) # Values of THUMBNAIL_FORMAT
+
+# The poster is taken this far into the video (or at a tenth of it, if shorter), as the
+# first frames are often black or a fade-in
+POSTER_OFFSET_SECONDS = 1.0
+
+
+def thumbnail_path(media_path, thumbnail_format):
+    """Path of the thumbnail of an upload (relative or absolute, like `media_path`)."""
+    return os.path.splitext(media_path)[0] + _THUMBNAIL_SUFFIX + _FORMAT_EXTENSIONS[thumbnail_format]
+
+def poster_path(media_path):
+    """Path of the poster frame of a video upload."""
+    return os.path.splitext(media_path)[0] + _POSTER_SUFFIX + '.jpg'
+
+def is_derived_file(filename):
+    """Whether a file in the upload folder is a thumbnail or poster rather than an upload."""
+    stem = os.path.splitext(filename)[0]
+    return stem.endswith(_THUMBNAIL_SUFFIX) or stem.endswith(_POSTER_SUFFIX)
+
+def _is_current(derived_path, source_path):
+    try:
+        return os.path.getmtime(derived_path) >= os.path.getmtime(source_path)
+    except OSError:
+        return False
+
+def _save_atomic(image, path, image_format, quality):
+    # Written under a temporary name and renamed, so a half-written file is never served
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    image.save(temp_path, format=image_format.upper(), quality=quality)
+    os.replace(temp_path, path)
+
+
+def generate_thumbnails(media_path, size, thumbnail_format='webp', quality=80, image=None, force=False):
+    """
+    Writes the thumbnail (and for videos the poster frame) of an upload, unless they
+    are already up to date.
+
+    Args:
+        media_path: Absolute path of the uploaded image or video
+        size: Maximum width/height of the thumbnail in pixels
+        thumbnail_format: 'webp' or 'jpeg'
+        quality: Encoder quality (1-100)
+        image: The upload as an already opened PIL image, to avoid decoding it again
+        force: Rewrite the files even if they are up to date
+
+    Returns:
+        Dictionary with the absolute 'thumbnail' and (for videos) 'poster' paths, or
+        None if the file is not a supported image/video or could not be read
+    """
+    from PIL import Image
+
+    extension = os.path.splitext(media_path)[1].lower()
+    if extension not in IMAGE_EXTENSIONS + VIDEO_EXTENSIONS:
+        return None
+    paths = {'thumbnail': thumbnail_path(media_path, thumbnail_format)}
+    if extension in VIDEO_EXTENSIONS:
+        paths['poster'] = poster_path(media_path)
+    if not force and all(_is_current(path, media_path) for path in paths.values()):
+        return paths
+
+    try:
+        if extension in VIDEO_EXTENSIONS:
+            image = _read_poster_frame(media_path)
+            if image is None:
+                logger.warning(f"Could not read a frame for the poster of: {media_path}")
+                return None
+            _save_atomic(image, paths['poster'], 'jpeg', quality)
+        elif image is None:
+            image = Image.open(media_path)
+            image.draft('RGB', (size, size)) # JPEGs are decoded at a reduced scale
+            image = image.convert('RGB')
+        else:
+            image = image.copy() # Don't shrink the caller's image
+        image.thumbnail((size, size), Image.BILINEAR, reducing_gap=2.0)
+        _save_atomic(image, paths['thumbnail'], thumbnail_format, quality)
+    except OSError as e:
+        logger.warning(f"Could not generate thumbnails for {media_path}: {e}")
+        return None
+    return paths
+
+def _read_poster_frame(video_path):
+    """Poster frame of a video as a PIL image, or None."""
+    import cv2 # Imported on first use to keep app startup fast
+    from PIL import Image
+
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            return None
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        poster_frame = int(min(fps * POSTER_OFFSET_SECONDS, frame_count / 10))
+        if poster_frame > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, poster_frame)
+        ok, frame = cap.read()
+        if not ok and poster_frame > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0) # Seeking is unreliable in some containers
+            ok, frame = cap.read()
+        if not ok:
+            return None
+        return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    finally:
+        cap.release()
+
+
+def generate_upload_thumbnails(config, media_path, image=None):
+    """generate_thumbnails() with the app's THUMBNAIL_* settings; returns None if thumbnails are disabled."""
+    if config['THUMBNAIL_SIZE'] <= 0:
+        return None
+    return generate_thumbnails(media_path, config['THUMBNAIL_SIZE'], config['THUMBNAIL_FORMAT'],
+                               config['THUMBNAIL_QUALITY'], image=image)
@@ -0,0 +1,180 @@
+import numpy as np
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """
+    Pairwise IoU of two sets of xyxy boxes.
+
+    Args:
+        boxes_a: Array of shape (N, 4)
+        boxes_b: Array of shape (M, 4)
+
+    Returns:
+        Array of shape (N, M)
+    """
+    if not len(boxes_a) or not len(boxes_b):
+        return np.zeros((len(boxes_a), len(boxes_b)), np.float32)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    area_a = (boxes_a[:, 2:] - boxes_a[:, :2]).clip(0).prod(axis=1)
+    area_b = (boxes_b[:, 2:] - boxes_b[:, :2]).clip(0).prod(axis=1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0).astype(np.float32)
+
+
+def greedy_match(boxes_a, cls_a, boxes_b, cls_b, iou_threshold):
+    """
+    Matches two sets of xyxy boxes one-to-one, greedily by IoU (best first), only
+    pairing boxes of the same class and with an IoU of at least `iou_threshold`.
+
+    Returns:
+        Tuple (pairs, ious): list of (index in a, index in b) and their IoUs
+    """
+    ious = iou_matrix(boxes_a, boxes_b)
+    if not ious.size:
+        return [], []
+    ious[cls_a[:, None] != cls_b[None, :]] = 0
+
+    pairs, pair_ious = [], []
+    used_a, used_b = set(), set()
+    for flat_index in np.argsort(-ious, axis=None).tolist():
+        i, j = divmod(flat_index, ious.shape[1])
+        if ious[i, j] < iou_threshold:
+            break
+        if i in used_a or j in used_b:
+            continue
+        used_a.add(i)
+        used_b.add(j)
+        pairs.append((i, j))
+        pair_ious.append(float(ious[i, j]))
+    return pairs, pair_ious
+
+
+class Track:
+    """One tracked object: its current box, motion estimate and the best detection seen."""
+    __slots__ = ('track_id', 'cls', 'xyxy', 'velocity', 'first_frame', 'last_frame',
+                 'hits', 'best_conf', 'best_xyxy')
+
+    def __init__(self, track_id, cls, xyxy, conf, frame_index):
+        self.track_id = track_id
+        self.cls = cls
+        self.xyxy = xyxy
+        self.velocity = np.zeros(4, np.float32)
+        self.first_frame = frame_index
+        self.last_frame = frame_index
+        self.hits = 1
+        self.best_conf = conf
+        self.best_xyxy = xyxy
+
+    def predict(self, frame_index):
+        """Constant-velocity estimate of the box at the given frame."""
+        return self.xyxy + self.velocity * (frame_index - self.last_frame)
+
+    def update(self, frame_index, xyxy, conf):
+        gap = frame_index - self.last_frame
+        if gap > 0:
+            # Smoothed per-frame displacement
+            self.velocity = 0.5 * self.velocity + 0.5 * (xyxy - self.xyxy) / gap
+        self.xyxy = xyxy
+        self.last_frame = frame_index
+        self.hits += 1
+        if conf > self.best_conf:
+            self.best_conf = conf
+            self.best_xyxy = xyxy
+
+    def to_dict(self, names, fps):
+        x1, y1, x2, y2 = self.best_xyxy.tolist()
+        return {
+            "track_id": self.track_id,
+            "trash_type": names.get(self.cls, f"Class_{self.cls}"),
+            "confidence": float(self.best_conf),
+            "bbox": {"x": int(x1), "y": int(y1), "width": int(x2 - x1), "height": int(y2 - y1)},
+            "first_seen": round(self.first_frame / fps, 3),
+            "last_seen": round(self.last_frame / fps, 3),
+        }
+
+
+class IoUTracker:
+    """
+    Small CPU multi-object tracker in the style of ByteTrack.
+
+    Every frame, tracks are matched to detections of the same class by IoU against the
+    track's constant-velocity prediction: first with the high-confidence detections,
+    then the still unmatched tracks with the low-confidence ones (which keeps objects
+    tracked through blur/occlusion without starting tracks from noise). Unmatched
+    high-confidence detections start new tracks. Tracks not seen for `max_age` frames
+    are finished; those seen in at least `min_hits` frames are returned as objects.
+    """
+
+    def __init__(self, iou_threshold=0.3, high_conf=0.5, low_conf=0.1, max_age=30, min_hits=2):
+        self.iou_threshold = iou_threshold
+        self.high_conf = high_conf
+        self.low_conf = low_conf
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self._tracks = []
+        self._next_id = 1
+
+    def update(self, frame_index, detections):
+        """
+        Feeds the DetectionBatch of one frame (frames must be fed in order).
+
+        Returns:
+            List of Track objects that finished with this frame
+        """
+        conf = detections.conf
+        high = np.flatnonzero(conf >= self.high_conf)
+        low = np.flatnonzero((conf >= self.low_conf) & (conf < self.high_conf))
+
+        matched_high = set()
+        if self._tracks:
+            predicted = np.stack([track.predict(frame_index) for track in self._tracks])
+            track_cls = np.array([track.cls for track in self._tracks])
+            unmatched_tracks = list(range(len(self._tracks)))
+
+            unmatched_tracks, matched = self._match(unmatched_tracks, high, predicted, track_cls, detections)
+            self._apply_matches(frame_index, matched, detections)
+            matched_high = {det_index for _, det_index in matched}
+
+            unmatched_tracks, matched = self._match(unmatched_tracks, low, predicted, track_cls, detections)
+            self._apply_matches(frame_index, matched, detections)
+
+        for det_index in high.tolist():
+            if det_index not in matched_high:
+                self._tracks.append(Track(
+                    self._next_id, int(detections.cls[det_index]),
+                    detections.xyxy[det_index], float(conf[det_index]), frame_index))
+                self._next_id += 1
+
+        finished = []
+        active = []
+        for track in self._tracks:
+            if frame_index - track.last_frame > self.max_age:
+                finished.append(track)
+            else:
+                active.append(track)
+        self._tracks = active
+        return [track for track in finished if track.hits >= self.min_hits]
+
+    def finish(self):
+        """Ends all remaining tracks (call at the end of the video)."""
+        finished = [track for track in self._tracks if track.hits >= self.min_hits]
+        self._tracks = []
+        return finished
+
+    def _apply_matches(self, frame_index, matched, detections):
+        for track_index, det_index in matched:
+            self._tracks[track_index].update(
+                frame_index, detections.xyxy[det_index], float(detections.conf[det_index]))
+
+    def _match(self, track_indices, det_indices, predicted, track_cls, detections):
+        if not track_indices or not len(det_indices):
+            return track_indices, []
+        track_indices = np.asarray(track_indices)
+        pairs, _ = greedy_match(predicted[track_indices], track_cls[track_indices],
+                                detections.xyxy[det_indices], detections.cls[det_indices], self.iou_threshold)
+        matched = [(int(track_indices[row]), int(det_indices[col])) for row, col in pairs]
+        used_tracks = {row for row, _ in pairs}
+        remaining = [int(track_index) for row, track_index in enumerate(track_indices) if row not in used_tracks]
+        return remaining, matched
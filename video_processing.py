@@ -0,0 +1,529 @@
+import functools
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import cv2
+import numpy as np
+from frame_sampling import SAMPLING_ALL, KeyframeSelector, interpolate_detections # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# How often (in frames) progress is reported while a video is processed
+PROGRESS_REPORT_INTERVAL = 10
+
+# Output formats of processed videos (VIDEO_OUTPUT_FORMAT). 'mp4' is written with OpenCV's
+# VideoWriter and can only be played once it is complete; 'fmp4' (fragmented MP4) and
+# 'hls' (an HLS playlist of fMP4 segments) are encoded to H.264 by an ffmpeg process that
+# the frames are piped to, and can be played while the video is still being processed.
+OUTPUT_MP4 = 'mp4'
+OUTPUT_FMP4 = 'fmp4'
+OUTPUT_HLS = 'hls'
+OUTPUT_FORMATS = (OUTPUT_MP4, OUTPUT_FMP4, OUTPUT_HLS)
+OUTPUT_MIMETYPES = {
+    OUTPUT_MP4: 'video/mp4',
+    OUTPUT_FMP4: 'video/mp4',
+    OUTPUT_HLS: 'application/vnd.apple.mpegurl',
+}
+HLS_PLAYLIST_NAME = 'index.m3u8'
+
+
+class VideoProcessingError(Exception):
+    """Raised when a video cannot be opened or the output cannot be written."""
+    pass
+
+
+def draw_detections(frame_cv2, frame_detections):
+    """
+    Draws bounding boxes and labels for the given DetectionBatch onto a BGR frame (in place).
+    """
+    color = (0, 255, 0)
+    for trash_type, confidence, (x1, y1, x2, y2) in zip(
+            frame_detections.trash_types(), frame_detections.conf.tolist(),
+            frame_detections.xyxy.astype(np.int32).tolist()):
+        label = f"{trash_type}: {confidence:.2f}"
+        cv2.rectangle(frame_cv2, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(frame_cv2, label, (x1, y1 - 10 if y1 - 10 > 10 else y1 + 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+
+def open_video_writer(output_path, fps, frame_size):
+    """
+    Opens a cv2.VideoWriter for an MP4 output file.
+    Uses H.264 (avc1) and falls back to MPEG-4 (mp4v) if avc1 is not available.
+    """
+    # H.264 is highly compatible for web playback.
+    fourcc_h264 = cv2.VideoWriter_fourcc(*'avc1') # Preferred for MP4/H.264
+    fourcc_mp4v = cv2.VideoWriter_fourcc(*'mp4v') # Fallback MPEG-4
+
+    out_writer = cv2.VideoWriter(output_path, fourcc_h264, fps, frame_size)
+
+    if not out_writer.isOpened():
+        logger.warning(f"VideoWriter failed to open with H.264 (avc1) for {output_path}. Trying fallback MPEG-4 (mp4v).")
+        out_writer = cv2.VideoWriter(output_path, fourcc_mp4v, fps, frame_size)
+
+    if not out_writer.isOpened():
+        raise VideoProcessingError(f"Could not open VideoWriter for: {output_path} even with fallback FourCC.")
+    logger.info(f"VideoWriter opened successfully for {output_path}")
+    return out_writer
+
+@functools.lru_cache(maxsize=None)
+def find_ffmpeg(ffmpeg_binary):
+    """Full path of the ffmpeg executable (a name on the PATH or a path), or None if there is none."""
+    return shutil.which(ffmpeg_binary)
+
+def video_encoder_settings(config):
+    """
+    Settings for FFmpegVideoWriter from the app's VIDEO_OUTPUT_FORMAT / VIDEO_ENCODER_* config,
+    as a plain dictionary (it is passed to the video job workers).
+
+    Falls back to the 'mp4' format (OpenCV) if ffmpeg is needed but can't be found.
+    """
+    output_format = config['VIDEO_OUTPUT_FORMAT']
+    if output_format not in OUTPUT_FORMATS:
+        logger.warning(f"Unknown VIDEO_OUTPUT_FORMAT '{output_format}'; using '{OUTPUT_MP4}'.")
+        output_format = OUTPUT_MP4
+    ffmpeg_path = find_ffmpeg(config['FFMPEG_BINARY']) if output_format != OUTPUT_MP4 else None
+    if output_format != OUTPUT_MP4 and ffmpeg_path is None:
+        logger.warning(f"ffmpeg ('{config['FFMPEG_BINARY']}') not found; writing processed videos as '{OUTPUT_MP4}' "
+                       f"instead of '{output_format}'.")
+        output_format = OUTPUT_MP4
+    return {
+        'format': output_format,
+        'ffmpeg': ffmpeg_path,
+        'preset': config['VIDEO_ENCODER_PRESET'],
+        'crf': config['VIDEO_ENCODER_CRF'],
+        'threads': config['VIDEO_ENCODER_THREADS'],
+        'segment_seconds': config['VIDEO_HLS_SEGMENT_SECONDS'],
+    }
+
+def processed_video_name(input_filename_base, output_format):
+    """Path of a processed video relative to PROCESSED_FOLDER; HLS output gets a folder of its own."""
+    if output_format == OUTPUT_HLS:
+        return f"processed_{input_filename_base}/{HLS_PLAYLIST_NAME}"
+    return f"processed_{input_filename_base}.mp4"
+
+class FFmpegVideoWriter:
+    """
+    Writes BGR frames to an ffmpeg process through a pipe, with the write()/release()
+    interface of cv2.VideoWriter.
+
+    ffmpeg encodes H.264 (libx264) with the given preset, CRF and thread count, and
+    writes either a fragmented MP4 or an HLS playlist with fMP4 segments. Keyframes are
+    forced every `segment_seconds`, so fragments and segments are finished at that pace
+    and a player can start while later frames are still being processed.
+    """
+
+    def __init__(self, output_path, fps, frame_size, output_format, ffmpeg, preset='veryfast', crf=23, threads=0,
+                 segment_seconds=2):
+        width, height = frame_size
+        keyframe_interval = max(int(round(fps * segment_seconds)), 1)
+        command = [
+            ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+            '-an', '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', # yuv420p needs even dimensions
+            '-c:v', 'libx264', '-preset', preset, '-crf', str(crf), '-threads', str(threads), '-pix_fmt', 'yuv420p',
+            '-g', str(keyframe_interval), '-keyint_min', str(keyframe_interval), '-sc_threshold', '0',
+        ]
+        if output_format == OUTPUT_HLS:
+            output_dir = os.path.dirname(output_path)
+            os.makedirs(output_dir, exist_ok=True)
+            command += [
+                '-f', 'hls', '-hls_time', str(segment_seconds), '-hls_list_size', '0',
+                '-hls_playlist_type', 'event', # Segments are only ever appended; ENDLIST is written at the end
+                '-hls_segment_type', 'fmp4', '-hls_fmp4_init_filename', 'init.mp4',
+                '-hls_segment_filename', os.path.join(output_dir, 'segment_%05d.m4s'),
+                output_path,
+            ]
+        else:
+            command += ['-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4', output_path]
+
+        self.output_path = output_path
+        self._stderr = tempfile.TemporaryFile() # A file rather than a pipe, so ffmpeg never blocks on it
+        try:
+            self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                             stderr=self._stderr)
+        except OSError as e:
+            self._stderr.close()
+            raise VideoProcessingError(f"Could not start ffmpeg for {output_path}: {e}") from e
+        logger.info(f"ffmpeg writer opened for {output_path} ({output_format}, preset {preset}, CRF {crf})")
+
+    def write(self, frame):
+        try:
+            self._process.stdin.write(np.ascontiguousarray(frame).data)
+        except (BrokenPipeError, ValueError):
+            self._process.wait()
+            raise VideoProcessingError(f"ffmpeg exited while writing {self.output_path}: {self._error_output()}") from None
+
+    def release(self):
+        """Closes the pipe and waits for ffmpeg to finish the file."""
+        if self._process.stdin.closed:
+            return
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self._process.wait()
+        error_output = self._error_output()
+        self._stderr.close()
+        if returncode != 0:
+            raise VideoProcessingError(f"ffmpeg failed with exit code {returncode} for {self.output_path}: {error_output}")
+
+    def _error_output(self):
+        self._stderr.seek(0)
+        return self._stderr.read().decode(errors='replace').strip()[-1000:]
+
+def open_output_writer(output_path, fps, frame_size, encoder=None):
+    """
+    Opens the writer for a processed video: an FFmpegVideoWriter for the 'fmp4' and 'hls'
+    formats of `encoder` (see video_encoder_settings), otherwise open_video_writer().
+    """
+    if encoder is None or encoder['format'] == OUTPUT_MP4:
+        return open_video_writer(output_path, fps, frame_size)
+    return FFmpegVideoWriter(
+        output_path, fps, frame_size, encoder['format'], encoder['ffmpeg'], preset=encoder['preset'],
+        crf=encoder['crf'], threads=encoder['threads'], segment_seconds=encoder['segment_seconds'])
+
+class StageTimings:
+    """
+    Accumulates per-stage timings of the video pipeline.
+
+    'busy' is the time a stage spent doing its own work, 'wait' the time it spent blocked
+    on its input or output queue. The stage with the highest busy time is the bottleneck.
+    """
+
+    def __init__(self, stage_names):
+        self._stats = {name: {"busy": 0.0, "wait": 0.0, "frames": 0} for name in stage_names}
+
+    def add(self, stage, busy=0.0, wait=0.0, frames=0):
+        # Each stage only ever updates its own entry, from its own thread
+        stats = self._stats[stage]
+        stats["busy"] += busy
+        stats["wait"] += wait
+        stats["frames"] += frames
+
+    def report(self):
+        report = {}
+        for name, stats in self._stats.items():
+            report[name] = {
+                "busy_seconds": round(stats["busy"], 3),
+                "wait_seconds": round(stats["wait"], 3),
+                "frames": stats["frames"],
+                "ms_per_frame": round(stats["busy"] * 1000 / stats["frames"], 2) if stats["frames"] else None,
+            }
+        return report
+
+    def bottleneck(self):
+        return max(self._stats, key=lambda name: self._stats[name]["busy"])
+
+
+class _PipelineStopped(Exception):
+    """Internal: raised inside a stage when another stage has failed."""
+    pass
+
+
+class _FrameBudget:
+    """
+    Counts the decoded frames that have not been written yet. The decode stage takes
+    one unit per frame and the encode stage returns them, so the frames held by the
+    queues and by the infer stage never exceed `limit`, however the keyframes fall.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    def try_acquire(self):
+        with self._condition:
+            if self._in_flight >= self.limit:
+                return False
+            self._in_flight += 1
+            return True
+
+    def acquire(self, stop_event):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                if stop_event.is_set():
+                    raise _PipelineStopped()
+                self._condition.wait(0.1)
+            self._in_flight += 1
+
+    def release(self, frames):
+        with self._condition:
+            self._in_flight -= frames
+            self._condition.notify_all()
+
+
+def _queue_put(q, item, stop_event):
+    while True:
+        if stop_event.is_set():
+            raise _PipelineStopped()
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+def _queue_get(q, stop_event):
+    while True:
+        if stop_event.is_set():
+            raise _PipelineStopped()
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+
+def _open_capture(input_path):
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise VideoProcessingError(f"Could not open video file for processing: {input_path}")
+    return cap
+
+def read_video_info(cap):
+    """
+    Reads FPS, frame size and frame count from an opened cv2.VideoCapture.
+    """
+    fps = cap.get(cv2.CAP_PROP_FPS) # Get FPS from original video
+    if fps <= 0 or fps > 120: # Sanity check and default for FPS
+        logger.warning(f"Original video FPS ({fps}) is invalid or out of range. Defaulting to 25 FPS for output.")
+        fps = 25.0
+    return {
+        "fps": fps,
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        "frame_count": max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0), # May be 0 if the container doesn't say
+    }
+
+def probe_video(input_path):
+    """Returns read_video_info() for a video file without processing it."""
+    cap = _open_capture(input_path)
+    try:
+        return read_video_info(cap)
+    finally:
+        cap.release()
+
+def process_video(inference_backend, input_path, output_path, progress_callback=None, batch_size=1, queue_size=4,
+                  detections_callback=None, keyframe_selector=None, encoder=None):
+    """
+    Runs YOLO detection over every frame of a video and writes an annotated video.
+
+    The work is split into four stages joined by bounded queues:
+    decode (cap.read + colour conversion) -> infer -> annotate -> encode (VideoWriter or ffmpeg pipe).
+    Decode, annotate and encode run on their own threads; OpenCV releases the GIL while
+    decoding and encoding, so they overlap with inference, which runs on the calling
+    thread (and so keeps its Flask app context). Frames are grouped into batches of
+    `batch_size` and each batch is passed to the model in a single call. Frames are
+    annotated and written in their original order.
+
+    With a KeyframeSelector only keyframes go through the model; the boxes of the
+    frames skipped in between are interpolated from the surrounding keyframes (the
+    skipped frames are held back until the next keyframe has been inferred). Batches
+    then hold a varying number of frames, so memory is bounded by frame count: at most
+    as many frames as `queue_size` full batches in each of the three queues, plus one
+    keyframe gap, are decoded and not yet written.
+
+    Args:
+        inference_backend: inference.InferenceBackend to run the model with
+        input_path: Absolute path of the uploaded video
+        output_path: Absolute path for the processed (annotated) MP4, or the playlist for HLS
+        progress_callback: Optional callable(frames_done, frames_total), called periodically
+        batch_size: Number of frames per model call (1 = frame by frame)
+        queue_size: Capacity (in batches) of the queues between stages; also sets the frame budget
+        detections_callback: Optional callable(frame_index, DetectionBatch), called from the
+            encode stage for every frame once it has been written
+        keyframe_selector: Optional frame_sampling.KeyframeSelector; None runs the model on every frame
+        encoder: Optional output settings from video_encoder_settings(); None writes an MP4 with OpenCV
+
+    Returns:
+        Dictionary with frame statistics and per-stage timings
+    """
+    batch_size = max(int(batch_size), 1)
+    keyframe_selector = keyframe_selector or KeyframeSelector(SAMPLING_ALL)
+    # A batch holds up to batch_size keyframes plus the frames skipped between them. The budget
+    # must exceed the frames skipped before a keyframe, which the infer stage holds back.
+    max_batch_frames = batch_size * keyframe_selector.max_frames_between_keyframes
+    frame_budget = _FrameBudget(3 * queue_size * batch_size + keyframe_selector.max_frames_between_keyframes)
+    cap = _open_capture(input_path)
+
+    try:
+        video_info = read_video_info(cap)
+        fps = video_info["fps"]
+        frame_width, frame_height = video_info["width"], video_info["height"]
+        frames_total = video_info["frame_count"]
+
+        out_writer = open_output_writer(output_path, fps, (frame_width, frame_height), encoder)
+        timings = StageTimings(["decode", "infer", "annotate", "encode"])
+        decoded_queue = queue.Queue(maxsize=queue_size)
+        inferred_queue = queue.Queue(maxsize=queue_size)
+        annotated_queue = queue.Queue(maxsize=queue_size)
+        stop_event = threading.Event()
+        errors = []
+        frames_written = [0]
+        keyframes_inferred = 0
+        start_time = time.perf_counter()
+
+        def decode_stage():
+            while True:
+                started = time.perf_counter()
+                # batch_rgb holds the converted frame for keyframes and None for skipped frames
+                batch_bgr, batch_rgb = [], []
+                keyframes = 0
+                while keyframes < batch_size and len(batch_bgr) < max_batch_frames:
+                    if not frame_budget.try_acquire():
+                        if batch_bgr:
+                            break # Hand over a partial batch so the later stages can free frames
+                        waited = time.perf_counter()
+                        frame_budget.acquire(stop_event)
+                        timings.add("decode", wait=time.perf_counter() - waited)
+                        started += time.perf_counter() - waited
+                    ret, frame_cv2 = cap.read()
+                    if not ret:
+                        frame_budget.release(1)
+                        break
+                    is_keyframe = keyframe_selector.is_keyframe(frame_cv2)
+                    batch_bgr.append(frame_cv2)
+                    batch_rgb.append(cv2.cvtColor(frame_cv2, cv2.COLOR_BGR2RGB) if is_keyframe else None)
+                    keyframes += is_keyframe
+                timings.add("decode", busy=time.perf_counter() - started, frames=len(batch_bgr))
+                waited = time.perf_counter()
+                _queue_put(decoded_queue, (batch_bgr, batch_rgb) if batch_bgr else None, stop_event)
+                timings.add("decode", wait=time.perf_counter() - waited)
+                if not batch_bgr:
+                    return
+
+        def annotate_stage():
+            while True:
+                waited = time.perf_counter()
+                item = _queue_get(inferred_queue, stop_event)
+                timings.add("annotate", wait=time.perf_counter() - waited)
+                if item is None:
+                    _queue_put(annotated_queue, None, stop_event)
+                    return
+                started = time.perf_counter()
+                batch_bgr, batch_detections = item
+                for frame, frame_detections in zip(batch_bgr, batch_detections):
+                    draw_detections(frame, frame_detections)
+                timings.add("annotate", busy=time.perf_counter() - started, frames=len(batch_bgr))
+                waited = time.perf_counter()
+                _queue_put(annotated_queue, item, stop_event)
+                timings.add("annotate", wait=time.perf_counter() - waited)
+
+        def encode_stage():
+            last_reported = 0
+            while True:
+                waited = time.perf_counter()
+                item = _queue_get(annotated_queue, stop_event)
+                timings.add("encode", wait=time.perf_counter() - waited)
+                if item is None:
+                    return
+                started = time.perf_counter()
+                batch_bgr, batch_detections = item
+                for frame in batch_bgr:
+                    out_writer.write(frame)
+                frame_budget.release(len(batch_bgr))
+                timings.add("encode", busy=time.perf_counter() - started, frames=len(batch_bgr))
+                if detections_callback:
+                    for offset, frame_detections in enumerate(batch_detections):
+                        detections_callback(frames_written[0] + offset, frame_detections)
+                frames_written[0] += len(batch_bgr)
+                if progress_callback and frames_written[0] - last_reported >= PROGRESS_REPORT_INTERVAL:
+                    progress_callback(frames_written[0], max(frames_total, frames_written[0]))
+                    last_reported = frames_written[0]
+
+        def run_stage(stage_fn):
+            try:
+                stage_fn()
+            except _PipelineStopped:
+                pass
+            except Exception as e:
+                errors.append(e)
+                stop_event.set()
+
+        threads = [
+            threading.Thread(target=run_stage, args=(stage_fn,), name=f"video-{stage_fn.__name__}", daemon=True)
+            for stage_fn in (decode_stage, annotate_stage, encode_stage)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            # Infer stage, on the calling thread
+            skipped_bgr = [] # Frames waiting for the next keyframe so their boxes can be interpolated
+            previous_keyframe = None
+            while True:
+                waited = time.perf_counter()
+                item = _queue_get(decoded_queue, stop_event)
+                timings.add("infer", wait=time.perf_counter() - waited)
+                if item is None:
+                    if skipped_bgr:
+                        # No keyframe after the last skipped frames: hold the last keyframe's boxes
+                        _queue_put(inferred_queue, (skipped_bgr, [previous_keyframe] * len(skipped_bgr)), stop_event)
+                    _queue_put(inferred_queue, None, stop_event)
+                    break
+                started = time.perf_counter()
+                batch_bgr, batch_rgb = item
+                key_positions = [i for i, frame_rgb in enumerate(batch_rgb) if frame_rgb is not None]
+                keyframe_detections = {}
+                if key_positions:
+                    # One model call for all keyframes of the batch; results come back in input order
+                    keyframe_detections = dict(zip(
+                        key_positions, inference_backend.predict([batch_rgb[i] for i in key_positions])))
+                    keyframes_inferred += len(key_positions)
+
+                out_bgr, out_detections = [], []
+                for i, frame in enumerate(batch_bgr):
+                    if i not in keyframe_detections:
+                        skipped_bgr.append(frame)
+                        continue
+                    detections = keyframe_detections[i]
+                    gap = len(skipped_bgr) + 1
+                    for k, skipped_frame in enumerate(skipped_bgr, start=1):
+                        out_bgr.append(skipped_frame)
+                        out_detections.append(interpolate_detections(previous_keyframe, detections, k / gap))
+                    skipped_bgr = []
+                    out_bgr.append(frame)
+                    out_detections.append(detections)
+                    previous_keyframe = detections
+                timings.add("infer", busy=time.perf_counter() - started, frames=len(out_bgr))
+                if out_bgr:
+                    waited = time.perf_counter()
+                    _queue_put(inferred_queue, (out_bgr, out_detections), stop_event)
+                    timings.add("infer", wait=time.perf_counter() - waited)
+        except _PipelineStopped:
+            pass
+        except Exception as e:
+            errors.append(e)
+            stop_event.set()
+        finally:
+            for thread in threads:
+                thread.join()
+            try:
+                out_writer.release()
+            except VideoProcessingError as e:
+                errors.append(e) # ffmpeg failed to finish the file
+    finally:
+        cap.release()
+
+    if errors:
+        raise errors[0]
+
+    frames_done = frames_written[0]
+    elapsed = time.perf_counter() - start_time
+    processing_fps = frames_done / elapsed if elapsed > 0 else 0.0
+    stage_timings = timings.report()
+    if progress_callback:
+        progress_callback(frames_done, frames_done)
+    logger.info(f"Processed video saved to: {output_path} ({frames_done} frames, {keyframes_inferred} inferred, "
+                f"sampling '{keyframe_selector.mode}', batch size {batch_size}, {processing_fps:.1f} frames/s)")
+    logger.info(f"Video pipeline stage timings (bottleneck: {timings.bottleneck()}): {stage_timings}")
+    return {
+        "frames_processed": frames_done,
+        "keyframes": keyframes_inferred,
+        "fps": fps,
+        "processing_fps": processing_fps,
+        "stage_timings": stage_timings,
+    }